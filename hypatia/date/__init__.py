@@ -0,0 +1,238 @@
+from datetime import date
+from datetime import datetime
+
+from ..field import FieldIndex
+
+_marker = []
+
+GRANULARITIES = ('year', 'month', 'day')
+
+class DateFieldIndex(FieldIndex):
+    """Date field index.
+
+    A field index for ``datetime.datetime`` (and ``datetime.date``) values,
+    e.g. modification dates.  Query types supported are the same as those of
+    a ``FieldIndex``.
+
+    Besides the forward index, which has a key per distinct datetime, the
+    index keeps coarse postings: the docids of the documents whose values
+    fall in each year, month and day.  A range query is answered by the
+    union of the postings of the coarsest periods which lie wholly inside
+    the range (e.g. whole years, then whole months and days at the edges of
+    the years), refined by the forward index only for the partial days at
+    the ends of the range.  The postings also make date histograms cheap
+    (see ``histogram``).
+
+    ``datetime.date`` values are indexed as datetimes at midnight.  Time
+    zone aware datetimes are indexed (and query values are converted) as
+    naive UTC datetimes, so that all values share the same periods.  Other
+    values raise a ValueError.
+    """
+
+    def reset(self):
+        """Initialize forward, reverse and period mappings."""
+        super(DateFieldIndex, self).reset()
+        # Each period index maps a period number (the year, the number of
+        # months since year 0, or the proleptic Gregorian ordinal of the
+        # day) to the docids of the documents whose values fall in it.
+        self._year_index = self.family.IO.BTree()
+        self._month_index = self.family.IO.BTree()
+        self._day_index = self.family.IO.BTree()
+
+    def discriminate(self, obj, default):
+        """ See interface IIndexInjection """
+        value = super(DateFieldIndex, self).discriminate(obj, default)
+        if value is default:
+            return value
+        if not isinstance(value, date):
+            raise ValueError('%r is not a date or datetime' % (value,))
+        return _normalize(value)
+
+    def _index_value(self, docid, value):
+        rev_index = self._rev_index
+        old = rev_index.get(docid, _marker)
+        super(DateFieldIndex, self)._index_value(docid, value)
+        value = rev_index.get(docid, _marker)
+        # if the value changed, the old one has been unindexed already
+        if value is not _marker and (old is _marker or old != value):
+            for periods, key in self._periods(value):
+                set = periods.get(key)
+                if set is None:
+                    set = self.family.IF.TreeSet()
+                    periods[key] = set
+                set.insert(docid)
+
+    def _insert_values(self, items, groups):
+        super(DateFieldIndex, self)._insert_values(items, groups)
+        # group the new docids by period before updating the postings
+        postings = [{}, {}, {}]
+        for value, docids in groups:
+            periods = self._periods(value)
+            for (ignored, key), docids_by_key in zip(periods, postings):
+                docids_by_key.setdefault(key, []).extend(docids)
+        trees = (self._year_index, self._month_index, self._day_index)
+        for periods, docids_by_key in zip(trees, postings):
+            for key, docids in sorted(docids_by_key.items()):
+                set = periods.get(key)
+                if set is None:
+                    periods[key] = self.family.IF.TreeSet(docids)
+                else:
+                    set.update(docids)
+
+    def unindex_doc(self, docid):
+        """See interface IIndexInjection"""
+        value = self._rev_index.get(docid, _marker)
+        if value is not _marker:
+            for periods, key in self._periods(value):
+                set = periods.get(key)
+                if set is not None:
+                    set.remove(docid)
+                    if not set:
+                        del periods[key]
+        super(DateFieldIndex, self).unindex_doc(docid)
+
+    def _periods(self, value):
+        return (
+            (self._year_index, value.year),
+            (self._month_index, _month_key(value)),
+            (self._day_index, value.toordinal()),
+            )
+
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             raise_unsortable=True, after=None):
+        if after is not None:
+            value, docid = after
+            after = (_normalize(value), docid)
+        return super(DateFieldIndex, self).sort(
+            docids, reverse=reverse, limit=limit, sort_type=sort_type,
+            raise_unsortable=raise_unsortable, after=after)
+
+    def search(self, queries, operator='or'):
+        queries = [_normalize(q) if isinstance(q, date) else q
+                   for q in queries]
+        return super(DateFieldIndex, self).search(queries, operator)
+
+    def applyInRange(self, start, end, excludemin=False, excludemax=False):
+        if start is None:
+            excludemin = False
+        else:
+            start = _normalize(start)
+        if end is None:
+            excludemax = False
+        else:
+            end = _normalize(end)
+        day_index = self._day_index
+        if not day_index:
+            return self.family.IF.TreeSet()
+
+        # the first and last days wholly inside the range
+        if start is None:
+            first = day_index.minKey()
+        else:
+            first = start.toordinal()
+            if excludemin or start != datetime.fromordinal(first):
+                first += 1
+        if end is None:
+            last = day_index.maxKey()
+        else:
+            last = end.toordinal() - 1
+        # keep the day after the last one representable
+        last = min(last, date.max.toordinal() - 1)
+
+        if first > last:
+            return super(DateFieldIndex, self).applyInRange(
+                start, end, excludemin=excludemin, excludemax=excludemax)
+
+        sets = [
+            super(DateFieldIndex, self).applyInRange(
+                start, datetime.fromordinal(first),
+                excludemin=excludemin, excludemax=True),
+            super(DateFieldIndex, self).applyInRange(
+                datetime.fromordinal(last + 1), end,
+                excludemax=excludemax),
+            ]
+        sets.extend(self._day_range_sets(first, last))
+        return self.family.IF.multiunion(sets)
+
+    def _day_range_sets(self, first, last):
+        # return the postings of the coarsest periods which make up the days
+        # from the ordinal first to the ordinal last
+        sets = []
+        after = date.fromordinal(last + 1)
+        while first <= last:
+            day = date.fromordinal(first)
+            if day.day != 1:
+                # the days up to the end of the month
+                month = _month_key(day) + 1
+                if month > _MAX_MONTH:
+                    # the month after December 9999 has no first day
+                    end = last
+                else:
+                    end = min(last, _month_start(month).toordinal() - 1)
+                sets.extend(self._day_index.values(first, end))
+                first = end + 1
+            elif day.month == 1 and after.year > day.year:
+                # whole years
+                sets.extend(self._year_index.values(day.year, after.year - 1))
+                first = date(after.year, 1, 1).toordinal()
+            else:
+                # whole months, up to the end of the year
+                month = _month_key(day)
+                end = min(_month_key(after), (day.year + 1) * 12)
+                if end == month:
+                    # less than a month is left
+                    sets.extend(self._day_index.values(first, last))
+                    break
+                sets.extend(self._month_index.values(month, end - 1))
+                first = _month_start(end).toordinal()
+        return sets
+
+    def histogram(self, granularity='month', docids=None):
+        """ Return a list of ``(period, count)`` pairs, in order, for each
+        year, month or day (depending on ``granularity``) in which the value
+        of at least one document falls.  ``period`` is the date of the first
+        day of the period; ``count`` is the number of documents.
+
+        If ``docids`` is passed, only those documents are counted (and
+        periods in which none of them fall are omitted).
+        """
+        if granularity == 'year':
+            periods = self._year_index
+            start = lambda key: date(key, 1, 1)
+        elif granularity == 'month':
+            periods = self._month_index
+            start = _month_start
+        elif granularity == 'day':
+            periods = self._day_index
+            start = date.fromordinal
+        else:
+            raise ValueError('granularity must be one of %s' %
+                             ', '.join(GRANULARITIES))
+        if docids is not None:
+            if not hasattr(docids, 'keys'):
+                docids = self.family.IF.Set(docids)
+            intersection = self.family.IF.intersection
+        result = []
+        for key, set in periods.items():
+            if docids is not None:
+                set = intersection(set, docids)
+                if not set:
+                    continue
+            result.append((start(key), len(set)))
+        return result
+
+def _normalize(value):
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    offset = value.utcoffset()
+    if offset is not None:
+        value = value.replace(tzinfo=None) - offset
+    return value
+
+def _month_key(value):
+    return value.year * 12 + value.month - 1
+
+def _month_start(key):
+    return date(key // 12, key % 12 + 1, 1)
+
+_MAX_MONTH = _month_key(date.max)
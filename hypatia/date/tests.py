@@ -0,0 +1,239 @@
+import unittest
+
+_marker = object()
+
+class TestDateFieldIndex(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from . import DateFieldIndex
+        return DateFieldIndex
+
+    def _makeOne(self, family=None):
+        def discriminator(obj, default):
+            if obj is _marker:
+                return default
+            return obj
+        return self._getTargetClass()(discriminator, family=family)
+
+    def _populate(self, index, count=500, seed=None):
+        import random
+        from datetime import datetime
+        from datetime import timedelta
+        rnd = random.Random(seed)
+        base = datetime(2010, 1, 1)
+        values = {}
+        for docid in range(count):
+            if rnd.random() < 0.2:
+                # land exactly on period boundaries every now and then
+                value = datetime(rnd.randrange(2009, 2016),
+                                 rnd.randrange(1, 13), 1)
+            else:
+                value = base + timedelta(
+                    seconds=rnd.randrange(6 * 365 * 86400))
+            index.index_doc(docid, value)
+            values[docid] = value
+        return values
+
+    def _expected(self, values, start, end, excludemin=False,
+                  excludemax=False):
+        result = []
+        for docid, value in sorted(values.items()):
+            if start is not None:
+                if value < start or (excludemin and value == start):
+                    continue
+            if end is not None:
+                if value > end or (excludemax and value == end):
+                    continue
+            result.append(docid)
+        return result
+
+    def _checkPeriods(self, index, values):
+        from . import _month_key
+        for periods, key in ((index._year_index, lambda v: v.year),
+                             (index._month_index, _month_key),
+                             (index._day_index, lambda v: v.toordinal())):
+            expected = {}
+            for docid, value in values.items():
+                expected.setdefault(key(value), set()).add(docid)
+            self.assertEqual(sorted(periods.keys()), sorted(expected))
+            for k, docids in expected.items():
+                self.assertEqual(set(periods[k]), docids)
+
+    def test_index_doc_maintains_periods(self):
+        import random
+        from datetime import datetime
+        index = self._makeOne()
+        values = self._populate(index, seed=1)
+        rnd = random.Random(2)
+        for i in range(300):
+            docid = rnd.randrange(500)
+            if docid in values and rnd.random() < 0.5:
+                index.unindex_doc(docid)
+                del values[docid]
+            else:
+                value = datetime(2012, rnd.randrange(1, 13),
+                                 rnd.randrange(1, 29))
+                index.index_doc(docid, value)
+                values[docid] = value
+        index.index_doc(0, _marker)
+        values.pop(0, None)
+        self._checkPeriods(index, values)
+
+    def test_index_docs_maintains_periods(self):
+        index = self._makeOne()
+        values = self._populate(index, count=100, seed=6)
+        other = self._makeOne()
+        more = self._populate(other, count=300, seed=7)
+        del other
+        index.index_docs(sorted(more.items()))
+        values.update(more)
+        self._checkPeriods(index, values)
+
+    def test_reindex_same_value(self):
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(2014, 5, 6, 7, 8))
+        index.index_doc(1, datetime(2014, 5, 6, 7, 8))
+        self.assertEqual(list(index._day_index.values()[0]), [1])
+
+    def test_applyInRange_matches_values(self):
+        import random
+        from datetime import datetime
+        from datetime import timedelta
+        index = self._makeOne()
+        values = self._populate(index, seed=3)
+        rnd = random.Random(4)
+        bounds = [None, datetime(2009, 1, 1), datetime(2013, 1, 1),
+                  datetime(2013, 3, 1), datetime(2020, 1, 1)]
+        bounds.extend(values[rnd.randrange(500)] for i in range(10))
+        bounds.extend(datetime(2010, 1, 1) + timedelta(
+            seconds=rnd.randrange(6 * 365 * 86400)) for i in range(10))
+        for start in bounds:
+            for end in bounds:
+                for excludemin in (False, True):
+                    for excludemax in (False, True):
+                        self.assertEqual(
+                            list(index.applyInRange(
+                                start, end, excludemin, excludemax)),
+                            self._expected(values, start, end, excludemin,
+                                           excludemax))
+
+    def test_applyInRange_last_month(self):
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(9999, 12, 30))
+        index.index_doc(2, datetime(9999, 12, 31, 5))
+        index.index_doc(3, datetime(9999, 11, 3))
+        self.assertEqual(
+            list(index.applyInRange(datetime(9999, 12, 5), None)), [1, 2])
+        self.assertEqual(
+            list(index.applyInRange(datetime(9999, 11, 2),
+                                    datetime(9999, 12, 31))), [1, 3])
+
+    def test_applyInRange_empty(self):
+        from datetime import datetime
+        index = self._makeOne()
+        self.assertEqual(
+            list(index.applyInRange(datetime(2010, 1, 1), None)), [])
+
+    def test_queries_accept_dates(self):
+        from datetime import date
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, date(2014, 5, 6))
+        index.index_doc(2, datetime(2014, 5, 6, 12))
+        index.index_doc(3, datetime(2014, 5, 7))
+        self.assertEqual(list(index.applyEq(date(2014, 5, 6))), [1])
+        self.assertEqual(list(index.applyGt(date(2014, 5, 6))), [2, 3])
+        self.assertEqual(list(index.applyLt(date(2014, 5, 7))), [1, 2])
+        self.assertEqual(index.document_repr(1),
+                         repr(datetime(2014, 5, 6)))
+
+    def test_aware_datetimes_normalized(self):
+        from datetime import datetime
+        from datetime import timedelta
+        from datetime import tzinfo
+        class Offset(tzinfo):
+            def utcoffset(self, dt):
+                return timedelta(hours=2)
+        index = self._makeOne()
+        index.index_doc(1, datetime(2014, 1, 1, 1, tzinfo=Offset()))
+        self.assertEqual(list(index.unique_values()),
+                         [datetime(2013, 12, 31, 23)])
+        self.assertEqual(list(index._year_index.keys()), [2013])
+        self.assertEqual(
+            list(index.applyGe(datetime(2014, 1, 1, 0, tzinfo=Offset()))),
+            [1])
+
+    def test_index_doc_invalid(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.index_doc, 1, '2014-01-01')
+        self.assertEqual(index.indexed_count(), 0)
+
+    def test_sort(self):
+        index = self._makeOne()
+        values = self._populate(index, count=100, seed=5)
+        self.assertEqual(list(index.sort(values, reverse=True)),
+                         sorted(values, key=values.get, reverse=True))
+
+    def test_sort_after(self):
+        from datetime import date
+        index = self._makeOne()
+        for docid, day in enumerate([3, 1, 2, 1]):
+            index.index_doc(docid, date(2014, 1, day))
+        self.assertEqual(
+            list(index.sort([0, 1, 2, 3], after=(date(2014, 1, 1), 1))),
+            [3, 2, 0])
+
+    def test_min_max_stats(self):
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(2014, 1, 3))
+        index.index_doc(2, datetime(2013, 5, 1))
+        self.assertEqual(index.min_value(), datetime(2013, 5, 1))
+        self.assertEqual(index.max_value([2]), datetime(2013, 5, 1))
+        self.assertEqual(index.stats([1, 2]),
+                         {'count': 2, 'min': datetime(2013, 5, 1),
+                          'max': datetime(2014, 1, 3)})
+
+    def test_reset(self):
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(2014, 1, 1))
+        index.reset()
+        self.assertFalse(index._year_index)
+        self.assertFalse(index._month_index)
+        self.assertFalse(index._day_index)
+
+    def test_histogram(self):
+        from datetime import date
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(2013, 12, 31, 23))
+        index.index_doc(2, datetime(2014, 1, 1))
+        index.index_doc(3, datetime(2014, 1, 1, 5))
+        index.index_doc(4, datetime(2014, 3, 2))
+        self.assertEqual(index.histogram('year'),
+                         [(date(2013, 1, 1), 1), (date(2014, 1, 1), 3)])
+        self.assertEqual(index.histogram(),
+                         [(date(2013, 12, 1), 1), (date(2014, 1, 1), 2),
+                          (date(2014, 3, 1), 1)])
+        self.assertEqual(index.histogram('day'),
+                         [(date(2013, 12, 31), 1), (date(2014, 1, 1), 2),
+                          (date(2014, 3, 2), 1)])
+
+    def test_histogram_docids(self):
+        from datetime import date
+        from datetime import datetime
+        index = self._makeOne()
+        index.index_doc(1, datetime(2013, 12, 31, 23))
+        index.index_doc(2, datetime(2014, 1, 1))
+        index.index_doc(3, datetime(2014, 1, 1, 5))
+        self.assertEqual(index.histogram('year', [2, 3, 7]),
+                         [(date(2014, 1, 1), 2)])
+        self.assertEqual(index.histogram('year', index.family.IF.Set([1])),
+                         [(date(2013, 1, 1), 1)])
+
+    def test_histogram_bad_granularity(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.histogram, 'week')
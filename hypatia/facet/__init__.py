@@ -1,8 +1,12 @@
 from hashlib import md5
+import heapq
+import numbers
 from zope.interface import implementer
 
 from ..keyword import KeywordIndex
 from ..interfaces import IIndex
+from ..util import intersection
+from ..util import intersection_count
 from .._compat import make_binary
 from .._compat import string_types
 
@@ -29,9 +33,22 @@ class FacetIndex(KeywordIndex):
     - All
 
     - NotAll
+
+    Facets are declared up front (``facets``), and documents are indexed
+    only with the declared facets among their facet specifiers and the
+    ancestors of these.  A dynamic facet index (``dynamic=True``) instead
+    indexes documents with any facet specifier and all its ancestors; it
+    interns each facet path as an integer path id in a table which also
+    records the id of its parent, and stores the path ids of each document
+    in the reverse index.
     """
 
-    def __init__(self, discriminator, facets, family=None):
+    # In a dynamic facet index, _parents maps the path id of each facet
+    # below the top level to the path id of its parent (path ids are word
+    # ids of the vocabulary of the keyword index, see build_vocabulary).
+    _parents = None
+
+    def __init__(self, discriminator, facets=(), family=None, dynamic=False):
         if not callable(discriminator):
             if not isinstance(discriminator, string_types):
                 raise ValueError('discriminator value must be callable or a '
@@ -42,12 +59,31 @@ class FacetIndex(KeywordIndex):
         self.facets = self.family.OO.Set(facets)
         self._not_indexed = self.family.IF.TreeSet()
         self.reset()
-
-    def document_repr(self, docid, default=None):
-        result = self._rev_index.get(docid, default)
-        if result is not default:
-            return repr(result)
-        return default
+        if dynamic:
+            self._parents = self.family.II.BTree()
+            self.build_vocabulary()
+
+    def build_vocabulary(self):
+        """ Renumber the facet path ids of a dynamic facet index (see
+        ``KeywordIndex.build_vocabulary``) and the parent path ids along with
+        them.  A facet index with declared facets stores facet paths in its
+        reverse index, and raises a ValueError."""
+        if self._parents is None:
+            raise ValueError('only a dynamic facet index stores facet path '
+                             'ids')
+        super(FacetIndex, self).build_vocabulary()
+        wids = self._wids
+        parents = self.family.II.BTree()
+        for facet, pid in wids.items():
+            if ':' in facet:
+                parents[pid] = wids[facet.rsplit(':', 1)[0]]
+        self._parents = parents
+
+    def drop_vocabulary(self):
+        """ Not supported by a dynamic facet index, which needs its facet
+        path ids; a facet index with declared facets has none to drop."""
+        if self._parents is not None:
+            raise ValueError('a dynamic facet index needs its facet path ids')
 
     def index_doc(self, docid, obj):
         """ Pass in an integer document id and an object supporting a
@@ -64,42 +100,315 @@ class FacetIndex(KeywordIndex):
         if docid in self._not_indexed:
             self._not_indexed.remove(docid)
 
+        if self._parents is not None:
+            self._index_value(docid, value)
+            return value
+
         old = self._rev_index.get(docid)
         if old is not None:
             self.unindex_doc(docid)
 
         changed = False
+        facets = self.facets
 
         for facet in value:
             L = []
             categories = facet.split(':')
             for category in categories:
                 L.append(category)
-                facet_candidate = ':'.join(L)
-                for fac in self.facets:
-                    if fac == facet_candidate:
-                        changed = True
-                        fwset = self._fwd_index.get(fac)
-                        if fwset is None:
-                            fwset = self.family.IF.Set()
-                            self._fwd_index[fac] = fwset
-                        fwset.insert(docid)
-                        revset = self._rev_index.get(docid)
-                        if revset is None:
-                            revset = self.family.OO.Set()
-                            self._rev_index[docid] = revset
-                        revset.insert(fac)
+                fac = ':'.join(L)
+                if fac in facets:
+                    changed = True
+                    self._insert_docids(fac, (docid,))
+                    revset = self._rev_index.get(docid)
+                    if revset is None:
+                        revset = self.family.OO.Set()
+                        self._rev_index[docid] = revset
+                    revset.insert(fac)
 
         if changed:
             self._num_docs.change(1)
 
         return value
 
-    def counts(self, docids, omit_facets=()):
+    def _keyword_set(self, seq):
+        if self._parents is None:
+            return super(FacetIndex, self)._keyword_set(seq)
+        # the path ids of the facets and of all their ancestors
+        parents = self._parents
+        ids = set()
+        for facet in seq:
+            pid = self._path_id(facet)
+            while pid is not None and pid not in ids:
+                ids.add(pid)
+                pid = parents.get(pid)
+        return self.family.II.Set(ids)
+
+    def _path_id(self, facet):
+        # return the path id of facet, interning it (and its ancestors) if
+        # it has none
+        pid = self._wids.get(facet)
+        if pid is None:
+            parent = None
+            if ':' in facet:
+                parent = self._path_id(facet.rsplit(':', 1)[0])
+            pid = self._word_id(facet)
+            if parent is not None:
+                self._parents[pid] = parent
+        return pid
+
+    def _remove_docids(self, word, docids):
+        parents = self._parents
+        if parents is None:
+            return super(FacetIndex, self)._remove_docids(word, docids)
+        pid = self._wids[word]
+        super(FacetIndex, self)._remove_docids(word, docids)
+        if word not in self._wids:
+            # no document has the facet any more
+            parents.pop(pid, None)
+
+    def _facet_paths(self):
+        # the facets which documents can be indexed with, in order
+        if self._parents is not None:
+            return self._fwd_index
+        return self.facets
+
+    def add_facet(self, facet):
+        """ Declare a new facet, e.g. ``style:gucci:bag``.
+
+        Documents indexed with facets below the new one (e.g. with
+        ``style:gucci:bag:small``) are added to it without reindexing;
+        documents indexed with the new facet itself (or with undeclared
+        facets below it) before it was declared must be reindexed to be
+        found under it."""
+        if self._parents is not None:
+            raise ValueError('facets of a dynamic facet index are not '
+                             'declared')
+        if not self.facets.insert(facet):
+            return
+        fwd_index = self._fwd_index
+        sets = [fwd_index[below] for below in self._facets_below(facet)
+                if below in fwd_index]
+        if not sets:
+            return
+        docids = self.family.IF.multiunion(sets)
+        self._insert_docids(facet, docids)
+        for docid in docids:
+            self._rev_index[docid].insert(facet)
+
+    def remove_facet(self, facet):
+        """ Remove a declared facet, and remove it from the documents
+        indexed with it.  Facets below it remain declared."""
+        if self._parents is not None:
+            raise ValueError('facets of a dynamic facet index are not '
+                             'declared')
+        if facet not in self.facets:
+            raise KeyError(facet)
+        self.facets.remove(facet)
+        docids = self._fwd_index.get(facet)
+        if docids is None:
+            return
+        docids = list(docids)
+        self._remove_docids(facet, docids)
+        rev_index = self._rev_index
+        for docid in docids:
+            revset = rev_index[docid]
+            revset.remove(facet)
+            if not revset:
+                # no declared facet is left for the document
+                del rev_index[docid]
+                self._num_docs.change(-1)
+
+    def multiselect_counts(self, docids, filters):
+        """ Return the facet counts for multi-select faceting.
+
+        ``docids`` is the result of the base query (without any facet
+        filter) and ``filters`` maps each facet group (a facet, e.g.
+        ``color``) to the docids matching the selection in that group (e.g.
+        the documents with ``color:red`` or ``color:blue``), or to None when
+        nothing is selected in the group.
+
+        Return a dictionary mapping each group to a dictionary of counts
+        like the one returned by ``counts``, for the facets below the group,
+        among the documents of ``docids`` which match the filters of all the
+        *other* groups.  All groups are counted at once, rather than by one
+        call to ``counts`` per group: either by looking up the facets of
+        each document, and which filters it fails, once, or (see
+        ``hypatia.keyword.postings_count_wins``) by counting the docids of
+        each facet in the forward index.
+        """
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet)):
+            docids = IF.Set(docids)
+        active = []
+        for group, selected in filters.items():
+            if selected is not None:
+                if not isinstance(selected, (IF.Set, IF.TreeSet)):
+                    selected = IF.Set(selected)
+                active.append((group, selected))
+        result = dict((group, {}) for group in filters)
+        if not docids:
+            return result
+        below = dict((group, list(self._facets_below(group)))
+                     for group in filters)
+        numfacets = sum(len(facets) for facets in below.values())
+        if self._postings_count_wins(docids, numfacets):
+            for group, facets in below.items():
+                # the documents matching the filters of the other groups
+                matching = docids
+                for other, selected in active:
+                    if other != group:
+                        matching = intersection(matching, selected,
+                                                self.family)
+                result[group] = self._forward_facet_counts(matching, facets)
+            return result
+
+        # the group of each facet below one
+        groups = {}
+        for group, facets in below.items():
+            for facet in facets:
+                groups[facet] = group
+        cache = {}
+        rev_index = self._rev_index
+        for docid in docids:
+            # the one group whose filter the document fails, if any
+            failed = None
+            for group, selected in active:
+                if docid not in selected:
+                    if failed is not None:
+                        break
+                    failed = group
+            else:
+                available_facets = rev_index.get(docid)
+                if available_facets is None:
+                    continue
+                ck = tuple(available_facets)
+                grouped = cache.get(ck)
+                if grouped is None:
+                    grouped = [(groups[facet], facet)
+                               for facet in self._rev_words(docid, ck)
+                               if facet in groups]
+                    cache[ck] = grouped
+                for group, facet in grouped:
+                    if failed is None or failed == group:
+                        counts = result[group]
+                        counts[facet] = counts.get(facet, 0) + 1
+        return result
+
+    def facet_tree(self, docids, max_per_level=None, min_count=1, path=None,
+                   depth=None):
+        """ Given a set of docids (usually returned from query), return the
+        facets below ``path`` (or the top-level facets, when ``path`` is
+        None) which at least ``min_count`` of the documents have, as a list
+        of mappings with ``facet``, ``count`` and ``children`` keys, most
+        frequent first (facets with the same count are in facet order).
+        ``children`` is the list of the facets below each facet, in the
+        same form, down to ``depth`` levels below ``path`` (or to the
+        bottom of the taxonomy).
+
+        At each level, only the ``max_per_level`` most frequent facets are
+        included (and only their children are counted).  The facets of a
+        level are looked at in order of their overall number of documents,
+        which is an upper bound of their number of documents among
+        ``docids``, so the less frequent facets are never counted once
+        enough facets with larger counts have been found.
+        """
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet)):
+            docids = IF.Set(docids)
+        if max_per_level is not None and max_per_level < 1:
+            raise ValueError('max_per_level must be 1 or greater')
+        return self._facet_level(docids, path, max_per_level,
+                                 max(min_count, 1), depth)
+
+    def _facet_level(self, docids, path, limit, min_count, depth):
+        if depth is not None:
+            if depth < 1:
+                return []
+            depth -= 1
+        result = []
+        for facet, count in self._top_facets(
+                docids, self._facet_children(path), limit, min_count):
+            children = self._facet_level(docids, facet, limit, min_count,
+                                         depth)
+            result.append(
+                {'facet': facet, 'count': count, 'children': children})
+        return result
+
+    def _top_facets(self, docids, facets, limit, min_count):
+        # return (facet, count) pairs for the limit facets which the most
+        # of docids have, most frequent first
+        fwd_index = self._fwd_index
+        candidates = []
+        for facet in facets:
+            fwset = fwd_index.get(facet)
+            if fwset is None:
+                continue
+            candidates.append(
+                (self._docid_count(facet, fwset), facet, fwset))
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        found = []
+        # the limit largest counts found so far
+        heap = []
+        for most, facet, fwset in candidates:
+            if most < min_count:
+                break
+            if limit is not None and len(heap) == limit and most < heap[0]:
+                break
+            count = intersection_count(fwset, docids, self.family)
+            if count < min_count:
+                continue
+            found.append((facet, count))
+            if limit is None:
+                continue
+            if len(heap) < limit:
+                heapq.heappush(heap, count)
+            elif count > heap[0]:
+                heapq.heapreplace(heap, count)
+        found.sort(key=lambda item: (-item[1], item[0]))
+        return found[:limit]
+
+    def _facet_children(self, path):
+        # the declared facets right below path (the top-level facets when
+        # path is None)
+        if path is None:
+            return [facet for facet in self._facet_paths()
+                    if ':' not in facet]
+        start = len(path) + 1
+        return [facet for facet in self._facets_below(path)
+                if ':' not in facet[start:]]
+
+    def _facets_below(self, facet):
+        # the declared facets below facet, e.g. style:gucci:bag for style
+        return self._facet_paths().keys(facet + ':', facet + ';',
+                                        excludemax=True)
+
+    def index_docs(self, docs):
+        """ Index many documents at once.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs; each pair is
+        indexed with ``index_doc``."""
+        for docid, obj in docs:
+            self.index_doc(docid, obj)
+
+    def counts(self, docids, omit_facets=(), limit=None):
         """ Given a set of docids (usually returned from query),
         provide count information for further facet narrowing.
         Optionally omit count information for facets and their
-        ancestors that are in 'omit_facets' (a sequence of facets)"""
+        ancestors that are in 'omit_facets' (a sequence of facets).
+        If ``limit`` is passed, only the ``limit`` most frequent facets are
+        included, as by ``KeywordIndex.counts`` (whose second argument is
+        ``limit`` rather than ``omit_facets``).
+
+        Depending on the number of docids and of facets, either the facets
+        of each document are looked up in the reverse index, or the docids
+        of each facet are counted in the forward index (see
+        ``hypatia.keyword.postings_count_wins``)."""
+        if isinstance(omit_facets, numbers.Integral):
+            raise TypeError('omit_facets must be a sequence of facets; pass '
+                            'limit as a keyword argument')
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be 1 or greater')
 
         effective_omits = self.family.OO.Set()
 
@@ -110,27 +419,62 @@ class FacetIndex(KeywordIndex):
                 L.append(category)
                 effective_omits.insert(':'.join(L))
 
-        include_facets = self.family.OO.difference(self.facets,
+        include_facets = self.family.OO.difference(self._facet_paths(),
                                                    effective_omits)
 
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet)):
+            docids = IF.Set(docids)
+        if not docids:
+            return {}
+        if self._postings_count_wins(docids, len(include_facets)):
+            counts = self._forward_facet_counts(docids, include_facets)
+        else:
+            counts = self._reverse_facet_counts(docids, include_facets)
+        if limit is not None and len(counts) > limit:
+            found = sorted(counts.items(),
+                           key=lambda item: (-item[1], item[0]))
+            counts = dict(found[:limit])
+        return counts
+
+    def _reverse_facet_counts(self, docids, include_facets):
+        # look up the facets of each document
         counts = {}
         isect_cache = {}
+        rev_index = self._rev_index
 
         for docid in docids:
-            available_facets = self._rev_index.get(docid)
-            ck = cachekey(available_facets)
+            available_facets = rev_index.get(docid)
+            if available_facets is None:
+                continue
+            # the facets of a document are sorted, so they key the cache
+            ck = tuple(available_facets)
             appropriate_facets = isect_cache.get(ck)
             if appropriate_facets is None:
-                appropriate_facets = self.family.OO.intersection(
-                    include_facets, available_facets)
+                # look the (few) facets of the document up rather than
+                # intersecting them with all the included facets
+                appropriate_facets = [
+                    facet for facet in self._rev_words(docid, ck)
+                    if facet in include_facets]
                 isect_cache[ck] = appropriate_facets
             for facet in appropriate_facets:
-                count = counts.get(facet, 0)
-                count += 1
-                counts[facet] = count
+                counts[facet] = counts.get(facet, 0) + 1
 
         return counts
 
+    def _forward_facet_counts(self, docids, include_facets):
+        # count the docids of each facet
+        counts = {}
+        fwd_index = self._fwd_index
+        for facet in include_facets:
+            fwset = fwd_index.get(facet)
+            if fwset is None:
+                continue
+            count = intersection_count(fwset, docids, self.family)
+            if count:
+                counts[facet] = count
+        return counts
+
 
 def cachekey(set):
     h = md5()
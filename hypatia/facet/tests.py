@@ -229,6 +229,312 @@ class TestCatalogFacetIndex(unittest.TestCase):
         counts = index.counts(result, search)
         self.assertEqual(counts, {'size:large':1})
 
+    def test_add_facet(self):
+        index = self._makeOne(facets=['style', 'style:gucci:handbag'])
+        index.index_doc(1, ['style:gucci:handbag'])
+        index.index_doc(2, ['style:gucci'])
+        index.index_doc(3, ['style:prada'])
+        index.add_facet('style:gucci')
+        self.assertEqual(list(index.facets),
+                         ['style', 'style:gucci', 'style:gucci:handbag'])
+        self.assertEqual(list(index.search(['style:gucci'])), [1])
+        self.assertEqual(list(index._rev_index[1]),
+                         ['style', 'style:gucci', 'style:gucci:handbag'])
+        index.index_doc(2, ['style:gucci'])
+        self.assertEqual(list(index.search(['style:gucci'])), [1, 2])
+        # already declared
+        index.add_facet('style')
+        self.assertEqual(list(index.search(['style'])), [1, 2, 3])
+
+    def test_add_facet_nothing_below(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.add_facet('color:green')
+        self.assertFalse('color:green' in index._fwd_index)
+        index.index_doc(5, ['color:green'])
+        self.assertEqual(list(index.search(['color:green'])), [5])
+
+    def test_remove_facet(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.remove_facet('color:blue')
+        self.assertFalse('color:blue' in index.facets)
+        self.assertFalse('color:blue' in index._fwd_index)
+        self.assertEqual(list(index.search(['color'])), [1, 2, 3])
+        self.assertEqual(list(index._rev_index[1]),
+                         ['color', 'price', 'price:0-100', 'style',
+                          'style:gucci', 'style:gucci:handbag'])
+        index.remove_facet('size')
+        index.remove_facet('size:large')
+        self.assertFalse(4 in index._rev_index)
+        self.assertEqual(index.indexed_count(), 3)
+        self.assertRaises(KeyError, index.remove_facet, 'size')
+        index.remove_facet('style:gucci:dress')
+        self.assertEqual(index.top_keywords(1), [('color', 3)])
+
+    def test_top_keywords(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(4, ['size:large', 'color:red'])
+        index.unindex_doc(1)
+        self.assertEqual(index.top_keywords(4),
+                         [('color', 3), ('color:blue', 2), ('color:red', 2),
+                          ('price', 2)])
+
+    def test_unindex_doc_keeps_counts(self):
+        index = self._makeOne()
+        index.index_doc(1, ['style:gucci:handbag', 'color:red'])
+        index.index_doc(2, ['style:gucci'])
+        index.unindex_doc(1)
+        self.assertEqual(dict(index._word_count_items()),
+                         {'style': 1, 'style:gucci': 1})
+        index.unindex_doc(2)
+        self.assertEqual(len(index._word_counts), 0)
+
+    def test_index_docs(self):
+        index = self._makeOne()
+        index.index_docs([(1, ['style:gucci:handbag']), (2, ['size:small'])])
+        self.assertEqual(sorted(index._fwd_index.keys()),
+                         ['size', 'size:small', 'style', 'style:gucci',
+                          'style:gucci:handbag'])
+        self.assertEqual(list(index._rev_index[2]), ['size', 'size:small'])
+
+    def test_counts_strategies(self):
+        import random
+        rnd = random.Random(1)
+        index = self._makeOne()
+        leaves = [facet for facet in FACETS if ':' in facet]
+        for docid in range(200):
+            index.index_doc(docid, rnd.sample(leaves, rnd.randrange(1, 4)))
+        omit = ['color:blue', 'style:gucci:dress']
+        docids = index.family.IF.Set(rnd.sample(range(250), 120))
+        expected = index._reverse_facet_counts(
+            docids, index.family.OO.difference(
+                index.facets, index.family.OO.Set(
+                    ['color', 'color:blue', 'style', 'style:gucci',
+                     'style:gucci:dress'])))
+        self.assertEqual(index.counts(docids, omit), expected)
+        self.assertEqual(index.counts(list(docids), omit), expected)
+        self.assertEqual(
+            index._forward_facet_counts(
+                docids, index.family.OO.Set(list(expected) + ['size:none'])),
+            expected)
+        self.assertEqual(index.counts([], omit), {})
+
+    def test_counts_limit(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        result = index.search(['price:0-100'])
+        self.assertEqual(index.counts(result, limit=3),
+                         {'color': 3, 'color:blue': 3, 'price': 3})
+        self.assertEqual(
+            index.counts(result, ['price:0-100', 'color:red'], limit=2),
+            {'color:blue': 3, 'style': 3})
+        index._postings_count_wins = lambda docids, numfacets: True
+        self.assertEqual(index.counts(result, limit=3),
+                         {'color': 3, 'color:blue': 3, 'price': 3})
+        self.assertRaises(ValueError, index.counts, result, limit=0)
+        self.assertRaises(TypeError, index.counts, result, 10)
+
+    def test_multiselect_counts(self):
+        import random
+        rnd = random.Random(3)
+        index = self._makeOne()
+        leaves = [facet for facet in FACETS if ':' in facet]
+        for docid in range(150):
+            index.index_doc(docid, rnd.sample(leaves, rnd.randrange(1, 5)))
+        docids = index.family.IF.Set(rnd.sample(range(160), 100))
+        filters = {
+            'color': index.search(['color:red'], 'or'),
+            'size': index.search(['size:small', 'size:large'], 'or'),
+            'price': list(index.search(['price:0-100'])),
+            'style': None,
+            }
+        expected = {}
+        for group in filters:
+            matching = set(docids)
+            for other, selected in filters.items():
+                if other != group and selected is not None:
+                    matching &= set(selected)
+            counts = {}
+            for docid in matching:
+                for facet in index._rev_index.get(docid, ()):
+                    if facet.startswith(group + ':'):
+                        counts[facet] = counts.get(facet, 0) + 1
+            expected[group] = counts
+        self.assertEqual(index.multiselect_counts(docids, filters), expected)
+        index._postings_count_wins = lambda docids, numfacets: True
+        self.assertEqual(index.multiselect_counts(list(docids), filters),
+                         expected)
+        index._postings_count_wins = lambda docids, numfacets: False
+        self.assertEqual(index.multiselect_counts(docids, filters), expected)
+        self.assertEqual(index.multiselect_counts([], filters),
+                         dict((group, {}) for group in filters))
+
+    def test_facet_tree(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(5, ['size:small', 'color:red'])
+        tree = index.facet_tree([1, 2, 3, 4, 5])
+        self.assertEqual(
+            [(node['facet'], node['count']) for node in tree],
+            [('color', 4), ('price', 3), ('style', 3), ('size', 2)])
+        self.assertEqual(
+            tree[0]['children'],
+            [{'facet': 'color:blue', 'count': 3, 'children': []},
+             {'facet': 'color:red', 'count': 2, 'children': []}])
+        self.assertEqual(
+            tree[2]['children'],
+            [{'facet': 'style:gucci', 'count': 3, 'children': [
+                {'facet': 'style:gucci:dress', 'count': 1, 'children': []},
+                {'facet': 'style:gucci:handbag', 'count': 1,
+                 'children': []},
+                ]}])
+
+    def test_facet_tree_pruned(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(5, ['size:small', 'color:red'])
+        docids = index.family.IF.Set([1, 2, 3, 4, 5])
+        self.assertEqual(
+            index.facet_tree(docids, max_per_level=2, depth=1),
+            [{'facet': 'color', 'count': 4, 'children': []},
+             {'facet': 'price', 'count': 3, 'children': []}])
+        self.assertEqual(
+            index.facet_tree(docids, min_count=2, path='style'),
+            [{'facet': 'style:gucci', 'count': 3, 'children': []}])
+        self.assertEqual(
+            index.facet_tree([4, 5], path='size', depth=1),
+            [{'facet': 'size:large', 'count': 1, 'children': []},
+             {'facet': 'size:small', 'count': 1, 'children': []}])
+        self.assertEqual(index.facet_tree([], path='size'), [])
+        self.assertRaises(ValueError, index.facet_tree, docids, 0)
+
+    def test_facet_tree_matches_counts(self):
+        import random
+        rnd = random.Random(2)
+        index = self._makeOne()
+        leaves = [facet for facet in FACETS if ':' in facet]
+        for docid in range(100):
+            index.index_doc(docid, rnd.sample(leaves, rnd.randrange(1, 4)))
+        docids = rnd.sample(range(100), 40)
+        counts = index.counts(docids)
+        def parent(facet):
+            if ':' in facet:
+                return facet.rsplit(':', 1)[0]
+        def check(nodes, path, limit):
+            expected = sorted(
+                [(facet, count) for facet, count in counts.items()
+                 if parent(facet) == path],
+                key=lambda item: (-item[1], item[0]))
+            self.assertEqual([(node['facet'], node['count'])
+                              for node in nodes], expected[:limit])
+            for node in nodes:
+                check(node['children'], node['facet'], limit)
+        check(index.facet_tree(docids), None, None)
+        check(index.facet_tree(docids, 2), None, 2)
+        index._word_counts = None
+        check(index.facet_tree(docids, 1), None, 1)
+
+    def _makeDynamic(self):
+        def _discriminator(obj, default):
+            if obj is _marker:
+                return default
+            return obj
+        return self._getTargetClass()(_discriminator, dynamic=True)
+
+    def _checkPaths(self, index):
+        paths = dict((pid, path) for path, pid in index._wids.items())
+        self.assertEqual(dict(index._words.items()), paths)
+        self.assertEqual(sorted(paths.values()),
+                         list(index._fwd_index.keys()))
+        for pid, path in paths.items():
+            if ':' in path:
+                parent = paths[index._parents[pid]]
+                self.assertEqual(parent, path.rsplit(':', 1)[0])
+            else:
+                self.assertFalse(pid in index._parents)
+        self.assertEqual(len(index._parents),
+                         len([path for path in paths.values()
+                              if ':' in path]))
+
+    def test_dynamic_index_doc(self):
+        index = self._makeDynamic()
+        index.index_doc(1, ['style:gucci:handbag', 'color:red'])
+        index.index_doc(2, ['style:prada', 'style:gucci'])
+        self._checkPaths(index)
+        self.assertEqual(list(index.search(['style:gucci'])), [1, 2])
+        self.assertEqual(list(index.search(['style:gucci:handbag'])), [1])
+        self.assertEqual(sorted(index._rev_words(2)),
+                         ['style', 'style:gucci', 'style:prada'])
+        self.assertTrue(
+            isinstance(index._rev_index[1], index.family.II.Set))
+        self.assertTrue('color:red' in index.document_repr(1))
+        index.index_doc(1, ['color:blue'])
+        index.index_doc(2, _marker)
+        self._checkPaths(index)
+        self.assertEqual(list(index._fwd_index.keys()),
+                         ['color', 'color:blue'])
+        self.assertEqual(list(index.not_indexed()), [2])
+        index.unindex_doc(1)
+        self._checkPaths(index)
+        self.assertEqual(len(index._wids), 0)
+        self.assertEqual(index.indexed_count(), 0)
+
+    def test_dynamic_counts(self):
+        index = self._makeDynamic()
+        index.index_docs([
+            (1, ['price:0-100', 'color:blue', 'style:gucci:handbag']),
+            (2, ['price:0-100', 'color:blue', 'style:gucci:dress']),
+            (3, ['price:0-100', 'color:red', 'color:blue', 'style:gucci']),
+            (4, ['size:large']),
+            ])
+        expected = {'color': 3, 'color:blue': 3, 'color:red': 1,
+                    'style': 3, 'style:gucci': 3, 'style:gucci:dress': 1,
+                    'style:gucci:handbag': 1}
+        docids = index.search(['price:0-100'])
+        self.assertEqual(index.counts(docids, ['price:0-100']), expected)
+        index._postings_count_wins = lambda docids, numfacets: True
+        self.assertEqual(index.counts(docids, ['price:0-100']), expected)
+        self.assertEqual(
+            [(node['facet'], node['count'])
+             for node in index.facet_tree([1, 2, 3, 4], path='style:gucci')],
+            [('style:gucci:dress', 1), ('style:gucci:handbag', 1)])
+        del index._postings_count_wins
+        self.assertEqual(
+            index.multiselect_counts(docids, {'color': None}),
+            {'color': {'color:blue': 3, 'color:red': 1}})
+
+    def test_dynamic_reset(self):
+        index = self._makeDynamic()
+        index.index_doc(1, ['style:gucci'])
+        index.reset()
+        self.assertEqual(len(index._parents), 0)
+        self.assertEqual(len(index._wids), 0)
+        index.index_doc(1, ['style:prada'])
+        self._checkPaths(index)
+
+    def test_build_vocabulary(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertRaises(ValueError, index.build_vocabulary)
+        index.drop_vocabulary()
+        self.assertEqual(index._wids, None)
+        dynamic = self._makeDynamic()
+        self.assertRaises(ValueError, dynamic.drop_vocabulary)
+        dynamic.index_doc(1, ['style:gucci:handbag', 'color:red'])
+        dynamic.index_doc(2, ['style:prada'])
+        dynamic.index_doc(1, ['size:small'])
+        dynamic.build_vocabulary()
+        self._checkPaths(dynamic)
+        self.assertEqual(sorted(dynamic._wids.values()), [0, 1, 2, 3])
+        self.assertEqual(list(dynamic.search(['style'])), [2])
+
+    def test_dynamic_facets_not_declared(self):
+        index = self._makeDynamic()
+        self.assertRaises(ValueError, index.add_facet, 'style')
+        self.assertRaises(ValueError, index.remove_facet, 'style')
+
     def test_indexed(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -247,3 +553,50 @@ class TestCatalogFacetIndex(unittest.TestCase):
         self.assertEqual(index.index_doc(20, 'foo'), 'foo')
         self.assertFalse(20 in index._not_indexed)
 
+
+class FacetIndexConcurrencyTests(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.db = DB(FileStorage(self.tmpdir + '/Data.fs'))
+        self.addCleanup(self.db.close)
+
+    def _makeOne(self, **kw):
+        import transaction
+        from . import FacetIndex
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        index = conn.root()['index'] = FacetIndex(_identity, FACETS, **kw)
+        index.index_doc(1, ['color:blue'])
+        index.index_doc(2, ['color:red'])
+        tm.commit()
+        conn.close()
+
+    def _open(self):
+        import transaction
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+        return tm, conn.root()['index']
+
+    def test_concurrent_shared_ancestor_commit(self):
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        # both documents add to the docids and count of the color facet
+        index1.index_doc(3, ['color:blue'])
+        index2.index_doc(4, ['color:red'])
+        tm1.commit()
+        tm2.commit()
+        tm1.begin()
+        self.assertEqual(list(index1._fwd_index['color']), [1, 2, 3, 4])
+        self.assertEqual(index1.top_keywords(3),
+                         [('color', 4), ('color:blue', 2), ('color:red', 2)])
+
+def _identity(obj, default):
+    return obj
@@ -17,10 +17,24 @@ import persistent
 from BTrees.Length import Length
 
 import bisect
+import decimal
 import heapq
+import math
+import numbers
+import random
+import struct
+from itertools import groupby
 from itertools import islice
+from operator import itemgetter
+from timeit import default_timer
 
 from zope.interface import implementer
+from ZODB.POSException import ConflictError
+
+try:
+    import numpy
+except ImportError: # pragma NO COVER
+    numpy = None
 
 from .. import interfaces
 from .. import RangeValue
@@ -29,6 +43,7 @@ from .. import query
 from ..compat import total_ordering
 from ..exc import Unsortable
 from ..util import BaseIndexMixin
+from ..util import intersection_count
 from .._compat import string_types
 
 _marker = []
@@ -65,9 +80,49 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
     - InRange
 
     - NotInRange
+
+    Besides the forward and reverse indexes, a field index can keep an
+    ordinal rank for each unique value (see ``build_ranks``): an integer
+    which sorts the same way as the value itself.  The ``RANKSORT`` sort
+    type uses the ranks to order docids by comparing integers instead of
+    arbitrary (and possibly expensive to compare) Python values.  When NumPy
+    is installed, the ``NUMPYSORT`` sort type sorts (or partitions) the
+    ranks of large result sets in bulk.
     """
 
-    def __init__(self, discriminator, family=None):
+    # Rank tables (see build_ranks) are optional; the ranksort and numpysort
+    # sort types fall back to timsort without them.
+    _value_ranks = None
+    _rank_index = None
+    _rank_state = None
+
+    # NumPy arrays of the rank index (docids and their ranks) and of the
+    # value ranks (the ranks, and a list of the values), built on demand,
+    # each with the token of the rank state they were built from
+    _v_rank_arrays = None
+    _v_value_arrays = None
+
+    # The BTree modules (attributes of the index family) holding the
+    # forward index, the reverse index and the value ranks; subclasses for
+    # values of a single type use modules with native keys or values.
+    _fwd_type = 'OO'
+    _rev_type = 'IO'
+    _value_ranks_type = 'OI'
+
+    # A SortCostModel used to choose a sort algorithm when the caller
+    # doesn't force one; when None, built-in heuristics are used instead.
+    sort_cost_model = None
+
+    # Range blocks (see build_range_blocks) are optional.  At each level, a
+    # key of the forward index starts a new block with a probability of
+    # 1/range_block_size (and only if it also starts a block at the level
+    # below).
+    _range_blocks = None
+    range_block_size = 32
+    range_block_levels = 4
+
+    def __init__(self, discriminator, family=None, range_blocks=False,
+                 ranks=False):
         if family is not None:
             self.family = family
         if not callable(discriminator):
@@ -76,15 +131,23 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                                  'string')
         self.discriminator = discriminator
         self.reset()
+        if range_blocks:
+            self.build_range_blocks()
+        if ranks:
+            self.build_ranks()
 
     def reset(self):
         """Initialize forward and reverse mappings."""
         # The forward index maps indexed values to a sequence of docids
-        self._fwd_index = self.family.OO.BTree()
+        self._fwd_index = getattr(self.family, self._fwd_type).BTree()
         # The reverse index maps a docid to its index value
-        self._rev_index = self.family.IO.BTree()
+        self._rev_index = getattr(self.family, self._rev_type).BTree()
         self._num_docs = Length(0)
         self._not_indexed = self.family.IF.TreeSet()
+        if self._rank_index is not None:
+            self.build_ranks()
+        if self._range_blocks is not None:
+            self.build_range_blocks()
 
     def unique_values(self):
         """ Return the unique values in the index for all docids as an iterable
@@ -113,10 +176,232 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             return repr(result)
         return default
 
+    def min_value(self, docids=None, default=None):
+        """ Return the smallest value in the index or, if ``docids`` is
+        passed, the smallest value of those documents.  Return ``default``
+        if there is no such value."""
+        if docids is None:
+            try:
+                return self._fwd_index.minKey()
+            except ValueError:
+                return default
+        for docid in self.sort(docids, limit=1, raise_unsortable=False):
+            return self._rev_index[docid]
+        return default
+
+    def max_value(self, docids=None, default=None):
+        """ Return the largest value in the index or, if ``docids`` is
+        passed, the largest value of those documents.  Return ``default``
+        if there is no such value."""
+        if docids is None:
+            try:
+                return self._fwd_index.maxKey()
+            except ValueError:
+                return default
+        for docid in self.sort(docids, reverse=True, limit=1,
+                               raise_unsortable=False):
+            return self._rev_index[docid]
+        return default
+
+    def stats(self, docids):
+        """ Return a dictionary of statistics about the values of the
+        documents among ``docids``: their ``count`` (documents without a
+        value are not counted), and their ``min`` and ``max`` values
+        (``None`` if there are none).  When all the values are numbers which
+        can be added together, it also holds their ``sum`` and ``mean``
+        (there are none for e.g. a mix of ``Decimal`` and ``float``
+        values).
+
+        The values are counted as by ``value_counts``; for large sets of
+        docids, this is vectorized with NumPy when it is installed."""
+        counts = self._value_counts(docids)
+        result = {
+            'count': sum([count for value, count in counts]),
+            'min': None,
+            'max': None,
+            }
+        if counts:
+            result['min'] = counts[0][0]
+            result['max'] = counts[-1][0]
+            for value, count in counts:
+                if not isinstance(value, numbers.Number):
+                    break
+            else:
+                try:
+                    total = sum([value * count for value, count in counts])
+                except TypeError:
+                    return result
+                result['sum'] = total
+                if isinstance(total, numbers.Integral):
+                    # true division under Python 2 as well
+                    total = float(total)
+                # Decimal (and Fraction) means keep the type of the values
+                result['mean'] = total / result['count']
+        return result
+
+    def value_counts(self, docids, limit=None):
+        """ Return a list of ``(value, count)`` pairs giving the number of
+        documents among ``docids`` which have each value, most frequent
+        values first (values with the same count are in value order).
+        Values which none of the documents have are left out; if ``limit``
+        is passed, only the ``limit`` most frequent values are returned.
+
+        When the index has few values compared to the number of docids, the
+        docids are counted in the forward index set of each value (see
+        ``hypatia.util.intersection_count``); otherwise the value of each
+        docid is looked up in the reverse index (in bulk, with NumPy, for
+        large sets of docids when it is installed).
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be 1 or greater')
+        counts = self._value_counts(docids)
+        if limit is None:
+            counts.sort(key=itemgetter(1), reverse=True)
+            return counts
+        return heapq.nlargest(limit, counts, key=itemgetter(1))
+
+    def _value_counts(self, docids):
+        # return (value, count) pairs in value order
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet)):
+            docids = IF.Set(docids)
+        rlen = len(docids)
+        if not rlen:
+            return []
+
+        numdocs = self._num_docs()
+        if fwcount_wins(self.word_count(), rlen, numdocs):
+            return self._value_counts_forward(docids)
+        if (numpy is not None and self._rank_index is not None and
+                rlen >= NUMPY_COUNT_MIN and
+                # building the arrays costs about as much as looking up a
+                # quarter of the docids of the index
+                (self._rank_arrays_cached() or rlen * 4 >= numdocs)):
+            return self._value_counts_numpy(docids)
+        return self._value_counts_reverse(docids)
+
+    def _value_counts_forward(self, docids):
+        # count the docids in the set of each value
+        family = self.family
+        counts = []
+        for value, set in self._fwd_index.items():
+            count = intersection_count(set, docids, family)
+            if count:
+                counts.append((value, count))
+        return counts
+
+    def _value_counts_reverse(self, docids):
+        # look up the value of each docid
+        counts = {}
+        get = self._rev_index.get
+        for docid in docids:
+            value = get(docid, _marker)
+            if value is not _marker:
+                counts[value] = counts.get(value, 0) + 1
+        return sorted(counts.items())
+
+    def _value_counts_numpy(self, docids):
+        # look up the ranks of all docids at once, and count them
+        ranks, missing = self._docid_ranks(docids)[1:]
+        ranks, counts = numpy.unique(ranks, return_counts=True)
+        value_ranks, values = self._value_arrays()
+        positions = numpy.searchsorted(value_ranks, ranks)
+        return [(values[position], count) for position, count in
+                zip(positions.tolist(), counts.tolist())]
+
     def index_doc(self, docid, value):
         """See interface IIndexInjection"""
         value = self.discriminate(value, _marker)
+        return self._index_value(docid, value)
+
+    def index_docs(self, docs):
+        """ Index many documents at once.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs.  The result is the
+        same as calling ``index_doc`` for each pair in turn, but documents
+        which are new to the index are added in bulk: all values are
+        discriminated first (so a value which cannot be indexed raises before
+        the index is changed), the new docids are grouped by value, and each
+        set of the forward index and the reverse index is then updated once,
+        in key order."""
+        values = {}
+        for docid, obj in docs:
+            values[docid] = self.discriminate(obj, _marker)
 
+        rev_index = self._rev_index
+        not_indexed = self._not_indexed
+        if rev_index or not_indexed:
+            # documents already known to the index take the per-document
+            # path
+            for docid in [docid for docid in values
+                          if docid in rev_index or docid in not_indexed]:
+                self._index_value(docid, values.pop(docid))
+
+        missing = [docid for docid, value in values.items()
+                   if value is _marker]
+        if missing:
+            for docid in missing:
+                del values[docid]
+            not_indexed.update(missing)
+
+        if values:
+            items = sorted(values.items())
+            groups = [
+                (value, [docid for docid, value in pairs])
+                for value, pairs in groupby(
+                    sorted(items, key=itemgetter(1)), itemgetter(1))
+                ]
+            self._insert_values(items, groups)
+
+    def _insert_values(self, items, groups):
+        # Add docids new to the index: items is a list of (docid, value)
+        # pairs in docid order, groups a list of (value, docids) pairs in
+        # value order, with the docids in order.
+        IF = self.family.IF
+        fwd_index = self._fwd_index
+        new_value_flags = []
+        for value, docids in groups:
+            set = fwd_index.get(value)
+            new_value_flags.append(set is None)
+            if set is None:
+                fwd_index[value] = IF.TreeSet(docids)
+            else:
+                set.update(docids)
+        self._rev_index.update(items)
+        self._num_docs.change(len(items))
+
+        # when most values are new, it's cheaper to rebuild the ranks and
+        # range blocks from scratch than to update them value by value
+        rebuild = sum(new_value_flags) * 2 > len(fwd_index)
+
+        rank_index = self._rank_index
+        if rank_index is not None:
+            if rebuild:
+                self._renumber_ranks()
+            else:
+                value_ranks = self._value_ranks
+                for value, docids in groups:
+                    rank = value_ranks.get(value)
+                    if rank is None:
+                        rank = self._rank_value(value)
+                    rank_index.update([(docid, rank) for docid in docids])
+            self._rank_state.changed()
+
+        if self._range_blocks is not None:
+            if rebuild:
+                self.build_range_blocks()
+            else:
+                for (value, docids), new_value in zip(groups, new_value_flags):
+                    if new_value:
+                        self._split_range_blocks(value)
+                    for level in self._range_blocks:
+                        try:
+                            start = level.maxKey(value)
+                        except ValueError:
+                            break
+                        level[start].update(docids)
+
+    def _index_value(self, docid, value):
         if value is _marker:
             if not (docid in self._not_indexed):
                 # unindex the previous value
@@ -139,7 +424,8 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
 
         # Insert into forward index.
         set = self._fwd_index.get(value)
-        if set is None:
+        new_value = set is None
+        if new_value:
             set = self.family.IF.TreeSet()
             self._fwd_index[value] = set
             
@@ -151,6 +437,19 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         # Insert into reverse index.
         rev_index[docid] = value
 
+        rank_index = self._rank_index
+        if rank_index is not None:
+            rank = self._value_ranks.get(value)
+            if rank is None:
+                rank = self._rank_value(value)
+            rank_index[docid] = rank
+            self._rank_state.changed()
+
+        if self._range_blocks is not None:
+            if new_value:
+                self._split_range_blocks(value)
+            self._range_blocks_insert(docid, value)
+
     def unindex_doc(self, docid):
         """See interface IIndexInjection.
         """
@@ -174,11 +473,326 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             # but keep it from throwing a dirty exception
             set = 1
 
+        if self._range_blocks is not None:
+            self._range_blocks_remove(docid, value)
+            if not set:
+                self._merge_range_blocks(value)
+
         if not set:
             del self._fwd_index[value]
 
+        rank_index = self._rank_index
+        if rank_index is not None:
+            if docid in rank_index:
+                del rank_index[docid]
+                self._rank_state.changed()
+            if not set and value in self._value_ranks:
+                del self._value_ranks[value]
+
         self._num_docs.change(-1)
 
+    def build_ranks(self):
+        """ Build (or rebuild) the rank tables of this index, which are then
+        maintained as documents are indexed and unindexed.
+
+        The rank tables map each value to an integer rank which sorts the
+        same way as the value, and each docid to the rank of its value; the
+        ``RANKSORT`` and ``NUMPYSORT`` sort types (and ``sort_key``) compare
+        the ranks instead of the values.  Indexing a value which is new to
+        the index assigns it a rank, and two concurrent transactions which
+        both assign ranks conflict (one of them is retried), as they might
+        have given the same rank to different values."""
+        self._value_ranks = getattr(
+            self.family, self._value_ranks_type).BTree()
+        self._rank_index = self.family.II.BTree()
+        self._rank_state = _RankState()
+        self._renumber_ranks()
+
+    def drop_ranks(self):
+        """ Stop maintaining rank tables """
+        self._value_ranks = self._rank_index = self._rank_state = None
+        self._v_rank_arrays = self._v_value_arrays = None
+
+    def _rank_value(self, value):
+        """ Assign a rank to a value which is new to the forward index and
+        return it.  The new rank is placed between the ranks of the
+        neighbouring values; if there is no room left between them, the
+        ranks of the values around them are spread out first (see
+        ``_relabel_ranks``)."""
+        value_ranks = self._value_ranks
+        try:
+            lower = value_ranks[value_ranks.maxKey(value)]
+        except ValueError:
+            lower = None
+        try:
+            upper = value_ranks[value_ranks.minKey(value)]
+        except ValueError:
+            upper = None
+
+        family = self.family
+        if lower is None and upper is None:
+            rank = 0
+        elif upper is None:
+            # past the largest value; the step shrinks with the room left
+            # and the size of the index, so that a run of ascending values
+            # (e.g. timestamps) runs out of room less and less often as it
+            # grows
+            rank = lower + self._rank_step(family.maxint - lower)
+        elif lower is None:
+            rank = upper - self._rank_step(upper - family.minint)
+        else:
+            rank = lower + (upper - lower) // 2
+
+        if (rank == lower or rank == upper or
+                not family.minint <= rank <= family.maxint):
+            rank = self._relabel_ranks(value, lower, upper)
+        else:
+            value_ranks[value] = rank
+        self._rank_state.changed(allocated=True)
+        return rank
+
+    def _rank_step(self, room):
+        return min(RANK_GAP, room // (self._num_docs() + 2))
+
+    def _relabel_ranks(self, value, lower, upper):
+        """ Rank the new ``value``, for which there is no room between the
+        ranks ``lower`` and ``upper`` of its neighbours (either of which is
+        ``None`` at the ends), by spreading out the ranks of the values
+        around it, and return its rank.
+
+        Ranks are seen as offsets from ``family.minint``.  The values
+        relabelled are those whose offsets fall in a range of offsets which
+        contains the offset of a neighbour and is aligned on its own size, a
+        power of two.  A range of ``2 ** i`` offsets is sparse enough when it
+        holds at most ``2 ** (i * (1 - 2 / bits) - RANK_SLACK)`` values once
+        the new one is added, ``bits`` being the number of bits of the
+        ranks; the range relabelled is the largest sparse one at most
+        ``RANK_EXTRA_LEVELS`` levels above the smallest.  The density allowed
+        decreases as ranges grow, so the number of ranks changed for each new
+        value stays polylogarithmic in the number of possible ranks,
+        amortized, and only when the whole integer range is too dense are all
+        values renumbered (see ``_renumber_ranks``).
+
+        Half of the range is left around the new value, the values below and
+        above it sharing the outer quarters, since values tend to be added
+        again where one just was (e.g. a run of values approaching a
+        limit)."""
+        family = self.family
+        minint = family.minint
+        bits = (family.maxint - minint).bit_length()
+        if lower is None:
+            anchor = upper - minint
+        else:
+            anchor = lower - minint
+        value_ranks = self._value_ranks
+        # the values below and above the new one, nearest first, and the
+        # next one in each direction which is not in the range yet
+        below_items = descending_items(value_ranks, value)
+        above_items = iter(value_ranks.items(value))
+        below, above = [], []
+        next_below = next(below_items, None)
+        next_above = next(above_items, None)
+        base = 2 * 2 ** (-2.0 / bits)
+        found = first = None
+        for i in range(1, bits + 1):
+            start = (anchor >> i) << i
+            end = start + (1 << i)
+            while next_below is not None and next_below[1] - minint >= start:
+                below.append(next_below[0])
+                next_below = next(below_items, None)
+            while next_above is not None and next_above[1] - minint < end:
+                above.append(next_above[0])
+                next_above = next(above_items, None)
+            count = len(below) + len(above) + 1
+            if count << RANK_SLACK <= base ** i:
+                found = (start, end, len(below), len(above))
+                if first is None:
+                    first = i
+            elif found is not None:
+                break
+            if first is not None and i >= first + RANK_EXTRA_LEVELS:
+                break
+        if found is None:
+            self._renumber_ranks()
+            return value_ranks[value]
+
+        start, end, nbelow, nabove = found
+        quarter = (end - start) // 4
+        values = below[nbelow - 1::-1] if nbelow else []
+        values.append(value)
+        values.extend(above[:nabove])
+        offsets = [start + (j + 1) * quarter // (nbelow + 1)
+                   for j in range(nbelow)]
+        offsets.append(start + 2 * quarter)
+        offsets.extend(end - quarter + (j + 1) * quarter // (nabove + 1)
+                       for j in range(nabove))
+        # walk the forward index once over the values relabelled, rather
+        # than looking each of them up
+        fwd_items = self._fwd_index.items(values[0], values[-1])
+        rank_index = self._rank_index
+        new_ranks = []
+        for (v, docids), offset in zip(fwd_items, offsets):
+            rank = minint + offset
+            new_ranks.append((v, rank))
+            for docid in docids:
+                rank_index[docid] = rank
+        value_ranks.update(new_ranks)
+        return value_ranks[value]
+
+    def _renumber_ranks(self):
+        """ Spread the ranks of all values in the forward index evenly over
+        the middle half of the integer range and recompute the rank of every
+        docid.  The quarters left free at both ends make room for values
+        appended below the smallest or above the largest one."""
+        family = self.family
+        numvalues = len(self._fwd_index)
+        span = family.maxint - family.minint
+        gap = max(1, span // (2 * (numvalues + 1)))
+        value_ranks = self._value_ranks
+        rank_index = self._rank_index
+        value_ranks.clear()
+        rank = family.minint + (span - gap * max(0, numvalues - 1)) // 2
+        for value, docids in self._fwd_index.items():
+            value_ranks[value] = rank
+            for docid in docids:
+                rank_index[docid] = rank
+            rank += gap
+        self._rank_state.changed(allocated=True)
+
+    def build_range_blocks(self):
+        """ Build (or rebuild) the range blocks of this index, which are
+        then maintained as documents are indexed and unindexed.
+
+        Range blocks speed up range queries spanning many distinct values.
+        At each of ``range_block_levels`` levels, the keys of the forward
+        index are split into blocks of consecutive keys (of about
+        ``range_block_size`` blocks of the level below each), and the union
+        of the docids of each block is stored.  A range query then unions
+        the blocks lying wholly inside the range at the highest level
+        possible, and only descends to smaller blocks (and finally to single
+        values) at the edges of the range."""
+        IF = self.family.IF
+        fwd_type = getattr(self.family, self._fwd_type)
+        levels = tuple(
+            fwd_type.BTree() for i in range(self.range_block_levels))
+        # the start and accumulated docid sets of the last block of each
+        # level
+        pending = [None] * len(levels)
+
+        def flush(level):
+            if pending[level] is not None:
+                start, sets = pending[level]
+                levels[level][start] = IF.TreeSet(IF.multiunion(sets))
+
+        for value, docids in self._fwd_index.items():
+            for level in range(self._range_block_height()):
+                flush(level)
+                pending[level] = (value, [])
+            for block in pending:
+                if block is not None:
+                    block[1].append(docids)
+
+        for level in range(len(levels)):
+            flush(level)
+
+        self._range_blocks = levels
+
+    def drop_range_blocks(self):
+        """ Stop maintaining range blocks """
+        self._range_blocks = None
+
+    def _range_block_height(self):
+        # number of levels at which a key starts a block
+        height = 0
+        while (height < self.range_block_levels and
+               random.random() * self.range_block_size < 1):
+            height += 1
+        return height
+
+    def _range_blocks_insert(self, docid, value):
+        for level in self._range_blocks:
+            try:
+                start = level.maxKey(value)
+            except ValueError:
+                # the value precedes the first block of this level (and so
+                # of every higher level)
+                break
+            level[start].insert(docid)
+
+    def _range_blocks_remove(self, docid, value):
+        for level in self._range_blocks:
+            try:
+                start = level.maxKey(value)
+            except ValueError:
+                break
+            level[start].remove(docid)
+
+    def _split_range_blocks(self, value):
+        # a new key may start new blocks, splitting the blocks which
+        # contained it
+        IF = self.family.IF
+        below = self._fwd_index
+        for level in self._range_blocks[:self._range_block_height()]:
+            try:
+                end = level.minKey(value)
+            except ValueError:
+                end = None
+            # the blocks of the level below starting at the new key and
+            # ending before the next block of this level make up the new
+            # block
+            # (BTrees exclude the last key given excludemax and no max)
+            docids = IF.multiunion(list(
+                below.values(value, end, excludemax=end is not None)))
+            try:
+                start = level.maxKey(value)
+            except ValueError:
+                pass
+            else:
+                if docids:
+                    level[start] = IF.TreeSet(
+                        IF.difference(level[start], docids))
+            level[value] = IF.TreeSet(docids)
+            below = level
+
+    def _merge_range_blocks(self, value):
+        # a key being removed from the forward index stops starting blocks;
+        # its blocks are merged into the preceding ones
+        for level in self._range_blocks:
+            if value not in level:
+                break
+            docids = level.pop(value)
+            try:
+                start = level.maxKey(value)
+            except ValueError:
+                continue
+            level[start].update(docids)
+
+    def _range_sets(self, height, start, end, excludemin, excludemax):
+        # return a list of docid sets whose union is the docids of the
+        # values in the range, using the blocks of the levels up to height
+        if height == 0:
+            return list(self._fwd_index.values(
+                start, end, excludemin=excludemin, excludemax=excludemax))
+        level = self._range_blocks[height - 1]
+        blocks = list(level.items(
+            start, end, excludemin=excludemin, excludemax=excludemax))
+        if not blocks:
+            return self._range_sets(
+                height - 1, start, end, excludemin, excludemax)
+        # the values from the start of the range to the first block
+        first = blocks[0][0]
+        sets = self._range_sets(height - 1, start, first, excludemin, True)
+        # the blocks wholly inside the range
+        sets.extend([docids for value, docids in blocks[:-1]])
+        # the last block only lies wholly inside an unbounded range
+        last, docids = blocks[-1]
+        if end is None:
+            sets.append(docids)
+        else:
+            sets.extend(self._range_sets(
+                height - 1, last, end, False, excludemax))
+        return sets
+
     def reindex_doc(self, docid, value):
         """ See interface IIndexInjection """
         # the base index's index_doc method special-cases a reindex
@@ -191,7 +805,18 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         limit=None,
         sort_type=None,
         raise_unsortable=True,
+        after=None,
         ):
+        """ See interface IIndexSort
+
+        If ``after`` is passed, it should be the ``(value, docid)`` pair of
+        the last document of the previous page of a paginated listing; only
+        the documents following it are returned.  Each page then costs about
+        as much as the first one, however deep it is.  For this, documents
+        are ordered by value, then (whether ``reverse`` is true or not) by
+        ascending docid, which is also the order documents with equal
+        values are returned in when ``docids`` is a set of docids.
+        """
         if limit is not None:
             limit = int(limit)
             if limit < 1:
@@ -212,6 +837,18 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         elif sort_type == interfaces.OPTIMAL:
             sort_type = None
 
+        if after is not None:
+            if sort_type is None:
+                if fwscan_wins(limit, len(docids), numdocs):
+                    sort_type = interfaces.FWSCAN
+                else:
+                    sort_type = interfaces.NBEST
+            if sort_type == interfaces.FWSCAN:
+                return self.scan_after(
+                    docids, after, reverse, limit, raise_unsortable)
+            return self.select_after(
+                docids, after, reverse, limit, raise_unsortable)
+
         if reverse:
             return self.sort_reverse(
                 docids,
@@ -243,6 +880,11 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         # See http://www.zope.org/Members/Caseman/ZCatalog_for_2.6.1
         # for an overview of why we bother doing all this work to
         # choose the right sort algorithm.
+
+        model = self.sort_cost_model
+        if sort_type is None and model is not None:
+            sort_type = model.choose(
+                self.sort_types(False, limit), False, limit, rlen, numdocs)
         
         if sort_type is None:
             if fwscan_wins(limit, rlen, numdocs):
@@ -265,6 +907,10 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             return self.nbest_ascending(docids, limit, raise_unsortable)
         elif sort_type == interfaces.TIMSORT:
             return self.timsort_ascending(docids, limit, raise_unsortable)
+        elif sort_type == interfaces.RANKSORT:
+            return self.ranksort_ascending(docids, limit, raise_unsortable)
+        elif sort_type == interfaces.NUMPYSORT:
+            return self.numpysort_ascending(docids, limit, raise_unsortable)
         else:
             raise ValueError('Unknown sort type %s' % sort_type)
 
@@ -276,9 +922,19 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         sort_type=None,
         raise_unsortable=True,
         ):
+        rlen = len(docids)
+
+        model = self.sort_cost_model
+        if sort_type is None and model is not None:
+            sort_type = model.choose(
+                self.sort_types(True, limit), True, limit, rlen, numdocs)
+
         if sort_type is None:
-            rlen = len(docids)
-            if limit:
+            if fwscan_wins(limit, rlen, numdocs):
+                # a scan from the largest value down wins under the same
+                # conditions as a forward scan does for ascending sorts
+                sort_type = interfaces.FWSCAN
+            elif limit:
                 if (limit < 300) or (limit/float(rlen) > 0.09):
                     sort_type = interfaces.NBEST
                 else:
@@ -286,15 +942,118 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             else:
                 sort_type = interfaces.TIMSORT
 
-        if sort_type == interfaces.NBEST:
+        if sort_type == interfaces.FWSCAN:
+            return self.scan_reverse(docids, limit, raise_unsortable)
+        elif sort_type == interfaces.NBEST:
             if limit is None:
                 raise ValueError('nbest requires a limit')
             return self.nbest_descending(docids, limit, raise_unsortable)
         elif sort_type == interfaces.TIMSORT:
             return self.timsort_descending(docids, limit, raise_unsortable)
+        elif sort_type == interfaces.RANKSORT:
+            return self.ranksort_descending(docids, limit, raise_unsortable)
+        elif sort_type == interfaces.NUMPYSORT:
+            return self.numpysort_descending(docids, limit, raise_unsortable)
         else:
             raise ValueError('Unknown sort type %s' % sort_type)
 
+    def sort_key(self, reverse=False):
+        """ Return a callable which accepts a docid and a default, and which
+        returns a key ordering the docid by its value in this index (in
+        descending order if ``reverse`` is true), or the default if the docid
+        is not indexed.  Used to sort by several indexes at once (see
+        :meth:`hypatia.util.ResultSet.sort_by`)."""
+        rank_index = self._rank_index
+        if rank_index is not None:
+            get = rank_index.get
+            if not reverse:
+                return get
+            def reversed_rank(docid, default, get=get):
+                rank = get(docid, _marker)
+                if rank is _marker:
+                    return default
+                return -rank
+            return reversed_rank
+
+        get = self._rev_index.get
+        if not reverse:
+            return get
+        def reversed_value(docid, default, get=get):
+            value = get(docid, _marker)
+            if value is _marker:
+                return default
+            return _Reversed(value)
+        return reversed_value
+
+    def sort_types(self, reverse=False, limit=None):
+        """ Return the sort types which can be used to sort this index in the
+        given direction with the given limit."""
+        sort_types = [interfaces.FWSCAN, interfaces.TIMSORT]
+        if limit:
+            sort_types.append(interfaces.NBEST)
+        if self._rank_index is not None:
+            sort_types.append(interfaces.RANKSORT)
+            if numpy is not None:
+                sort_types.append(interfaces.NUMPYSORT)
+        return sort_types
+
+    def calibrate_sort(
+        self,
+        model=None,
+        sizes=(0.001, 0.01, 0.1, 0.5, 1.0),
+        limits=(1, 10, 100, 1000, None),
+        repeat=1,
+        ):
+        """ Time every applicable sort algorithm against random samples of
+        the docids in this index and fit ``model`` (a :class:`SortCostModel`,
+        a new one is created if it is ``None``) to the timings.  The model is
+        stored as the ``sort_cost_model`` of this index, which then uses it
+        to pick an algorithm whenever ``sort`` is not passed a sort type.
+
+        ``sizes`` are the sizes of the sampled result sets, as fractions of
+        the number of indexed documents, ``limits`` the limits to sort
+        them with and ``repeat`` the number of timings taken (the best one
+        is kept) for each combination.
+
+        Passing the same model to several indexes (e.g. all the field
+        indexes of a catalog) calibrates a single, shared model.
+
+        Returns the model."""
+        if model is None:
+            model = SortCostModel()
+
+        docids = list(self._rev_index.keys())
+        numdocs = len(docids)
+        if not numdocs:
+            raise ValueError('cannot calibrate an empty index')
+
+        rlens = sorted(set(max(1, int(numdocs * size)) for size in sizes))
+        for rlen in rlens:
+            sample = self.family.IF.Set(random.sample(docids, rlen))
+            for limit in limits:
+                if limit is not None and limit >= rlen:
+                    continue
+                for reverse in (False, True):
+                    for sort_type in self.sort_types(reverse, limit):
+                        timings = []
+                        for i in range(repeat):
+                            start = default_timer()
+                            for docid in self.sort(
+                                sample,
+                                reverse=reverse,
+                                limit=limit,
+                                sort_type=sort_type,
+                                raise_unsortable=False,
+                                ):
+                                pass
+                            timings.append(default_timer() - start)
+                        model.observe(sort_type, reverse, limit, rlen,
+                                      numdocs, min(timings))
+
+        model.fit()
+        self.sort_cost_model = model
+        return model
+
     def scan_forward(self, docids, limit=None, raise_unsortable=True):
         fwd_index = self._fwd_index
 
@@ -314,6 +1073,105 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         if raise_unsortable and docids:
             raise Unsortable(docids)
 
+    def scan_reverse(self, docids, limit=None, raise_unsortable=True):
+        # like scan_forward, but walks the forward index from its largest
+        # value down
+        # make a copy so we don't mutate what we're passed.
+        docids = self.family.IF.TreeSet(docids)
+
+        n = 0
+        for value, set in descending_items(self._fwd_index):
+            for docid in set:
+                if docid in docids:
+                    n+=1
+                    docids.remove(docid)
+                    yield docid
+                    if limit and n >= limit:
+                        return
+
+        if raise_unsortable and docids:
+            raise Unsortable(docids)
+
+    def scan_after(self, docids, after, reverse=False, limit=None,
+                   raise_unsortable=True):
+        # like scan_forward (or scan_reverse), but starts from the value of
+        # the (value, docid) pair after, skipping the docids of that value
+        # up to (and including) its docid
+        after_value, after_docid = after
+
+        # make a copy so we don't mutate what we're passed.
+        docids = self.family.IF.TreeSet(docids)
+
+        if reverse:
+            items = descending_items(self._fwd_index, after_value)
+        else:
+            items = self._fwd_index.items(after_value)
+
+        n = 0
+        for value, set in items:
+            if value == after_value:
+                set = set.keys(after_docid, excludemin=True)
+            for docid in set:
+                if docid in docids:
+                    n+=1
+                    docids.remove(docid)
+                    yield docid
+                    if limit and n >= limit:
+                        return
+
+        if raise_unsortable:
+            # the docids left over are either before the cursor or missing
+            rev_index = self._rev_index
+            missing_docids = [
+                docid for docid in docids if docid not in rev_index]
+            if missing_docids:
+                raise Unsortable(missing_docids)
+
+    def select_after(self, docids, after, reverse=False, limit=None,
+                     raise_unsortable=True):
+        # sort (or select the first limit of) the docids following the
+        # (value, docid) pair after
+        value, docid = after
+        get = self._rev_index.get
+        missing_docids = []
+        candidates = []
+        if reverse:
+            # order by descending value, then ascending docid
+            cursor = (value, -docid)
+            for docid in docids:
+                value = get(docid, _marker)
+                if value is _marker:
+                    missing_docids.append(docid)
+                    continue
+                item = (value, -docid)
+                if item < cursor:
+                    candidates.append(item)
+            if limit:
+                result = heapq.nlargest(limit, candidates)
+            else:
+                result = sorted(candidates, reverse=True)
+            for value, docid in result:
+                yield -docid
+        else:
+            cursor = (value, docid)
+            for docid in docids:
+                value = get(docid, _marker)
+                if value is _marker:
+                    missing_docids.append(docid)
+                    continue
+                item = (value, docid)
+                if item > cursor:
+                    candidates.append(item)
+            if limit:
+                result = heapq.nsmallest(limit, candidates)
+            else:
+                result = sorted(candidates)
+            for value, docid in result:
+                yield docid
+
+        if raise_unsortable and missing_docids:
+            raise Unsortable(missing_docids)
+
     def nbest_ascending(self, docids, limit, raise_unsortable=False):
         if limit is None: #pragma NO COVERAGE
             raise RuntimeError('n-best used without limit')
@@ -351,7 +1209,9 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             raise RuntimeError('N-Best used without limit')
         iterable = nsort(docids, self._rev_index, DESC)
         missing_docids = []
-        for value, docid in heapq.nlargest(limit, iterable):
+        # docids with equal values keep their order, as with other sorts
+        for value, docid in heapq.nlargest(limit, iterable,
+                                           key=itemgetter(0)):
             if value is DESC:
                 missing_docids.append(docid)
             else:
@@ -392,8 +1252,11 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                 missing_docids.append(k)
             return v
 
-        for docid in sorted(docids, key=get, reverse=reverse):
-            if docid in missing_docids:
+        sorted_docids = sorted(docids, key=get, reverse=reverse)
+        # a set, as testing membership in the list would be quadratic
+        missing = set(missing_docids)
+        for docid in sorted_docids:
+            if docid in missing:
                 # skip docids not in this index
                 continue
             n += 1
@@ -404,25 +1267,217 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         if raise_unsortable and missing_docids:
             raise Unsortable(missing_docids)
 
+    def ranksort_ascending(self, docids, limit, raise_unsortable=True):
+        return self._ranksort(
+            docids,
+            limit,
+            reverse=False,
+            raise_unsortable=raise_unsortable,
+            )
+
+    def ranksort_descending(self, docids, limit, raise_unsortable=True):
+        return self._ranksort(
+            docids,
+            limit,
+            reverse=True,
+            raise_unsortable=raise_unsortable,
+            )
+
+    def _ranksort(
+        self,
+        docids,
+        limit=None,
+        reverse=False,
+        raise_unsortable=True,
+        ):
+        # Like timsort (and stable like it), but compares the integer ranks
+        # of the values instead of the values themselves.
+        rank_index = self._rank_index
+        if rank_index is None:
+            for docid in self._timsort(docids, limit, reverse,
+                                       raise_unsortable):
+                yield docid
+            return
+
+        get = rank_index.get
+        missing_docids = []
+        ranked = []
+        for docid in docids:
+            rank = get(docid)
+            if rank is None:
+                missing_docids.append(docid)
+            else:
+                ranked.append((rank, docid))
+
+        key = itemgetter(0)
+        if limit and limit < len(ranked):
+            if reverse:
+                ranked = heapq.nlargest(limit, ranked, key=key)
+            else:
+                ranked = heapq.nsmallest(limit, ranked, key=key)
+        else:
+            ranked.sort(key=key, reverse=reverse)
+
+        for rank, docid in ranked:
+            yield docid
+
+        if raise_unsortable and missing_docids:
+            raise Unsortable(missing_docids)
+
+    def numpysort_ascending(self, docids, limit, raise_unsortable=True):
+        return self._numpysort(
+            docids,
+            limit,
+            reverse=False,
+            raise_unsortable=raise_unsortable,
+            )
+
+    def numpysort_descending(self, docids, limit, raise_unsortable=True):
+        return self._numpysort(
+            docids,
+            limit,
+            reverse=True,
+            raise_unsortable=raise_unsortable,
+            )
+
+    def _rank_arrays(self):
+        # the docids of the rank index and their ranks, as NumPy arrays;
+        # they are cached until the token of the rank state changes, which
+        # (unlike this index object) every change to the rank tables
+        # modifies, also in other connections
+        token = self._rank_state.token
+        cached = self._v_rank_arrays
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        rank_index = self._rank_index
+        count = len(rank_index)
+        arrays = (
+            numpy.fromiter(rank_index.keys(), numpy.int64, count),
+            numpy.fromiter(rank_index.values(), numpy.int64, count),
+            )
+        self._v_rank_arrays = (token, arrays)
+        return arrays
+
+    def _value_arrays(self):
+        # the ranks of the values, in order, as a NumPy array, and a list of
+        # the values; cached like the rank arrays
+        token = self._rank_state.token
+        cached = self._v_value_arrays
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        value_ranks = self._value_ranks
+        values = list(value_ranks.keys())
+        arrays = (
+            numpy.fromiter(value_ranks.values(), numpy.int64, len(values)),
+            values,
+            )
+        self._v_value_arrays = (token, arrays)
+        return arrays
+
+    def _rank_arrays_cached(self):
+        cached = self._v_rank_arrays
+        return cached is not None and cached[0] == self._rank_state.token
+
+    def _docid_ranks(self, docids):
+        # return a NumPy array of the docids found in the rank index, an
+        # array of their ranks and a list of the docids not found
+        all_docids, all_ranks = self._rank_arrays()
+        docids = numpy.fromiter(docids, numpy.int64)
+        positions = numpy.searchsorted(all_docids, docids)
+        found = positions < len(all_docids)
+        found[found] = all_docids[positions[found]] == docids[found]
+        return (docids[found], all_ranks[positions[found]],
+                docids[~found].tolist())
+
+    def _numpysort(
+        self,
+        docids,
+        limit=None,
+        reverse=False,
+        raise_unsortable=True,
+        ):
+        # Like ranksort (and stable like it), but looks up the ranks of all
+        # docids at once in NumPy arrays of the rank index (see
+        # _rank_arrays), and sorts or partitions them with NumPy.
+        if numpy is None or self._rank_index is None:
+            for docid in self._ranksort(docids, limit, reverse,
+                                        raise_unsortable):
+                yield docid
+            return
+
+        docids, ranks, missing_docids = self._docid_ranks(docids)
+
+        if reverse:
+            # a stable descending sort is a stable ascending sort of the
+            # reversed ranks, reversed
+            docids = docids[::-1]
+            ranks = ranks[::-1]
+        n = len(ranks)
+        if limit and limit < n:
+            # partition to find the rank of the limit-th docid, then sort
+            # only the docids which rank no further
+            if reverse:
+                threshold = numpy.partition(ranks, n - limit)[n - limit]
+                candidates = numpy.flatnonzero(ranks >= threshold)
+            else:
+                threshold = numpy.partition(ranks, limit - 1)[limit - 1]
+                candidates = numpy.flatnonzero(ranks <= threshold)
+            docids = docids[candidates]
+            ranks = ranks[candidates]
+        order = numpy.argsort(ranks, kind='mergesort')
+        if reverse:
+            order = order[::-1]
+        result = docids[order]
+        if limit:
+            result = result[:limit]
+
+        for docid in result.tolist():
+            yield docid
+
+        if raise_unsortable and missing_docids:
+            raise Unsortable(missing_docids)
+
     def search(self, queries, operator='or'):
+        IF = self.family.IF
         sets = []
+        points = []
         for q in queries:
             if isinstance(q, RangeValue):
-                q = q.as_tuple()
+                sets.append(self.applyInRange(*q.as_tuple()))
             else:
-                q = (q, q)
-            set = self.family.IF.multiunion(self._fwd_index.values(*q))
-            sets.append(set)
+                points.append(q)
+
+        if points:
+            # look the point values up in order (so that neighbouring
+            # lookups share the same BTree nodes), once each
+            points.sort()
+            values = points[:1]
+            for value in points[1:]:
+                if value != values[-1]:
+                    values.append(value)
+            if operator == 'and' and len(values) > 1:
+                # a document only has one value
+                return IF.Set()
+            get = self._fwd_index.get
+            for value in values:
+                set = get(value)
+                if set is None:
+                    set = IF.Set()
+                # copied by the multiunion or intersection below
+                sets.append(set)
 
         result = None
 
-        if len(sets) == 1:
+        if len(sets) == 1 and not points:
             result = sets[0]
         elif operator == 'and':
-            for _, set in sorted([(len(x), x) for x in sets]):
-                result = self.family.IF.intersection(set, result)
+            for set in sorted(sets, key=len):
+                result = IF.intersection(set, result)
+            if len(sets) == 1:
+                # don't hand out the forward index set itself
+                result = IF.Set(result)
         else:
-            result = self.family.IF.multiunion(sets)
+            result = IF.multiunion(sets)
 
         return result
 
@@ -496,6 +1551,13 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         return query.NotAny(self, value)
 
     def applyInRange(self, start, end, excludemin=False, excludemax=False):
+        range_blocks = self._range_blocks
+        if range_blocks is not None:
+            # an open end excludes nothing
+            excludemin = excludemin and start is not None
+            excludemax = excludemax and end is not None
+            return self.family.IF.multiunion(self._range_sets(
+                len(range_blocks), start, end, excludemin, excludemax))
         return self.family.IF.multiunion(
             self._fwd_index.values(
                 start, end, excludemin=excludemin, excludemax=excludemax)
@@ -511,6 +1573,268 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
     def notinrange(self, start, end, excludemin=False, excludemax=False):
         return query.NotInRange(self, start, end, excludemin, excludemax)
 
+class IntegerFieldIndex(FieldIndex):
+    """ A field index for integer values.
+
+    The forward and reverse indexes are keyed and valued by integers
+    (``family.IO`` and ``family.II`` BTrees), so value comparisons happen in
+    C and values are stored compactly.  Values must be integers within the
+    bounds of the index family (``family.minint`` to ``family.maxint``);
+    indexing any other value raises a ValueError.
+
+    Query values may be any real numbers: a range bound which is not an
+    integer is rounded towards the inside of the range, and a point query
+    for a value which is not an integer of the family matches nothing.
+    Other query values raise a ValueError.
+    """
+
+    _fwd_type = 'IO'
+    _rev_type = 'II'
+    _value_ranks_type = 'II'
+
+    def discriminate(self, obj, default):
+        """ See interface IIndexInjection """
+        value = super(IntegerFieldIndex, self).discriminate(obj, default)
+        if value is default:
+            return value
+        if not isinstance(value, numbers.Integral):
+            raise ValueError('%r is not an integer' % (value,))
+        value = int(value)
+        if not self.family.minint <= value <= self.family.maxint:
+            raise ValueError('%r is out of the bounds of the index family' %
+                             value)
+        return value
+
+    def _int_key(self, value):
+        # the integer equal to the real number value, or None if no
+        # integer of the family is
+        if not isinstance(value, _REAL_TYPES):
+            raise ValueError('%r is not a number' % (value,))
+        if value != value:
+            # NaN
+            return None
+        if not self.family.minint <= value <= self.family.maxint:
+            return None
+        key = int(value)
+        if key != value:
+            return None
+        return key
+
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             raise_unsortable=True, after=None):
+        if after is not None:
+            value, docid = after
+            key = self._int_key(value)
+            if key is None:
+                raise ValueError('%r is not an integer value of the index' %
+                                 (value,))
+            after = (key, docid)
+        return super(IntegerFieldIndex, self).sort(
+            docids, reverse=reverse, limit=limit, sort_type=sort_type,
+            raise_unsortable=raise_unsortable, after=after)
+
+    def search(self, queries, operator='or'):
+        keys = []
+        for q in queries:
+            if not isinstance(q, RangeValue):
+                q = self._int_key(q)
+                if q is None:
+                    # no document has this value
+                    if operator == 'and':
+                        return self.family.IF.Set()
+                    continue
+            keys.append(q)
+        return super(IntegerFieldIndex, self).search(keys, operator)
+
+    def applyInRange(self, start, end, excludemin=False, excludemax=False):
+        family = self.family
+        for bound in start, end:
+            if bound is not None:
+                if not isinstance(bound, _REAL_TYPES):
+                    raise ValueError('%r is not a number' % (bound,))
+                if bound != bound:
+                    # nothing compares with NaN
+                    return family.IF.Set()
+        if start is not None:
+            if start > family.maxint:
+                return family.IF.Set()
+            if start < family.minint:
+                start = None
+            else:
+                key = int(math.ceil(start))
+                if key != start:
+                    excludemin = False
+                start = key
+        if end is not None:
+            if end < family.minint:
+                return family.IF.Set()
+            if end > family.maxint:
+                end = None
+            else:
+                key = int(math.floor(end))
+                if key != end:
+                    excludemax = False
+                end = key
+        return super(IntegerFieldIndex, self).applyInRange(
+            start, end, excludemin=excludemin, excludemax=excludemax)
+
+class FloatFieldIndex(FieldIndex):
+    """ A field index for floating point values (e.g. timestamps).
+
+    Values are stored as 64-bit integers which sort the same way as the
+    values themselves (see ``float_key``), in ``family.IO`` and
+    ``family.II`` BTrees, so value comparisons happen in C and values are
+    stored compactly.  (BTrees with float values only hold single precision
+    floats, which would lose most of the precision of e.g. timestamps.)
+    This requires the 64-bit BTree family.
+
+    Integers and other real numbers are indexed as floats; indexing NaN or
+    any other value raises a ValueError.  Query values are converted in the
+    same way.
+    """
+
+    _fwd_type = 'IO'
+    _rev_type = 'II'
+    _value_ranks_type = 'II'
+
+    def __init__(self, discriminator, family=None, range_blocks=False,
+                 ranks=False):
+        if family is not None and family.maxint < _INT64_MAX:
+            raise ValueError('FloatFieldIndex requires the 64-bit family')
+        super(FloatFieldIndex, self).__init__(
+            discriminator, family=family, range_blocks=range_blocks,
+            ranks=ranks)
+
+    def discriminate(self, obj, default):
+        """ See interface IIndexInjection """
+        value = super(FloatFieldIndex, self).discriminate(obj, default)
+        if value is default:
+            return value
+        return float_key(value)
+
+    def unique_values(self):
+        """ Return the unique values in the index for all docids as an iterable
+        """
+        return [float_value(key) for key in self._fwd_index.keys()]
+
+    def document_repr(self, docid, default=None):
+        result = self._rev_index.get(docid, default)
+        if result is not default:
+            return repr(float_value(result))
+        return default
+
+    def min_value(self, docids=None, default=None):
+        key = super(FloatFieldIndex, self).min_value(docids, _marker)
+        if key is _marker:
+            return default
+        return float_value(key)
+
+    def max_value(self, docids=None, default=None):
+        key = super(FloatFieldIndex, self).max_value(docids, _marker)
+        if key is _marker:
+            return default
+        return float_value(key)
+
+    def _value_counts(self, docids):
+        counts = super(FloatFieldIndex, self)._value_counts(docids)
+        return [(float_value(key), count) for key, count in counts]
+
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             raise_unsortable=True, after=None):
+        if after is not None:
+            value, docid = after
+            after = (float_key(value), docid)
+        return super(FloatFieldIndex, self).sort(
+            docids, reverse=reverse, limit=limit, sort_type=sort_type,
+            raise_unsortable=raise_unsortable, after=after)
+
+    def search(self, queries, operator='or'):
+        keys = []
+        for q in queries:
+            if not isinstance(q, RangeValue):
+                q = float_key(q)
+            keys.append(q)
+        return super(FloatFieldIndex, self).search(keys, operator)
+
+    def applyInRange(self, start, end, excludemin=False, excludemax=False):
+        if start is not None:
+            start = float_key(start)
+        if end is not None:
+            end = float_key(end)
+        return super(FloatFieldIndex, self).applyInRange(
+            start, end, excludemin=excludemin, excludemax=excludemax)
+
+# Decimal is not registered as a numbers.Real
+_REAL_TYPES = (numbers.Real, decimal.Decimal)
+
+_INT64_MAX = (1 << 63) - 1
+
+def float_key(value):
+    """ Return a 64-bit integer which sorts the same way among the keys of
+    other floats as the float ``value`` among other floats.
+
+    Raises ValueError if ``value`` is not a real number or is NaN.
+    """
+    if not isinstance(value, numbers.Real):
+        raise ValueError('%r is not a real number' % (value,))
+    value = float(value)
+    if value != value:
+        raise ValueError('NaN cannot be indexed')
+    # adding 0.0 turns -0.0 into 0.0
+    key = struct.unpack('<q', struct.pack('<d', value + 0.0))[0]
+    if key < 0:
+        # the bits of a negative float are its sign bit and its magnitude;
+        # flip the magnitude bits so that larger magnitudes sort first
+        key ^= _INT64_MAX
+    return key
+
+def float_value(key):
+    """ Return the float whose ``float_key`` is ``key`` """
+    if key < 0:
+        key ^= _INT64_MAX
+    return struct.unpack('<d', struct.pack('<q', key))[0]
+
+def descending_items(tree, max=None):
+    """ Yield the ``(key, value)`` pairs of a BTree in descending key order,
+    starting from the largest key not greater than ``max`` if it is passed.
+
+    BTrees can only be iterated in ascending order (and indexing their items
+    from the end walks every bucket), so this walks the internal nodes of the
+    tree, as exposed by their state, from the rightmost bucket leftwards;
+    only the nodes holding the keys actually yielded are loaded."""
+    state = tree.__getstate__()
+    if state is None:
+        return
+    data = state[0]
+    if len(data) == 1 and isinstance(data[0], tuple):
+        # a node with a single bucket stores the bucket's state inline
+        for item in _descending_bucket_items(data[0], max):
+            yield item
+        return
+    tree_type = type(tree)
+    for i in range(len(data) - 1, -1, -2):
+        # data alternates children and the smallest keys of all children
+        # but the first
+        if max is not None and i and data[i - 1] > max:
+            continue
+        child = data[i]
+        if isinstance(child, tree_type):
+            items = descending_items(child, max)
+        else:
+            items = _descending_bucket_items(child.__getstate__(), max)
+        for item in items:
+            yield item
+        # every key of the children to the left is smaller
+        max = None
+
+def _descending_bucket_items(state, max=None):
+    items = state[0]
+    end = len(items)
+    if max is not None:
+        end = 2 * bisect.bisect_right(items[::2], max)
+    for i in range(end - 2, -1, -2):
+        yield items[i], items[i + 1]
+
 def nsort(docids, rev_index, missing):
     for docid in docids:
         try:
@@ -533,11 +1857,192 @@ class _MissingValue(object):
             return True
         return False
 
+@total_ordering
+class _Reversed(object):
+    """ Wraps a value to invert its ordering """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+# The least number of docids for which value counts are computed with NumPy
+# (when it is installed) rather than by looking up each docid.
+NUMPY_COUNT_MIN = 1000
+
+# The largest distance between the rank of a value added below the smallest
+# or above the largest value and the rank of its neighbour; leaves room to
+# insert new values between them without renumbering.
+RANK_GAP = 1 << 16
+
+# Bound the density of the ranges of ranks relabelled when a new value has no
+# room between its neighbours (see ``FieldIndex._relabel_ranks``).
+RANK_SLACK = 3
+RANK_EXTRA_LEVELS = 2
+
+class _RankState(persistent.Persistent):
+    """ The state of the rank tables of a field index shared by concurrent
+    transactions.
+
+    ``allocations`` counts the rank assignments (a value ranked, relabelled
+    or renumbered).  Two concurrent transactions which both assign ranks
+    may have given the same rank to different values, so they conflict;
+    other concurrent changes to the rank tables are merged by the BTrees
+    themselves.  ``token`` is replaced by a new random one with every change
+    to the rank tables (including merged ones), so that data derived from
+    the rank tables can be cached until it changes.
+    """
+
+    def __init__(self):
+        self.allocations = 0
+        self.token = _new_token()
+
+    def changed(self, allocated=False):
+        if allocated:
+            self.allocations += 1
+        self.token = _new_token()
+
+    def _p_resolveConflict(self, old, committed, new):
+        if (committed['allocations'] != old['allocations'] and
+                new['allocations'] != old['allocations']):
+            raise ConflictError
+        state = dict(new)
+        state['allocations'] = max(committed['allocations'],
+                                   new['allocations'])
+        state['token'] = _new_token()
+        return state
+
+def _new_token():
+    return random.getrandbits(64)
+
 # for nbest sort, we need 2 sentinels; one which is greater than anything else
 # (ASC) and one which is less than anything else (DESC).
 ASC = _MissingValue(True)
 DESC = _MissingValue(False)
 
+class SortCostModel(persistent.Persistent):
+    """ Predicts how long each sort algorithm takes to sort a result set.
+
+    The cost of an algorithm is modelled as a linear combination of two
+    features computed from the number of docids in the index (``numdocs``),
+    the number of docids to sort (``rlen``) and the ``limit`` (see
+    :func:`sort_features`), with one pair of coefficients for each sort type
+    and direction.  The coefficients are fitted by least squares against
+    timings recorded with ``observe``; :meth:`FieldIndex.calibrate_sort`
+    gathers those timings from a live index.
+    """
+
+    def __init__(self):
+        # (sort_type, reverse) -> (coef, coef)
+        self.coefficients = {}
+        # (sort_type, reverse) -> [((feature, feature), seconds), ...]
+        self.observations = {}
+
+    def observe(self, sort_type, reverse, limit, rlen, numdocs, seconds):
+        """ Record that sorting ``rlen`` docids out of ``numdocs`` using
+        ``sort_type`` took ``seconds``."""
+        features = sort_features(sort_type, limit, rlen, numdocs)
+        key = (sort_type, bool(reverse))
+        self.observations.setdefault(key, []).append((features, seconds))
+        self._p_changed = True
+
+    def fit(self):
+        """ Fit the coefficients of every sort type to the recorded
+        observations."""
+        coefficients = {}
+        for key, observations in self.observations.items():
+            coefficients[key] = fit_nonnegative(observations)
+        self.coefficients = coefficients
+
+    def predict(self, sort_type, reverse, limit, rlen, numdocs):
+        """ Return the predicted duration of a sort in seconds, or ``None``
+        if the model has not been calibrated for ``sort_type``."""
+        coefs = self.coefficients.get((sort_type, bool(reverse)))
+        if coefs is None:
+            return None
+        features = sort_features(sort_type, limit, rlen, numdocs)
+        return sum(c * f for c, f in zip(coefs, features))
+
+    def choose(self, sort_types, reverse, limit, rlen, numdocs):
+        """ Return the sort type out of ``sort_types`` with the lowest
+        predicted cost.  Return ``None`` if the model has not been calibrated
+        for any of them."""
+        best = None
+        best_cost = None
+        for sort_type in sort_types:
+            cost = self.predict(sort_type, reverse, limit, rlen, numdocs)
+            if cost is not None and (best_cost is None or cost < best_cost):
+                best = sort_type
+                best_cost = cost
+        return best
+
+def sort_features(sort_type, limit, rlen, numdocs):
+    """ Return the two cost model features of a sort algorithm.  Every
+    algorithm pays a per-docid cost (``rlen``); the second feature estimates
+    the work which is specific to the algorithm."""
+    if sort_type == interfaces.FWSCAN:
+        # number of indexed docids visited before ``limit`` of those in the
+        # result set are found
+        if limit:
+            visited = min(numdocs, limit * numdocs / float(rlen))
+        else:
+            visited = numdocs
+        return (rlen, visited)
+    if sort_type == interfaces.NBEST:
+        return (rlen, limit * math.log(limit + 1, 2))
+    return (rlen, rlen * math.log(rlen + 1, 2))
+
+def fit_nonnegative(observations):
+    """ Least squares fit of two nonnegative coefficients to a sequence of
+    ``((feature, feature), value)`` observations."""
+    sxx = sxy = syy = sxt = syt = 0.0
+    for (x, y), t in observations:
+        sxx += x * x
+        sxy += x * y
+        syy += y * y
+        sxt += x * t
+        syt += y * t
+
+    det = sxx * syy - sxy * sxy
+    if det > 0:
+        a = (syy * sxt - sxy * syt) / det
+        b = (sxx * syt - sxy * sxt) / det
+        if a >= 0 and b >= 0:
+            return (a, b)
+
+    # fall back to the best fit using a single feature
+    candidates = []
+    if sxx:
+        candidates.append((max(sxt / sxx, 0.0), 0.0))
+    if syy:
+        candidates.append((0.0, max(syt / syy, 0.0)))
+    if not candidates:
+        return (0.0, 0.0)
+
+    def residual(coefs):
+        a, b = coefs
+        return sum((a * x + b * y - t) ** 2 for (x, y), t in observations)
+
+    return min(candidates, key=residual)
+
+def fwcount_wins(numvalues, rlen, numdocs):
+    """
+    Return True if counting the docids of a result set by value is likely
+    faster by intersecting the result set with the forward index set of
+    each value than by looking up the value of each docid.
+
+    Looking up a value costs about as much as intersecting 20 docids of a
+    forward index set, or 75 docids of the result set, in C; a forward count
+    visits every set (i.e. every indexed docid) and the result set once per
+    value.
+    """
+    return numdocs / 20.0 + numvalues * rlen / 75.0 < rlen
+
 def fwscan_wins(limit, rlen, numdocs):
     """
     Primitive curve-fitting to see if forward scan will beat both
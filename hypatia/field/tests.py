@@ -1,6 +1,11 @@
 import unittest
 import doctest
 
+try:
+    import numpy as _numpy
+except ImportError: # pragma NO COVER
+    _numpy = None
+
 _marker = object()
 
 class FieldIndexTests(unittest.TestCase):
@@ -9,7 +14,7 @@ class FieldIndexTests(unittest.TestCase):
         from . import FieldIndex
         return FieldIndex
 
-    def _makeOne(self, discriminator=None, family=None):
+    def _makeOne(self, discriminator=None, family=None, ranks=True):
         def _discriminator(obj, default):
             if obj is _marker:
                 return default
@@ -17,7 +22,7 @@ class FieldIndexTests(unittest.TestCase):
         if discriminator is None:
             discriminator = _discriminator
         return self._getTargetClass()(discriminator=discriminator,
-                                      family=family)
+                                      family=family, ranks=ranks)
     def _populateIndex(self, index):
         index.index_doc(5, 1) # docid, obj
         index.index_doc(2, 2)
@@ -454,14 +459,77 @@ class FieldIndexTests(unittest.TestCase):
         c1 = IFSet([1, 2, 3, 4, 5])
         self.assertRaises(ValueError, index.sort, c1, sort_type='nonesuch')
 
-    def test_sort_bad_sort_type_reverse_fwscan(self):
+    def test_sort_force_fwscan_reverse_no_limit(self):
         from BTrees.IFBTree import IFSet
         from ..interfaces import FWSCAN
         index = self._makeOne()
         self._populateIndex(index)
         c1 = IFSet([1, 2, 3, 4, 5])
-        self.assertRaises(ValueError,
-                          index.sort, c1, reverse=True, sort_type=FWSCAN)
+        result = index.sort(c1, reverse=True, sort_type=FWSCAN)
+        self.assertEqual(list(result), [4, 3, 1, 2, 5])
+
+    def test_sort_force_fwscan_reverse_w_limit(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import FWSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, reverse=True, limit=2, sort_type=FWSCAN)
+        self.assertEqual(list(result), [4, 3])
+
+    def test_sort_force_fwscan_reverse_many_values(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import FWSCAN
+        index = self._makeOne()
+        for i in range(1000):
+            index.index_doc(i, i // 2)
+        c1 = IFSet(range(0, 1000, 3))
+        result = index.sort(c1, reverse=True, limit=5, sort_type=FWSCAN)
+        self.assertEqual(list(result), [999, 996, 993, 990, 987])
+        result = index.sort(c1, reverse=True, sort_type=FWSCAN)
+        self.assertEqual(list(result), list(range(999, -1, -3)))
+
+    def test_sort_force_fwscan_reverse_missing_docid(self):
+        from hypatia.exc import Unsortable
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import FWSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, reverse=True, sort_type=FWSCAN)
+        dids = []
+        try:
+            for did in result:
+                dids.append(did)
+        except Unsortable as e:
+            self.assertEqual(list(e.docids), [99])
+        else: # pragma: no cover
+            raise AssertionError('Unsortable not raised')
+        self.assertEqual(dids, [4, 3, 1, 2, 5])
+
+    def test_sort_force_fwscan_reverse_missing_docid_raise_unsortable_f(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import FWSCAN
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, reverse=True, sort_type=FWSCAN,
+                            raise_unsortable=False)
+        self.assertEqual(list(result), [4, 3, 1, 2, 5])
+
+    def test_sort_noforce_reverse_fwscan(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        called = []
+        def scan_reverse(docids, limit, raise_unsortable):
+            called.append(limit)
+            return []
+        index.scan_reverse = scan_reverse
+        # the result set is nearly the whole index
+        c1 = IFSet([1, 2, 3, 4, 5, 6, 7, 8, 9])
+        index.sort(c1, reverse=True, limit=3)
+        self.assertEqual(called, [3])
 
     def test_sort_bad_sort_type_reverse(self):
         from BTrees.IFBTree import IFSet
@@ -765,6 +833,696 @@ class FieldIndexTests(unittest.TestCase):
         result = index.sort(c1, reverse=True, limit=3, sort_type=NBEST)
         self.assertEqual(list(result), [4, 3, 1])
 
+    def test_sort_force_ranksort_no_limit(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, sort_type=RANKSORT)
+        self.assertEqual(list(result), [5, 2, 1, 3, 4])
+
+    def test_sort_force_ranksort_w_limit(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, limit=3, sort_type=RANKSORT)
+        self.assertEqual(list(result), [5, 2, 1])
+
+    def test_sort_force_ranksort_reverse(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, reverse=True, sort_type=RANKSORT)
+        self.assertEqual(list(result), [4, 3, 1, 2, 5])
+        result = index.sort(c1, reverse=True, limit=2, sort_type=RANKSORT)
+        self.assertEqual(list(result), [4, 3])
+
+    def test_sort_force_ranksort_is_stable(self):
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        index.index_doc(1, 'b')
+        index.index_doc(2, 'a')
+        index.index_doc(3, 'b')
+        index.index_doc(4, 'a')
+        result = index.sort([3, 4, 1, 2], sort_type=RANKSORT)
+        self.assertEqual(list(result), [4, 2, 3, 1])
+        result = index.sort([3, 4, 1, 2], reverse=True, sort_type=RANKSORT)
+        self.assertEqual(list(result), [3, 1, 4, 2])
+
+    def test_sort_force_ranksort_missing_docid(self):
+        from hypatia.exc import Unsortable
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, sort_type=RANKSORT)
+        dids = []
+        try:
+            for did in result:
+                dids.append(did)
+        except Unsortable as e:
+            self.assertEqual(list(e.docids), [99])
+        else: # pragma: no cover
+            raise AssertionError('Unsortable not raised')
+        self.assertEqual(dids, [5, 2, 1, 3, 4])
+
+    def test_sort_force_ranksort_missing_docid_raise_unsortable_false(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        c1 = IFSet([1, 2, 3, 4, 5, 99])
+        result = index.sort(c1, sort_type=RANKSORT, raise_unsortable=False)
+        self.assertEqual(list(result), [5, 2, 1, 3, 4])
+
+    def test_sort_force_ranksort_without_rank_tables(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        # indexes persisted before rank tables existed
+        index._value_ranks = index._rank_index = None
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, limit=3, sort_type=RANKSORT)
+        self.assertEqual(list(result), [5, 2, 1])
+
+    def test_ranks_follow_value_order(self):
+        index = self._makeOne()
+        for docid, value in enumerate(['m', 'c', 'x', 'a', 'n', 'm', 'z']):
+            index.index_doc(docid, value)
+        ranks = index._value_ranks
+        values = list(ranks.keys())
+        self.assertEqual(values, ['a', 'c', 'm', 'n', 'x', 'z'])
+        self.assertEqual([ranks[v] for v in values],
+                         sorted([ranks[v] for v in values]))
+        self.assertEqual(len(set(ranks.values())), len(values))
+        for docid, value in index._rev_index.items():
+            self.assertEqual(index._rank_index[docid], ranks[value])
+
+    def _assertSameState(self, index, other):
+        def items(index):
+            return [(value, list(docids))
+                    for value, docids in index._fwd_index.items()]
+        self.assertEqual(items(index), items(other))
+        self.assertEqual(list(index._rev_index.items()),
+                         list(other._rev_index.items()))
+        self.assertEqual(list(index._not_indexed), list(other._not_indexed))
+        self.assertEqual(index.indexed_count(), other.indexed_count())
+        # ranks depend on the order values were added in, but they must
+        # agree with the values
+        ranks = list(index._value_ranks.items())
+        self.assertEqual([value for value, rank in ranks],
+                         list(index._fwd_index.keys()))
+        self.assertEqual([rank for value, rank in ranks],
+                         sorted(rank for value, rank in ranks))
+        for docid, value in index._rev_index.items():
+            self.assertEqual(index._rank_index[docid],
+                             index._value_ranks[value])
+
+    def test_index_docs_empty_index(self):
+        index = self._makeOne()
+        other = self._makeOne()
+        docs = [(docid, docid % 7) for docid in range(100)]
+        docs.append((100, _marker))
+        docs.append((3, 50))
+        index.index_docs(iter(docs))
+        for docid, value in docs:
+            other.index_doc(docid, value)
+        self._assertSameState(index, other)
+        self.assertEqual(len(set(index._value_ranks.values())), 8)
+
+    def test_index_docs_populated_index(self):
+        import random
+        index = self._makeOne()
+        other = self._makeOne()
+        for docid in range(0, 200, 2):
+            index.index_doc(docid, docid % 13)
+            other.index_doc(docid, docid % 13)
+        index.index_doc(1, _marker)
+        other.index_doc(1, _marker)
+        docs = []
+        for i in range(300):
+            value = random.choice([_marker, random.randrange(20)])
+            docs.append((random.randrange(300), value))
+        index.index_docs(docs)
+        for docid, value in docs:
+            other.index_doc(docid, value)
+        self._assertSameState(index, other)
+
+    def test_index_docs_many_new_values(self):
+        index = self._makeOne()
+        other = self._makeOne()
+        for docid in range(10):
+            index.index_doc(docid, docid * 100)
+            other.index_doc(docid, docid * 100)
+        docs = [(docid, docid * 3) for docid in range(10, 300)]
+        index.index_docs(docs)
+        for docid, value in docs:
+            other.index_doc(docid, value)
+        self._assertSameState(index, other)
+
+    def test_index_docs_bad_value_changes_nothing(self):
+        from . import IntegerFieldIndex
+        index = IntegerFieldIndex(lambda obj, default: obj)
+        self.assertRaises(ValueError, index.index_docs,
+                          [(1, 1), (2, 'two'), (3, 3)])
+        self.assertEqual(index.indexed_count(), 0)
+        self.assertEqual(list(index._fwd_index.keys()), [])
+
+    def test_value_counts(self):
+        index = self._makeOne()
+        for docid in range(30):
+            index.index_doc(docid, docid % 4)
+        index.index_doc(30, 7)
+        self.assertEqual(index.value_counts(range(10)),
+                         [(0, 3), (1, 3), (2, 2), (3, 2)])
+        self.assertEqual(index.value_counts(range(10), limit=3),
+                         [(0, 3), (1, 3), (2, 2)])
+        self.assertEqual(index.value_counts([30, 1, 99]), [(1, 1), (7, 1)])
+        self.assertEqual(index.value_counts([]), [])
+        self.assertEqual(index.value_counts(index.family.IF.Set()), [])
+
+    def test_min_value_max_value(self):
+        index = self._makeOne()
+        self.assertEqual(index.min_value(), None)
+        self.assertEqual(index.max_value(default=0), 0)
+        self._populateIndex(index)
+        self.assertEqual(index.min_value(), 1)
+        self.assertEqual(index.max_value(), 11)
+        self.assertEqual(index.min_value([1, 3, 99]), 3)
+        self.assertEqual(index.max_value([1, 3, 99]), 4)
+        self.assertEqual(index.min_value([99]), None)
+        self.assertEqual(index.max_value([], default=0), 0)
+
+    def test_stats(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.stats([1, 3, 4, 99]),
+                         {'count': 3, 'min': 3, 'max': 5, 'sum': 12,
+                          'mean': 4.0})
+        self.assertEqual(index.stats([99]),
+                         {'count': 0, 'min': None, 'max': None})
+
+    def test_stats_decimals(self):
+        from decimal import Decimal
+        index = self._makeOne()
+        index.index_doc(1, Decimal('9.99'))
+        index.index_doc(2, Decimal('20.00'))
+        index.index_doc(3, 5)
+        self.assertEqual(index.stats([1, 2]),
+                         {'count': 2, 'min': Decimal('9.99'),
+                          'max': Decimal('20.00'), 'sum': Decimal('29.99'),
+                          'mean': Decimal('14.995')})
+        stats = index.stats([1, 2, 3])
+        self.assertEqual(stats['sum'], Decimal('34.99'))
+        self.assertTrue(isinstance(stats['mean'], Decimal))
+
+    def test_stats_decimals_and_floats(self):
+        from decimal import Decimal
+        index = self._makeOne()
+        index.index_doc(1, Decimal('9.99'))
+        index.index_doc(2, 20.5)
+        self.assertEqual(index.stats([1, 2]),
+                         {'count': 2, 'min': Decimal('9.99'), 'max': 20.5})
+
+    def test_stats_not_numbers(self):
+        index = self._makeOne()
+        index.index_doc(1, 'a')
+        index.index_doc(2, 'c')
+        index.index_doc(3, 'a')
+        self.assertEqual(index.stats([1, 2, 3]),
+                         {'count': 3, 'min': 'a', 'max': 'c'})
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_value_counts_numpy(self):
+        import random
+        index = self._makeOne()
+        for docid in range(5000):
+            index.index_doc(docid, random.randrange(1000))
+        docids = index.family.IF.Set(random.sample(range(6000), 3000))
+        self.assertEqual(index._value_counts_numpy(docids),
+                         index._value_counts_reverse(docids))
+        stats = index.stats(docids)
+        self.assertTrue(index._rank_arrays_cached())
+        values = [index._rev_index[docid] for docid in docids
+                  if docid in index._rev_index]
+        self.assertEqual(stats['count'], len(values))
+        self.assertEqual(stats['min'], min(values))
+        self.assertEqual(stats['max'], max(values))
+        self.assertEqual(stats['sum'], sum(values))
+        index.index_doc(0, 5000)
+        self.assertFalse(index._rank_arrays_cached())
+
+    def test_value_counts_bad_limit(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.value_counts, [1], limit=0)
+
+    def test_value_counts_strategies_agree(self):
+        import random
+        index = self._makeOne()
+        for docid in range(2000):
+            index.index_doc(docid, random.randrange(10))
+        for rlen in (1, 20, 500, 1900):
+            docids = index.family.IF.Set(random.sample(range(2100), rlen))
+            self.assertEqual(index._value_counts_forward(docids),
+                             index._value_counts_reverse(docids))
+        self.assertEqual(
+            index.value_counts(range(2000)),
+            sorted(index._value_counts_reverse(range(2000)),
+                   key=lambda item: -item[1]))
+
+    def _assertPagesMatchSort(self, index, docids, reverse, sort_type):
+        values = dict(index._rev_index.items())
+        if reverse:
+            key = lambda docid: (-values[docid], docid)
+        else:
+            key = lambda docid: (values[docid], docid)
+        expected = sorted(docids, key=key)
+        pages = []
+        after = None
+        while True:
+            page = list(index.sort(docids, reverse=reverse, limit=7,
+                                   sort_type=sort_type, after=after))
+            if not page:
+                break
+            pages.extend(page)
+            after = (values[page[-1]], page[-1])
+        self.assertEqual(pages, expected)
+        self.assertEqual(
+            list(index.sort(docids, reverse=reverse, sort_type=sort_type,
+                            after=(values[expected[9]], expected[9]))),
+            expected[10:])
+
+    def test_sort_after(self):
+        from ..interfaces import FWSCAN
+        from ..interfaces import NBEST
+        from ..interfaces import TIMSORT
+        import random
+        index = self._makeOne()
+        for docid in range(300):
+            index.index_doc(docid, docid % 17)
+        docids = index.family.IF.Set(random.sample(range(300), 100))
+        for reverse in (False, True):
+            for sort_type in (None, FWSCAN, NBEST, TIMSORT):
+                self._assertPagesMatchSort(index, docids, reverse, sort_type)
+
+    def test_sort_after_cursor_value_not_indexed(self):
+        from ..interfaces import FWSCAN
+        from ..interfaces import NBEST
+        index = self._makeOne()
+        self._populateIndex(index)
+        for sort_type in (FWSCAN, NBEST):
+            self.assertEqual(
+                list(index.sort([1, 2, 3, 4], after=(2.5, 99),
+                                sort_type=sort_type)),
+                [1, 3, 4])
+            self.assertEqual(
+                list(index.sort([1, 2, 3, 4], after=(2.5, 99),
+                                sort_type=sort_type, reverse=True)),
+                [2])
+
+    def test_sort_after_w_missing_docids(self):
+        from ..interfaces import FWSCAN
+        from ..interfaces import NBEST
+        from ..exc import Unsortable
+        index = self._makeOne()
+        self._populateIndex(index)
+        for sort_type in (FWSCAN, NBEST):
+            result = index.sort([1, 2, 3, 99], after=(2, 2),
+                                sort_type=sort_type)
+            self.assertRaises(Unsortable, list, result)
+            result = index.sort([1, 2, 3, 99], after=(2, 2),
+                                sort_type=sort_type, raise_unsortable=False)
+            self.assertEqual(list(result), [1, 3])
+
+    def test_sort_nbest_descending_ties_in_docid_order(self):
+        from ..interfaces import NBEST
+        index = self._makeOne()
+        for docid in range(10):
+            index.index_doc(docid, docid // 3)
+        self.assertEqual(
+            list(index.sort(index.family.IF.Set(range(10)), reverse=True,
+                            limit=5, sort_type=NBEST)),
+            [9, 6, 7, 8, 3])
+
+    def test_ranks_relabelled_locally_when_gap_exhausted(self):
+        import BTrees
+        index = self._makeOne(family=BTrees.family32)
+        renumbered = []
+        index._renumber_ranks = lambda: renumbered.append(True)
+        index.index_doc(1, 0.0)
+        index.index_doc(2, 1.0)
+        index.index_doc(3, 2.0)
+        top = index._value_ranks[2.0]
+        # repeatedly halve the gap between the two lowest values
+        value = 1.0
+        for docid in range(4, 100):
+            value = value / 2
+            index.index_doc(docid, value)
+        self.assertEqual(renumbered, [])
+        ranks = index._value_ranks
+        self.assertEqual(list(ranks.values()),
+                         sorted(ranks.values()))
+        self.assertEqual(len(set(ranks.values())), len(ranks))
+        # values far from the ones added keep their ranks
+        self.assertEqual(ranks[2.0], top)
+        for docid, value in index._rev_index.items():
+            self.assertEqual(index._rank_index[docid], ranks[value])
+
+    def test_ranks_split_same_gap_without_renumbering(self):
+        import BTrees
+        index = self._makeOne(family=BTrees.family32)
+        relabelled = []
+        relabel_ranks = index._relabel_ranks
+        def _relabel_ranks(value, lower, upper):
+            relabelled.append(value)
+            return relabel_ranks(value, lower, upper)
+        index._relabel_ranks = _relabel_ranks
+        renumbered = []
+        index._renumber_ranks = lambda: renumbered.append(True)
+        index.index_doc(0, 0)
+        index.index_doc(1, 1)
+        for docid in range(2, 3000):
+            index.index_doc(docid, 1.0 / docid)
+        self.assertEqual(renumbered, [])
+        # most new values fit in the room left by the last relabelling
+        self.assertTrue(len(relabelled) < 3000 // 4)
+        values = list(index._value_ranks.values())
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), len(values))
+        for docid, value in index._rev_index.items():
+            self.assertEqual(index._rank_index[docid],
+                             index._value_ranks[value])
+
+    def test_ranks_random_values_family32(self):
+        import BTrees
+        import random
+        rnd = random.Random(42)
+        index = self._makeOne(family=BTrees.family32)
+        for docid in range(3000):
+            index.index_doc(docid, rnd.choice([rnd.random(),
+                                               rnd.randrange(10),
+                                               -docid, docid]))
+            if docid % 7 == 0:
+                index.unindex_doc(rnd.randrange(docid + 1))
+        ranks = list(index._value_ranks.items())
+        self.assertEqual([value for value, rank in ranks],
+                         list(index._fwd_index.keys()))
+        self.assertEqual([rank for value, rank in ranks],
+                         sorted(rank for value, rank in ranks))
+        self.assertEqual(len(set(rank for value, rank in ranks)),
+                         len(ranks))
+        for docid, value in index._rev_index.items():
+            self.assertEqual(index._rank_index[docid],
+                             index._value_ranks[value])
+
+    def test_no_ranks_by_default(self):
+        from ..interfaces import RANKSORT
+        index = self._makeOne(ranks=False)
+        self._populateIndex(index)
+        self.assertEqual(index._value_ranks, None)
+        self.assertEqual(index._rank_index, None)
+        result = index.sort([1, 2, 3, 5], sort_type=RANKSORT)
+        self.assertEqual(list(result), [5, 2, 1, 3])
+
+    def test_build_ranks_and_drop_ranks(self):
+        index = self._makeOne(ranks=False)
+        self._populateIndex(index)
+        index.build_ranks()
+        ranks = index._value_ranks
+        self.assertEqual(list(ranks.keys()), list(index._fwd_index.keys()))
+        self.assertEqual(list(ranks.values()), sorted(ranks.values()))
+        self.assertEqual(index._rank_index[3], ranks[4])
+        index.index_doc(7, 0)
+        self.assertTrue(index._rank_index[7] < ranks[1])
+        index.reset()
+        self.assertEqual(len(index._value_ranks), 0)
+        index.drop_ranks()
+        self.assertEqual(index._value_ranks, None)
+        self.assertEqual(index._rank_index, None)
+        index.index_doc(1, 1)
+        self.assertEqual(index._rank_index, None)
+
+    def test_ranks_appended_past_int32_range(self):
+        import BTrees
+        from . import RANK_GAP
+        index = self._makeOne(family=BTrees.family32)
+        renumbered = []
+        renumber_ranks = index._renumber_ranks
+        def _renumber_ranks():
+            renumbered.append(True)
+            renumber_ranks()
+        index._renumber_ranks = _renumber_ranks
+        # more ascending values than fit 2**32 ranks RANK_GAP apart
+        count = (1 << 32) // RANK_GAP + 1000
+        for docid in range(count):
+            index.index_doc(docid, docid)
+        index.index_doc(count, -1)
+        self.assertTrue(len(renumbered) <= 2)
+        ranks = index._value_ranks
+        self.assertEqual(len(ranks), count + 1)
+        self.assertEqual(ranks.minKey(), -1)
+        values = list(ranks.values())
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), len(values))
+        self.assertEqual(index._rank_index[count - 1], ranks[count - 1])
+
+    def test_ranks_reindex_and_unindex(self):
+        index = self._makeOne()
+        index.index_doc(1, 'a')
+        index.index_doc(2, 'b')
+        index.index_doc(3, 'b')
+        index.index_doc(2, 'c')
+        self.assertEqual(index._rank_index[2], index._value_ranks['c'])
+        index.unindex_doc(1)
+        self.assertFalse(1 in index._rank_index)
+        self.assertFalse('a' in index._value_ranks)
+        index.index_doc(3, _marker)
+        self.assertFalse(3 in index._rank_index)
+        self.assertFalse('b' in index._value_ranks)
+        self.assertEqual(list(index._value_ranks.keys()), ['c'])
+        self.assertEqual(list(index._rank_index.keys()), [2])
+
+    def test_sort_key(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        key = index.sort_key()
+        self.assertTrue(key(5, None) < key(2, None) < key(10, None))
+        self.assertEqual(key(99, None), None)
+        key = index.sort_key(reverse=True)
+        self.assertTrue(key(5, None) > key(2, None) > key(10, None))
+        self.assertEqual(key(99, None), None)
+
+    def test_sort_key_without_rank_tables(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index._value_ranks = index._rank_index = None
+        key = index.sort_key()
+        self.assertEqual(key(5, None), 1)
+        self.assertEqual(key(99, None), None)
+        key = index.sort_key(reverse=True)
+        self.assertTrue(key(5, None) > key(2, None) > key(10, None))
+        self.assertTrue(key(5, None) == key(5, None))
+        self.assertEqual(key(99, None), None)
+
+    def test_resultset_sort_by(self):
+        from ..util import ResultSet
+        status = self._makeOne()
+        modified = self._makeOne()
+        title = self._makeOne()
+        for docid, (s, m, t) in enumerate([
+                ('draft', 3, 'c'),
+                ('public', 1, 'a'),
+                ('draft', 3, 'a'),
+                ('public', 2, 'b'),
+                ('draft', 1, 'b'),
+                ]):
+            status.index_doc(docid, s)
+            modified.index_doc(docid, m)
+            title.index_doc(docid, t)
+        title._value_ranks = title._rank_index = None
+        sorts = [(status, False), (modified, True), (title, False)]
+        rs = ResultSet([0, 1, 2, 3, 4], 5, None)
+        self.assertEqual(list(rs.sort_by(sorts).ids), [2, 0, 4, 3, 1])
+        rs = ResultSet([0, 1, 2, 3, 4], 5, None)
+        self.assertEqual(list(rs.sort_by(sorts, limit=2).ids), [2, 0])
+
+    def _assertNumpysortMatchesRanksort(self, index, docids):
+        from ..interfaces import NUMPYSORT, RANKSORT
+        for reverse in (False, True):
+            for limit in (None, 1, 5, 50, 1000):
+                self.assertEqual(
+                    list(index.sort(docids, reverse=reverse, limit=limit,
+                                    sort_type=NUMPYSORT,
+                                    raise_unsortable=False)),
+                    list(index.sort(docids, reverse=reverse, limit=limit,
+                                    sort_type=RANKSORT,
+                                    raise_unsortable=False)))
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_sort_force_numpysort(self):
+        import random
+        index = self._makeOne()
+        for docid in range(500):
+            index.index_doc(docid, random.randrange(40))
+        docids = random.sample(range(600), 300)
+        self._assertNumpysortMatchesRanksort(index, docids)
+        self._assertNumpysortMatchesRanksort(
+            index, index.family.IF.Set(docids))
+        # the arrays are rebuilt after the index changes
+        index.unindex_doc(docids[0])
+        index.index_doc(docids[1], 100)
+        self._assertNumpysortMatchesRanksort(index, docids)
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_sort_force_numpysort_w_missing_docids(self):
+        from ..interfaces import NUMPYSORT
+        from ..exc import Unsortable
+        index = self._makeOne()
+        self._populateIndex(index)
+        result = index.sort([99, 5, 2, -1], sort_type=NUMPYSORT)
+        self.assertRaises(Unsortable, list, result)
+        result = index.sort([99, 5, 2, 1000], sort_type=NUMPYSORT,
+                            raise_unsortable=False)
+        self.assertEqual(list(result), [5, 2])
+
+    def test_sort_force_numpysort_without_numpy(self):
+        from ..interfaces import NUMPYSORT
+        from . import numpy
+        import hypatia.field
+        index = self._makeOne()
+        self._populateIndex(index)
+        hypatia.field.numpy = None
+        try:
+            self.assertEqual(
+                list(index.sort([1, 2, 3], sort_type=NUMPYSORT,
+                                reverse=True)),
+                [3, 1, 2])
+            self.assertFalse(NUMPYSORT in index.sort_types())
+        finally:
+            hypatia.field.numpy = numpy
+
+    def test_sort_timsort_many_missing_docids(self):
+        from ..interfaces import TIMSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        docids = list(range(12, 20000)) + [1, 2]
+        self.assertEqual(
+            list(index.sort(docids, sort_type=TIMSORT,
+                            raise_unsortable=False)),
+            [2, 1])
+
+    def test_sort_types(self):
+        from ..interfaces import FWSCAN, NBEST, TIMSORT, RANKSORT, NUMPYSORT
+        from . import numpy
+        index = self._makeOne()
+        ranked = [RANKSORT]
+        if numpy is not None:
+            ranked.append(NUMPYSORT)
+        self.assertEqual(index.sort_types(),
+                         [FWSCAN, TIMSORT] + ranked)
+        self.assertEqual(index.sort_types(limit=10),
+                         [FWSCAN, TIMSORT, NBEST] + ranked)
+        self.assertEqual(index.sort_types(reverse=True, limit=10),
+                         [FWSCAN, TIMSORT, NBEST] + ranked)
+        index._rank_index = None
+        self.assertEqual(index.sort_types(reverse=True), [FWSCAN, TIMSORT])
+
+    def test_sort_uses_cost_model(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import NBEST
+        index = self._makeOne()
+        self._populateIndex(index)
+        model = DummyCostModel(NBEST)
+        index.sort_cost_model = model
+        called = []
+        def nbest_ascending(docids, limit, raise_unsortable):
+            called.append(limit)
+            return []
+        index.nbest_ascending = nbest_ascending
+        c1 = IFSet([1, 2, 3, 4, 5])
+        index.sort(c1, limit=3)
+        self.assertEqual(called, [3])
+        self.assertEqual(model.chosen,
+                         [(index.sort_types(False, 3), False, 3, 5, 11)])
+
+    def test_sort_reverse_uses_cost_model(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import RANKSORT
+        index = self._makeOne()
+        self._populateIndex(index)
+        model = DummyCostModel(RANKSORT)
+        index.sort_cost_model = model
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, reverse=True)
+        self.assertEqual(list(result), [4, 3, 1, 2, 5])
+        self.assertEqual(model.chosen,
+                         [(index.sort_types(True, None), True, None, 5, 11)])
+
+    def test_sort_uncalibrated_cost_model_uses_heuristics(self):
+        from BTrees.IFBTree import IFSet
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.sort_cost_model = DummyCostModel(None)
+        c1 = IFSet([1, 2, 3, 4, 5])
+        self.assertEqual(list(index.sort(c1, limit=3)), [5, 2, 1])
+        self.assertEqual(list(index.sort(c1, reverse=True, limit=3)),
+                         [4, 3, 1])
+
+    def test_sort_explicit_sort_type_ignores_cost_model(self):
+        from BTrees.IFBTree import IFSet
+        from ..interfaces import NBEST
+        index = self._makeOne()
+        self._populateIndex(index)
+        model = DummyCostModel(None)
+        index.sort_cost_model = model
+        c1 = IFSet([1, 2, 3, 4, 5])
+        result = index.sort(c1, limit=3, sort_type=NBEST)
+        self.assertEqual(list(result), [5, 2, 1])
+        self.assertEqual(model.chosen, [])
+
+    def test_calibrate_sort(self):
+        from ..interfaces import NBEST, TIMSORT
+        from . import SortCostModel
+        index = self._makeOne()
+        for docid in range(200):
+            index.index_doc(docid, docid % 17)
+        model = index.calibrate_sort(sizes=(0.1, 1.0), limits=(5, None))
+        self.assertTrue(isinstance(model, SortCostModel))
+        self.assertTrue(index.sort_cost_model is model)
+        self.assertTrue((NBEST, True) in model.coefficients)
+        self.assertTrue((TIMSORT, False) in model.coefficients)
+        # limit 5 is used for the 20 docid sample, not for a 200 docid one
+        self.assertEqual(len(model.observations[(NBEST, False)]), 2)
+        self.assertEqual(len(model.observations[(TIMSORT, False)]), 4)
+        result = index.sort(list(range(200)), limit=3)
+        self.assertEqual(list(result), [0, 17, 34])
+
+    def test_calibrate_sort_shared_model(self):
+        from ..interfaces import TIMSORT
+        from . import SortCostModel
+        model = SortCostModel()
+        index1 = self._makeOne()
+        index2 = self._makeOne()
+        for docid in range(50):
+            index1.index_doc(docid, docid)
+            index2.index_doc(docid, str(docid))
+        index1.calibrate_sort(model, sizes=(1.0,), limits=(None,))
+        index2.calibrate_sort(model, sizes=(1.0,), limits=(None,))
+        self.assertTrue(index1.sort_cost_model is model)
+        self.assertTrue(index2.sort_cost_model is model)
+        self.assertEqual(len(model.observations[(TIMSORT, False)]), 2)
+
+    def test_calibrate_sort_empty_index(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.calibrate_sort)
+
     def test_search_single_range_querymember_or(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -817,6 +1575,36 @@ class FieldIndexTests(unittest.TestCase):
         result = sorted(list(result))
         self.assertEqual(result, [])
 
+    def test_search_many_points(self):
+        import random
+        index = self._makeOne()
+        for docid in range(1000):
+            index.index_doc(docid, docid % 300)
+        values = [random.randrange(400) for i in range(200)]
+        expected = sorted(docid for docid in range(1000)
+                          if docid % 300 in values)
+        self.assertEqual(list(index.search(values)), expected)
+        self.assertEqual(list(index.applyAny(values)), expected)
+
+    def test_search_point_result_is_a_copy(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        for operator in ('or', 'and'):
+            result = index.search([1], operator)
+            self.assertEqual(list(result), [5])
+            result.insert(99)
+            self.assertEqual(list(index._fwd_index[1]), [5])
+
+    def test_search_equal_points_and(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(list(index.search([2, 2], 'and')), [2])
+        self.assertEqual(
+            list(index.search([2, RangeValue(1, 3)], 'and')), [2])
+        self.assertEqual(list(index.search([99, RangeValue(1, 3)], 'and')),
+                         [])
+
     def test_apply_dict_single_range(self):
         from hypatia import RangeValue
         index = self._makeOne()
@@ -1185,6 +1973,450 @@ class FieldIndexTests(unittest.TestCase):
         self.assertEqual(result._start, 1)
         self.assertEqual(result._end, 2)
 
+class FieldIndexConcurrencyTests(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        storage = FileStorage(self.tmpdir + '/Data.fs')
+        self.db = DB(storage)
+        self.addCleanup(self.db.close)
+
+    def _makeOne(self, ranks=True):
+        import transaction
+        from . import FieldIndex
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        conn.root()['index'] = FieldIndex(_identity, ranks=ranks)
+        for docid in range(1, 11):
+            conn.root()['index'].index_doc(docid, docid)
+        tm.commit()
+        conn.close()
+
+    def _open(self):
+        import transaction
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+        return tm, conn.root()['index']
+
+    def test_concurrent_new_ranks_conflict(self):
+        from ZODB.POSException import ConflictError
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        # both values are ranked above the largest one, and would get the
+        # same rank
+        index1.index_doc(11, 100)
+        index2.index_doc(12, 200)
+        tm1.commit()
+        self.assertRaises(ConflictError, tm2.commit)
+        tm2.abort()
+        self.assertEqual(index2._rank_index[11], index2._value_ranks[100])
+
+    def test_concurrent_existing_values_commit(self):
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        index1.index_doc(11, 3)
+        index2.index_doc(12, 5)
+        tm1.commit()
+        tm2.commit()
+        tm1.begin()
+        self.assertEqual(list(index1._fwd_index[3]), [3, 11])
+        self.assertEqual(index1._rank_index[12], index1._value_ranks[5])
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_numpysort_sees_other_connections_changes(self):
+        from ..interfaces import NUMPYSORT
+        from ..interfaces import TIMSORT
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        docids = index2.family.IF.Set(range(1, 20))
+        self.assertEqual(list(index2.sort(docids, sort_type=NUMPYSORT,
+                                          raise_unsortable=False)),
+                         list(range(1, 11)))
+        self.assertTrue(index2._rank_arrays_cached())
+        index1.index_doc(1, 50)
+        index1.index_doc(11, 0)
+        index1.index_doc(12, 5)
+        tm1.commit()
+        tm2.begin()
+        self.assertFalse(index2._rank_arrays_cached())
+        self.assertEqual(list(index2.sort(docids, sort_type=NUMPYSORT,
+                                          raise_unsortable=False)),
+                         list(index2.sort(docids, sort_type=TIMSORT,
+                                          raise_unsortable=False)))
+        self.assertEqual(list(index2.sort(docids, sort_type=NUMPYSORT,
+                                          raise_unsortable=False)),
+                         [11, 2, 3, 4, 5, 12, 6, 7, 8, 9, 10, 1])
+
+    @unittest.skipIf(_numpy is None, 'NumPy is not installed')
+    def test_value_counts_numpy_sees_other_connections_changes(self):
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        docids = index2.family.IF.Set(range(1, 20))
+        self.assertEqual(index2._value_counts_numpy(docids),
+                         index2._value_counts_reverse(docids))
+        index1.index_doc(1, 50)
+        index1.index_doc(2, 3)
+        index1.index_doc(11, 0)
+        tm1.commit()
+        tm2.begin()
+        counts = index2._value_counts_numpy(docids)
+        self.assertEqual(counts, index2._value_counts_reverse(docids))
+        self.assertEqual(counts[:3], [(0, 1), (3, 2), (4, 1)])
+
+    def test_concurrent_new_values_without_ranks_commit(self):
+        self._makeOne(ranks=False)
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        index1.index_doc(11, 100)
+        index2.index_doc(12, 200)
+        tm1.commit()
+        tm2.commit()
+        tm1.begin()
+        self.assertEqual(list(index1._fwd_index.keys())[-2:], [100, 200])
+
+class FieldIndexRangeBlocksTests(unittest.TestCase):
+
+    def _makeOne(self, block_size=2, levels=3):
+        from . import FieldIndex
+        def discriminator(obj, default):
+            return obj
+        index = FieldIndex(discriminator)
+        index.range_block_size = block_size
+        index.range_block_levels = levels
+        return index
+
+    def _checkBlocks(self, index):
+        below = index._fwd_index
+        for level in index._range_blocks:
+            keys = list(level.keys())
+            self.assertTrue(set(keys) <= set(below.keys()))
+            bounds = keys[1:] + [None]
+            for start, end in zip(keys, bounds):
+                expected = set()
+                for docids in index._fwd_index.values(
+                        start, end, excludemax=end is not None):
+                    expected.update(docids)
+                self.assertEqual(set(level[start]), expected)
+            below = level
+
+    def _checkRanges(self, index, values):
+        import random
+        candidates = sorted(set(values)) + [-1, 50, 101]
+        for i in range(50):
+            start, end = sorted(random.sample(candidates, 2))
+            for excludemin in (False, True):
+                for excludemax in (False, True):
+                    self.assertEqual(
+                        list(index.applyInRange(
+                            start, end, excludemin, excludemax)),
+                        list(index.family.IF.multiunion(
+                            index._fwd_index.values(
+                                start, end, excludemin=excludemin,
+                                excludemax=excludemax))))
+            self.assertEqual(list(index.applyInRange(start, None)),
+                             list(index.applyGe(start)))
+            self.assertEqual(
+                list(index.applyInRange(None, end)),
+                list(index.family.IF.multiunion(
+                    index._fwd_index.values(None, end))))
+
+    def test_ctor_range_blocks(self):
+        from . import FieldIndex
+        index = FieldIndex('value', range_blocks=True)
+        self.assertEqual(len(index._range_blocks), index.range_block_levels)
+        self.assertEqual(FieldIndex('value')._range_blocks, None)
+
+    def test_build_range_blocks(self):
+        index = self._makeOne()
+        for docid in range(200):
+            index.index_doc(docid, docid % 97)
+        index.build_range_blocks()
+        self.assertEqual(len(index._range_blocks), 3)
+        self._checkBlocks(index)
+        self._checkRanges(index, range(97))
+
+    def test_drop_range_blocks(self):
+        index = self._makeOne()
+        index.build_range_blocks()
+        index.drop_range_blocks()
+        self.assertEqual(index._range_blocks, None)
+        index.index_doc(1, 1)
+        self.assertEqual(list(index.applyInRange(0, 2)), [1])
+
+    def test_reset_keeps_range_blocks(self):
+        index = self._makeOne()
+        index.build_range_blocks()
+        index.index_doc(1, 1)
+        index.reset()
+        self.assertEqual(len(index._range_blocks), 3)
+        self.assertFalse(any(index._range_blocks))
+
+    def test_maintained_under_index_and_unindex(self):
+        import random
+        index = self._makeOne()
+        index.build_range_blocks()
+        values = {}
+        for i in range(1000):
+            docid = random.randrange(300)
+            if docid in values and random.random() < 0.4:
+                index.unindex_doc(docid)
+                del values[docid]
+            else:
+                value = random.randrange(100)
+                index.index_doc(docid, value)
+                values[docid] = value
+        self._checkBlocks(index)
+        self._checkRanges(index, values.values())
+
+    def test_index_docs(self):
+        import random
+        for existing in (0, 100, 1000):
+            index = self._makeOne()
+            index.build_range_blocks()
+            for docid in range(existing):
+                index.index_doc(docid, random.randrange(1000))
+            index.index_docs([
+                (random.randrange(2000), random.randrange(1000))
+                for i in range(300)])
+            self._checkBlocks(index)
+
+    def test_search_range(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        index.build_range_blocks()
+        for docid in range(100):
+            index.index_doc(docid, docid)
+        self.assertEqual(list(index.search([RangeValue(10, 19), 50])),
+                         list(range(10, 20)) + [50])
+        self.assertEqual(list(index.applyInRange(90, 200)),
+                         list(range(90, 100)))
+        self.assertEqual(list(index.applyLt(3)), [0, 1, 2])
+
+class IntegerFieldIndexTests(unittest.TestCase):
+
+    def _makeOne(self, family=None):
+        from . import IntegerFieldIndex
+        def discriminator(obj, default):
+            if obj is _marker:
+                return default
+            return obj
+        return IntegerFieldIndex(discriminator, family=family)
+
+    def test_trees(self):
+        import BTrees
+        index = self._makeOne()
+        self.assertTrue(isinstance(index._fwd_index, BTrees.family64.IO.BTree))
+        self.assertTrue(isinstance(index._rev_index, BTrees.family64.II.BTree))
+
+    def test_index_doc(self):
+        index = self._makeOne()
+        index.index_doc(1, 5)
+        index.index_doc(2, -3)
+        index.index_doc(3, True)
+        index.index_doc(4, _marker)
+        self.assertEqual(list(index.unique_values()), [-3, 1, 5])
+        self.assertEqual(list(index.not_indexed()), [4])
+        self.assertEqual(index.document_repr(1), '5')
+
+    def test_index_doc_not_integer(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.index_doc, 1, 1.5)
+        self.assertRaises(ValueError, index.index_doc, 1, '1')
+        self.assertEqual(index.indexed_count(), 0)
+
+    def test_index_doc_out_of_bounds(self):
+        import BTrees
+        index = self._makeOne(family=BTrees.family32)
+        index.index_doc(1, BTrees.family32.maxint)
+        self.assertRaises(ValueError, index.index_doc, 2,
+                          BTrees.family32.maxint + 1)
+
+    def test_queries_and_sort(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        for docid in range(1, 11):
+            index.index_doc(docid, 100 - docid)
+        self.assertEqual(list(index.applyEq(95)), [5])
+        self.assertEqual(list(index.search([RangeValue(90, 92), 99])),
+                         [1, 8, 9, 10])
+        self.assertEqual(list(index.applyGt(97)), [1, 2])
+        self.assertEqual(list(index.sort([1, 5, 3], limit=2)), [5, 3])
+        self.assertEqual(list(index.sort([1, 5, 3], reverse=True)),
+                         [1, 3, 5])
+
+    def test_range_queries_not_integers(self):
+        from decimal import Decimal
+        import BTrees
+        index = self._makeOne(family=BTrees.family32)
+        for docid in range(1, 8):
+            index.index_doc(docid, docid)
+        self.assertEqual(list(index.applyGt(3.0)), [4, 5, 6, 7])
+        self.assertEqual(list(index.applyGt(2.5)), [3, 4, 5, 6, 7])
+        self.assertEqual(list(index.applyLt(Decimal('3.5'))), [1, 2, 3])
+        self.assertEqual(list(index.applyInRange(2.5, 5)), [3, 4, 5])
+        self.assertEqual(
+            list(index.applyInRange(2.5, 5.5, excludemin=True,
+                                    excludemax=True)),
+            [3, 4, 5])
+        self.assertEqual(list(index.applyInRange(-1e20, 2.0)), [1, 2])
+        self.assertEqual(list(index.applyGe(float('-inf'))),
+                         [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(list(index.applyGe(1e20)), [])
+        self.assertEqual(list(index.applyLe(float('nan'))), [])
+        self.assertRaises(ValueError, index.applyGt, '3')
+
+    def test_point_queries_not_integers(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        for docid in range(1, 8):
+            index.index_doc(docid, docid)
+        self.assertEqual(list(index.applyEq(3.0)), [3])
+        self.assertEqual(list(index.applyEq(2.5)), [])
+        self.assertEqual(list(index.applyAny([2.5, 4, 1 << 70])), [4])
+        self.assertEqual(
+            list(index.search([RangeValue(1.5, 3), 2.5], operator='and')),
+            [])
+        self.assertRaises(ValueError, index.applyEq, '3')
+
+    def test_sort_after_not_integer(self):
+        index = self._makeOne()
+        for docid, value in enumerate([3, 1, 2, 2]):
+            index.index_doc(docid, value)
+        self.assertEqual(list(index.sort([0, 1, 2, 3], after=(2.0, 2))),
+                         [3, 0])
+        self.assertRaises(ValueError, index.sort, [0, 1, 2, 3],
+                          after=(2.5, 0))
+
+    def test_unindex_doc(self):
+        index = self._makeOne()
+        index.index_doc(1, 5)
+        index.index_doc(2, 5)
+        index.unindex_doc(1)
+        index.unindex_doc(2)
+        self.assertEqual(list(index.unique_values()), [])
+        self.assertEqual(index.indexed_count(), 0)
+
+class FloatFieldIndexTests(unittest.TestCase):
+
+    def _makeOne(self, family=None):
+        from . import FloatFieldIndex
+        def discriminator(obj, default):
+            if obj is _marker:
+                return default
+            return obj
+        return FloatFieldIndex(discriminator, family=family)
+
+    def test_ctor_32bit_family(self):
+        import BTrees
+        self.assertRaises(ValueError, self._makeOne, family=BTrees.family32)
+
+    def test_index_doc(self):
+        index = self._makeOne()
+        index.index_doc(1, 0.1)
+        index.index_doc(2, -2.5)
+        index.index_doc(3, 7)
+        index.index_doc(4, 1.7e9 + 0.25)
+        index.index_doc(5, _marker)
+        self.assertEqual(list(index.unique_values()),
+                         [-2.5, 0.1, 7.0, 1.7e9 + 0.25])
+        self.assertEqual(list(index.not_indexed()), [5])
+        self.assertEqual(index.document_repr(1), '0.1')
+        self.assertEqual(index.document_repr(6), None)
+
+    def test_index_doc_invalid(self):
+        index = self._makeOne()
+        self.assertRaises(ValueError, index.index_doc, 1, float('nan'))
+        self.assertRaises(ValueError, index.index_doc, 1, '1.5')
+        self.assertEqual(index.indexed_count(), 0)
+
+    def test_queries(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        values = [-1e300, -3.5, -0.0, 0.0, 1e-300, 2, 2.5, float('inf')]
+        for docid, value in enumerate(values):
+            index.index_doc(docid, value)
+        self.assertEqual(list(index.applyEq(0)), [2, 3])
+        self.assertEqual(list(index.applyEq(2.0)), [5])
+        self.assertEqual(list(index.applyLt(-3.5)), [0])
+        self.assertEqual(list(index.applyGe(2)), [5, 6, 7])
+        self.assertEqual(list(index.search([RangeValue(-4, 0)])),
+                         [1, 2, 3])
+        self.assertEqual(list(index.applyInRange(-4, 0, excludemax=True)),
+                         [1])
+        self.assertEqual(list(index.applyNotEq(2.5)),
+                         [0, 1, 2, 3, 4, 5, 7])
+
+    def test_sort(self):
+        import random
+        index = self._makeOne()
+        values = {}
+        for docid in range(200):
+            values[docid] = random.uniform(-1000, 1000)
+            index.index_doc(docid, values[docid])
+        expected = sorted(values, key=values.get)
+        self.assertEqual(list(index.sort(values)), expected)
+        self.assertEqual(list(index.sort(values, reverse=True, limit=10)),
+                         expected[::-1][:10])
+
+    def test_value_counts(self):
+        index = self._makeOne()
+        index.index_doc(1, 2.5)
+        index.index_doc(2, -1)
+        index.index_doc(3, 2.5)
+        self.assertEqual(index.value_counts([1, 2, 3]),
+                         [(2.5, 2), (-1.0, 1)])
+
+    def test_min_max_stats(self):
+        index = self._makeOne()
+        self.assertEqual(index.min_value(), None)
+        index.index_doc(1, 2.5)
+        index.index_doc(2, -1)
+        index.index_doc(3, 0.25)
+        self.assertEqual(index.min_value(), -1.0)
+        self.assertEqual(index.max_value(), 2.5)
+        self.assertEqual(index.max_value([2, 3]), 0.25)
+        self.assertEqual(index.stats([1, 2, 3]),
+                         {'count': 3, 'min': -1.0, 'max': 2.5, 'sum': 1.75,
+                          'mean': 1.75 / 3})
+
+    def test_sort_after(self):
+        index = self._makeOne()
+        for docid, value in enumerate([0.5, 0.25, 0.75, 0.5]):
+            index.index_doc(docid, value)
+        self.assertEqual(list(index.sort([0, 1, 2, 3], after=(0.5, 0))),
+                         [3, 2])
+
+class Test_float_key(unittest.TestCase):
+
+    def _callFUT(self, value):
+        from . import float_key
+        return float_key(value)
+
+    def test_order_preserved(self):
+        from . import float_value
+        values = [float('-inf'), -1e300, -1.0, -5e-324, 0.0, 5e-324,
+                  1.0, 1.5, 1e300, float('inf')]
+        keys = [self._callFUT(value) for value in values]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual([float_value(key) for key in keys], values)
+
+    def test_negative_zero(self):
+        self.assertEqual(self._callFUT(-0.0), self._callFUT(0.0))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._callFUT, float('nan'))
+        self.assertRaises(ValueError, self._callFUT, None)
+
 class Test_fwscan_wins(unittest.TestCase):
 
     def _callFUT(self, limit, rlen, numdocs):
@@ -1271,6 +2503,21 @@ class Test_fwscan_wins(unittest.TestCase):
         self.assertFalse(self._callFUT(4097, 16383, 65536))
 
 
+class Test_fwcount_wins(unittest.TestCase):
+
+    def _callFUT(self, numvalues, rlen, numdocs):
+        from . import fwcount_wins
+        return fwcount_wins(numvalues, rlen, numdocs)
+
+    def test_few_values_large_resultset(self):
+        self.assertTrue(self._callFUT(5, 20000, 200000))
+
+    def test_small_resultset(self):
+        self.assertFalse(self._callFUT(5, 1000, 200000))
+
+    def test_many_values(self):
+        self.assertFalse(self._callFUT(1000, 200000, 200000))
+
 class Test_nbest_ascending_wins(unittest.TestCase):
 
     def _callFUT(self, limit, rlen, numdocs):
@@ -1337,6 +2584,171 @@ class Test_nbest_ascending_wins(unittest.TestCase):
         self.assertTrue(self._callFUT(2048, 32767, 65536))
         self.assertFalse(self._callFUT(2049, 32767, 65536))
 
+class TestSortCostModel(unittest.TestCase):
+
+    def _makeOne(self):
+        from . import SortCostModel
+        return SortCostModel()
+
+    def test_predict_uncalibrated(self):
+        from ..interfaces import TIMSORT
+        model = self._makeOne()
+        self.assertEqual(model.predict(TIMSORT, False, None, 10, 100), None)
+
+    def test_choose_uncalibrated(self):
+        from ..interfaces import TIMSORT, NBEST
+        model = self._makeOne()
+        self.assertEqual(
+            model.choose([TIMSORT, NBEST], False, 10, 100, 1000), None)
+
+    def test_observe_and_fit(self):
+        from . import sort_features
+        from ..interfaces import TIMSORT
+        model = self._makeOne()
+        for rlen in (10, 100, 1000, 10000):
+            x, y = sort_features(TIMSORT, None, rlen, 10000)
+            model.observe(TIMSORT, False, None, rlen, 10000, 2 * x + 3 * y)
+        model.fit()
+        a, b = model.coefficients[(TIMSORT, False)]
+        self.assertAlmostEqual(a, 2)
+        self.assertAlmostEqual(b, 3)
+        x, y = sort_features(TIMSORT, None, 500, 10000)
+        self.assertAlmostEqual(
+            model.predict(TIMSORT, False, None, 500, 10000), 2 * x + 3 * y)
+        self.assertEqual(model.predict(TIMSORT, True, None, 500, 10000),
+                         None)
+
+    def test_choose(self):
+        from ..interfaces import FWSCAN, NBEST, TIMSORT
+        model = self._makeOne()
+        model.coefficients = {
+            (FWSCAN, False): (0.0, 1.0),
+            (NBEST, False): (1.0, 0.0),
+            (TIMSORT, False): (2.0, 0.0),
+            }
+        # a large result set with a small limit: scanning finds the first
+        # docids after visiting a few of the indexed ones
+        self.assertEqual(
+            model.choose([FWSCAN, NBEST, TIMSORT], False, 1, 1000, 1000),
+            FWSCAN)
+        # a small result set: the scan visits nearly the whole index
+        self.assertEqual(
+            model.choose([FWSCAN, NBEST, TIMSORT], False, 10, 20, 1000),
+            NBEST)
+        self.assertEqual(
+            model.choose([FWSCAN, TIMSORT], False, 10, 20, 1000),
+            TIMSORT)
+        self.assertEqual(
+            model.choose([FWSCAN, NBEST, TIMSORT], True, 10, 20, 1000),
+            None)
+
+class Test_sort_features(unittest.TestCase):
+
+    def _callFUT(self, sort_type, limit, rlen, numdocs):
+        from . import sort_features
+        return sort_features(sort_type, limit, rlen, numdocs)
+
+    def test_fwscan(self):
+        from ..interfaces import FWSCAN
+        self.assertEqual(self._callFUT(FWSCAN, None, 10, 100), (10, 100))
+        self.assertEqual(self._callFUT(FWSCAN, 2, 10, 100), (10, 20))
+        self.assertEqual(self._callFUT(FWSCAN, 20, 10, 100), (10, 100))
+
+    def test_nbest(self):
+        from ..interfaces import NBEST
+        self.assertEqual(self._callFUT(NBEST, 3, 10, 100), (10, 6))
+
+    def test_timsort(self):
+        from ..interfaces import TIMSORT, RANKSORT
+        self.assertEqual(self._callFUT(TIMSORT, None, 7, 100), (7, 21))
+        self.assertEqual(self._callFUT(RANKSORT, 3, 7, 100), (7, 21))
+
+class Test_fit_nonnegative(unittest.TestCase):
+
+    def _callFUT(self, observations):
+        from . import fit_nonnegative
+        return fit_nonnegative(observations)
+
+    def test_exact(self):
+        observations = [((1, 2), 8), ((3, 1), 9), ((2, 2), 10)]
+        a, b = self._callFUT(observations)
+        self.assertAlmostEqual(a, 2)
+        self.assertAlmostEqual(b, 3)
+
+    def test_negative_coefficient_dropped(self):
+        # t = 2x - y would need a negative coefficient
+        observations = [((1, 1), 1), ((2, 1), 3), ((3, 1), 5)]
+        a, b = self._callFUT(observations)
+        self.assertTrue(a > 0)
+        self.assertEqual(b, 0)
+
+    def test_collinear(self):
+        observations = [((1, 2), 2), ((2, 4), 4)]
+        a, b = self._callFUT(observations)
+        self.assertEqual(b, 0)
+        self.assertAlmostEqual(a, 2)
+
+    def test_no_observations(self):
+        self.assertEqual(self._callFUT([]), (0.0, 0.0))
+
+class Test_descending_items(unittest.TestCase):
+
+    def _callFUT(self, tree):
+        from . import descending_items
+        return list(descending_items(tree))
+
+    def _makeTree(self, keys):
+        from BTrees.OOBTree import OOBTree
+        tree = OOBTree()
+        for key in keys:
+            tree[key] = str(key)
+        return tree
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT(self._makeTree([])), [])
+
+    def test_single_bucket(self):
+        tree = self._makeTree([3, 1, 2])
+        self.assertEqual(self._callFUT(tree), [(3, '3'), (2, '2'), (1, '1')])
+
+    def test_many_buckets(self):
+        import random
+        keys = random.sample(range(100000), 20000)
+        tree = self._makeTree(keys)
+        expected = [(key, str(key)) for key in sorted(keys, reverse=True)]
+        self.assertEqual(self._callFUT(tree), expected)
+
+    def test_after_deletions(self):
+        keys = list(range(5000))
+        tree = self._makeTree(keys)
+        for key in range(0, 5000, 7):
+            del tree[key]
+        for key in range(100, 4000):
+            if key % 7:
+                del tree[key]
+        expected = sorted(tree.items(), reverse=True)
+        self.assertEqual(self._callFUT(tree), expected)
+
+    def test_max(self):
+        import random
+        keys = random.sample(range(100000), 5000)
+        tree = self._makeTree(keys)
+        for max in (-1, 0, 1, 500, 50000.5, 99999, 100000,
+                    sorted(keys)[2500]):
+            expected = [(key, str(key))
+                        for key in sorted(keys, reverse=True) if key <= max]
+            self.assertEqual(list(self._callFUT_max(tree, max)), expected)
+
+    def test_max_single_bucket(self):
+        tree = self._makeTree([3, 1, 2])
+        self.assertEqual(list(self._callFUT_max(tree, 2)),
+                         [(2, '2'), (1, '1')])
+        self.assertEqual(list(self._callFUT_max(tree, 0)), [])
+
+    def _callFUT_max(self, tree, max):
+        from . import descending_items
+        return descending_items(tree, max)
+
 class Test_MissingValue(unittest.TestCase):
     def _makeOne(self, val):
         from hypatia.field import _MissingValue
@@ -1369,7 +2781,29 @@ def test_suite():
     return unittest.TestSuite((
         doctest.DocFileSuite('README.txt', optionflags=doctest.ELLIPSIS),
         unittest.makeSuite(FieldIndexTests),
+        unittest.makeSuite(FieldIndexConcurrencyTests),
+        unittest.makeSuite(FieldIndexRangeBlocksTests),
+        unittest.makeSuite(IntegerFieldIndexTests),
+        unittest.makeSuite(FloatFieldIndexTests),
+        unittest.makeSuite(Test_float_key),
         unittest.makeSuite(Test_fwscan_wins),
+        unittest.makeSuite(Test_fwcount_wins),
         unittest.makeSuite(Test_nbest_ascending_wins),
+        unittest.makeSuite(TestSortCostModel),
+        unittest.makeSuite(Test_sort_features),
+        unittest.makeSuite(Test_fit_nonnegative),
+        unittest.makeSuite(Test_descending_items),
         unittest.makeSuite(Test_MissingValue),
         ))
+
+def _identity(obj, default):
+    return obj
+
+class DummyCostModel(object):
+    def __init__(self, sort_type):
+        self.sort_type = sort_type
+        self.chosen = []
+
+    def choose(self, sort_types, reverse, limit, rlen, numdocs):
+        self.chosen.append((sort_types, reverse, limit, rlen, numdocs))
+        return self.sort_type
@@ -135,7 +135,7 @@ class IResultSet(Interface):
         """ Return the length of the result set"""
 
     def sort(index, reverse=False, limit=None, sort_type=None,
-             raise_unsortable=True):
+             raise_unsortable=True, after=None):
         """Return another IResultSet sorted using the ``index`` (an IIndexSort)
         passed to it after performing the sort using the index and the
         ``limit``, ``reverse``, and ``sort_type`` parameters.
@@ -155,6 +155,36 @@ class IResultSet(Interface):
         resolve any of the docids in the set of docids in this result set, a
         :exc:`hypatia.exc.Unsortable` exception will be raised during iteration
         over the sorted docids.
+
+        If ``after`` is not ``None``, it is passed on to the ``sort`` method
+        of indexes which support pagination cursors (e.g.
+        :class:`hypatia.field.FieldIndex`): the ``(value, docid)`` pair of
+        the last document of the previous page, so that only the documents
+        following it are returned.  The sorted docids are then computed
+        right away rather than as they are iterated over, so that the length
+        of the result set is the number of documents following the cursor
+        (at most ``limit``).
+        """
+
+    def sort_by(sorts, limit=None, raise_unsortable=True):
+        """Return another IResultSet sorted using several indexes at once.
+
+        ``sorts`` is a sequence of ``(index, reverse)`` pairs, most
+        significant first: documents are ordered by the value they have in
+        the first index, ties are broken by the value they have in the
+        second index, and so on.  Each index must provide a ``sort_key``
+        method which accepts ``reverse`` and returns a callable; the callable
+        accepts a docid and a default and returns a key which orders the
+        docid within that index (or the default if the docid isn't sortable
+        by it).
+
+        If ``limit`` is passed, only the first ``limit`` documents are
+        returned; they are selected without sorting the whole result set.
+
+        The sort is stable.  If ``raise_unsortable`` is ``True`` (the
+        default), and some of the docids in this result set are not sortable
+        by all of the indexes, a :exc:`hypatia.exc.Unsortable` exception
+        will be raised during iteration over the sorted docids.
         """
 
     def first(resolve=True):
@@ -183,5 +213,7 @@ class IResultSet(Interface):
 FWSCAN = 'fwscan'
 NBEST = 'nbest'
 TIMSORT = 'timsort'
+RANKSORT = 'ranksort'
+NUMPYSORT = 'numpysort'
 STABLE = 'stable'
 OPTIMAL = 'optimal'
@@ -5,6 +5,12 @@ from ..interfaces import (
     IIndexStatistics,
     )
 from ..util import BaseIndexMixin
+from ..util import intersection
+from ..util import intersection_count
+
+import heapq
+from itertools import islice
+from operator import itemgetter
 
 from persistent import Persistent
 
@@ -43,13 +49,34 @@ class KeywordIndex(BaseIndexMixin, Persistent):
 
     - NotAll
 
+    - MinMatch
+
+    - NotMinMatch
+
     """
 
     # If a word is referenced by at least tree_threshold docids,
-    # use a TreeSet for that word instead of a Set.
+    # use a TreeSet for that word instead of a Set.  The TreeSet is only
+    # converted back to a Set once fewer than half as many docids refer to
+    # it, so that words whose document counts hover around tree_threshold
+    # aren't converted back and forth.
     tree_threshold = 64
 
-    def __init__(self, discriminator, family=None):
+    # The vocabulary (see build_vocabulary) is optional.  When present,
+    # _wids maps each indexed keyword to an integer word id, _words maps
+    # word ids back to keywords, and the reverse index stores a set of word
+    # ids for each docid instead of a set of keywords.
+    _wids = None
+    _words = None
+
+    # Indexes created with older versions of hypatia have no keyword counts
+    # (see reset); the docids of each keyword are then counted instead.  The
+    # count index (see build_count_index) is optional.
+    _word_counts = None
+    _count_index = None
+
+    def __init__(self, discriminator, family=None, vocabulary=False,
+                 count_index=False):
         if family is not None:
             self.family = family
         if not callable(discriminator):
@@ -58,6 +85,10 @@ class KeywordIndex(BaseIndexMixin, Persistent):
                                  'string')
         self.discriminator = discriminator
         self.reset()
+        if vocabulary:
+            self.build_vocabulary()
+        if count_index:
+            self.build_count_index()
 
     def reset(self):
         """Initialize forward and reverse mappings."""
@@ -65,13 +96,76 @@ class KeywordIndex(BaseIndexMixin, Persistent):
         # The forward index maps index keywords to a sequence of docids
         self._fwd_index = self.family.OO.BTree()
 
-        # The reverse index maps a docid to its keywords
-        # TODO: Using a vocabulary might be the better choice to store
-        # keywords since it would allow use to use integers instead of strings
+        # The reverse index maps a docid to its keywords (or to their word
+        # ids when a vocabulary is used)
         self._rev_index = self.family.IO.BTree()
         self._num_docs = Length(0)
         self._not_indexed = self.family.IF.TreeSet()
 
+        # The word counts map each keyword to a Length holding its number
+        # of documents, so that concurrent changes to the number of
+        # documents of a keyword are merged like those to _num_docs.
+        self._word_counts = self.family.OO.BTree()
+        if self._count_index is not None:
+            self._count_index = self.family.IO.BTree()
+        if self._wids is not None:
+            self.build_vocabulary()
+
+    def build_vocabulary(self):
+        """ Store the keywords of each document in the reverse index as a set
+        of integer word ids, mapped to and from the keywords by a vocabulary
+        which is maintained as documents are indexed and unindexed.
+
+        Word id sets take far less space than sets of keyword strings when
+        keywords are shared by many documents, and comparing the old and new
+        keywords of a reindexed document compares integers.  An existing
+        index is converted in place."""
+        wids = self.family.OI.BTree()
+        words = self.family.IO.BTree()
+        for wid, word in enumerate(self._fwd_index.keys()):
+            wids[word] = wid
+            words[wid] = word
+        II = self.family.II
+        rev_index = self._rev_index
+        for docid, kw in list(rev_index.items()):
+            rev_index[docid] = II.Set(wids[word] for word in
+                                      self._rev_words(docid, kw))
+        self._wids = wids
+        self._words = words
+
+    def drop_vocabulary(self):
+        """ Store the keywords of each document in the reverse index as a set
+        of keywords again """
+        if self._wids is None:
+            return
+        OO = self.family.OO
+        rev_index = self._rev_index
+        for docid, wids in list(rev_index.items()):
+            rev_index[docid] = OO.Set(self._rev_words(docid, wids))
+        self._wids = self._words = None
+
+    def build_count_index(self):
+        """ Maintain an index of keywords by number of documents, with which
+        ``top_keywords`` (and ``counts`` with a ``limit``) look at the most
+        frequent keywords first without looking up the number of documents
+        of every keyword.
+
+        The count index is changed whenever the number of documents of a
+        keyword changes, so concurrent transactions indexing documents with
+        the same keyword conflict while it is maintained."""
+        count_index = self.family.IO.BTree()
+        OO = self.family.OO
+        for word, count in self._word_count_items():
+            words = count_index.get(count)
+            if words is None:
+                count_index[count] = words = OO.TreeSet()
+            words.insert(word)
+        self._count_index = count_index
+
+    def drop_count_index(self):
+        """ Stop maintaining the index of keywords by number of documents """
+        self._count_index = None
+
     def unique_values(self):
         """ Return the unique values in the index for all docids as an iterable
         """
@@ -94,6 +188,149 @@ class KeywordIndex(BaseIndexMixin, Persistent):
         """Return the number of indexed words"""
         return len(self._fwd_index)
 
+    def top_keywords(self, n, docids=None):
+        """ Return a list of ``(keyword, count)`` pairs for the ``n``
+        keywords which the most documents have, most frequent first
+        (keywords with the same count are in keyword order).
+
+        If ``docids`` is passed, only those documents are counted (and
+        keywords which none of them have are left out), as by ``counts``.
+        """
+        if n < 1:
+            raise ValueError('n must be 1 or greater')
+        if docids is not None:
+            return self._keyword_counts(docids, n)
+        result = []
+        for count, words in self._words_by_count():
+            for word in islice(words, n - len(result)):
+                result.append((word, count))
+            if len(result) == n:
+                break
+        return result
+
+    def counts(self, docids, limit=None):
+        """ Given a set of docids (usually returned from query), return a
+        dictionary mapping each keyword which at least one of the documents
+        has to the number of the documents which have it.  If ``limit`` is
+        passed, only the ``limit`` most frequent keywords are included.
+
+        Depending on the number of docids and of keywords, either the
+        keywords of each document are looked up in the reverse index, or
+        the docids of each keyword are counted in the forward index (see
+        ``postings_count_wins``).  In the latter case, when ``limit`` is
+        passed, keywords are looked at in order of their overall number of
+        documents, which is an upper bound of their number of documents
+        among ``docids``, and the less frequent keywords are never counted
+        once ``limit`` keywords with larger counts have been found.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be 1 or greater')
+        return dict(self._keyword_counts(docids, limit))
+
+    def _keyword_counts(self, docids, limit):
+        # return (keyword, count) pairs, most frequent first
+        IF = self.family.IF
+        if not isinstance(docids, (IF.Set, IF.TreeSet)):
+            docids = IF.Set(docids)
+        if not docids:
+            return []
+        if self._postings_count_wins(docids, len(self._fwd_index)):
+            found = self._forward_counts(docids, limit)
+        else:
+            found = self._reverse_counts(docids)
+        found.sort(key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            del found[limit:]
+        return found
+
+    def _postings_count_wins(self, docids, numwords):
+        # decide how to count numwords keywords for the (non-empty) set of
+        # docids, estimating the number of keywords per document from a few
+        # of them
+        rev_index = self._rev_index
+        sample = [len(rev_index.get(docid, ())) for docid in
+                  islice(docids, 16)]
+        per_doc = float(sum(sample)) / len(sample)
+        postings = per_doc * self._num_docs()
+        return postings_count_wins(numwords, len(docids), postings, per_doc)
+
+    def _reverse_counts(self, docids):
+        counts = {}
+        get = counts.get
+        rev_index = self._rev_index
+        for docid in docids:
+            for word in rev_index.get(docid, ()):
+                counts[word] = get(word, 0) + 1
+        words = self._words
+        if words is not None:
+            return [(words[wid], count) for wid, count in counts.items()]
+        return list(counts.items())
+
+    def _forward_counts(self, docids, limit):
+        fwd_index = self._fwd_index
+        found = []
+        if limit is None:
+            for word, word_idx in fwd_index.items():
+                count = intersection_count(word_idx, docids, self.family)
+                if count:
+                    found.append((word, count))
+            return found
+        # the limit largest counts found so far
+        heap = []
+        for most, words in self._words_by_count():
+            if len(heap) == limit and most < heap[0]:
+                break
+            for word in words:
+                count = intersection_count(fwd_index[word], docids,
+                                           self.family)
+                if not count:
+                    continue
+                found.append((word, count))
+                if len(heap) < limit:
+                    heapq.heappush(heap, count)
+                elif count > heap[0]:
+                    heapq.heapreplace(heap, count)
+        return found
+
+    def _word_count_items(self):
+        # yield (keyword, number of documents) pairs, in keyword order
+        word_counts = self._word_counts
+        if word_counts is None:
+            for word, docids in self._fwd_index.items():
+                yield word, len(docids)
+        else:
+            for word, length in word_counts.items():
+                yield word, length()
+
+    def _docid_count(self, word, docids):
+        # the number of documents of word, whose forward index entry is
+        # docids; a TreeSet doesn't store its length
+        word_counts = self._word_counts
+        if word_counts is None:
+            return len(docids)
+        return word_counts[word]()
+
+    def _words_by_count(self):
+        # yield (count, keywords) pairs, largest count first
+        count_index = self._count_index
+        if count_index is None:
+            counts = {}
+            for word, count in self._word_count_items():
+                counts.setdefault(count, []).append(word)
+            for count in sorted(counts, reverse=True):
+                yield count, counts[count]
+            return
+        try:
+            count = count_index.maxKey()
+        except ValueError:
+            return
+        while True:
+            yield count, count_index[count]
+            try:
+                count = count_index.maxKey(count - 1)
+            except ValueError:
+                return
+
     def applyAny(self, values):
         return self.apply({'query': values, 'operator': 'or'})
 
@@ -118,6 +355,66 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     def notall(self, value):
         return query.NotAll(self, value)
 
+    def applyMinMatch(self, values, min_match):
+        """ Return the docids of the documents which have at least
+        ``min_match`` of the keywords in ``values`` """
+        if isinstance(values, string_types):
+            values = [values]
+        if min_match < 1:
+            raise ValueError('min_match must be at least 1')
+        words = self.family.OO.Set(self.normalize(values))
+        if min_match > len(words):
+            return self.family.IF.Set()
+        return self._min_match(self._sized_sets(words), min_match)
+
+    def _sized_sets(self, words):
+        # return a (number of documents, docids) pair for each of words,
+        # smallest first
+        empty = self.family.IF.Set()
+        fwd_index = self._fwd_index
+        sets = []
+        for word in words:
+            docids = fwd_index.get(word)
+            if docids is None:
+                sets.append((0, empty))
+            else:
+                sets.append((self._docid_count(word, docids), docids))
+        sets.sort(key=itemgetter(0))
+        return sets
+
+    def _min_match(self, sets, min_match):
+        IF = self.family.IF
+        if min_match == 1:
+            return IF.multiunion([set for count, set in sets])
+        # Any document which has min_match of the n keywords is in at least
+        # one of any n - min_match + 1 of their sets, so only the documents
+        # in the smallest ones are counted; the larger sets are only
+        # intersected with them.
+        cut = len(sets) - min_match + 1
+        if not sets[cut - 1][0]:
+            # fewer than min_match of the keywords are indexed at all
+            return IF.Set()
+        counts = IF.Bucket()
+        for count, set in sets[:cut]:
+            _, counts = IF.weightedUnion(counts, set)
+        for count, set in sets[cut:]:
+            if not counts:
+                break
+            _, counts = IF.weightedUnion(
+                counts, intersection(counts, set, self.family,
+                                     len(counts), count))
+        return IF.Set(
+            [docid for docid, count in counts.items() if count >= min_match])
+
+    def minmatch(self, value, min_match):
+        return query.MinMatch(self, value, min_match)
+
+    def applyNotMinMatch(self, *args, **kw):
+        return self._negate(self.applyMinMatch, *args, **kw)
+
+    def notminmatch(self, value, min_match):
+        return query.NotMinMatch(self, value, min_match)
+
     def applyEq(self, value):
         return self.apply([value])
 
@@ -142,9 +439,40 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     def document_repr(self, docid, default=None):
         result = self._rev_index.get(docid, default)
         if result is not default:
+            if self._words is not None:
+                result = self.family.OO.Set(self._rev_words(docid, result))
             return repr(result)
         return default
 
+    def _rev_words(self, docid, kw=None):
+        # Return the keywords of docid, given its reverse index entry kw (or
+        # None when the docid isn't indexed).
+        if kw is None:
+            kw = self._rev_index.get(docid)
+            if kw is None:
+                return None
+        if self._words is None:
+            return kw
+        words = self._words
+        return [words[wid] for wid in kw]
+
+    def _keyword_set(self, seq):
+        # Return the reverse index entry for the keywords in seq, allocating
+        # word ids for new keywords when a vocabulary is used.
+        if self._wids is None:
+            return self.family.OO.Set(seq)
+        return self.family.II.Set([self._word_id(word) for word in seq])
+
+    def _word_id(self, word):
+        # return the word id of word, allocating one if it has none
+        wid = self._wids.get(word)
+        if wid is None:
+            words = self._words
+            wid = words.maxKey() + 1 if words else 0
+            self._wids[word] = wid
+            words[wid] = word
+        return wid
+
     def index_doc(self, docid, obj):
         seq = self.discriminate(obj, _marker)
 
@@ -160,6 +488,9 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             # Remove from set of unindexed docs if it was in there.
             self._not_indexed.remove(docid)
 
+        self._index_value(docid, seq)
+
+    def _index_value(self, docid, seq):
         if isinstance(seq, string_types):
             raise TypeError('seq argument must be a list/tuple of strings')
 
@@ -171,43 +502,115 @@ class KeywordIndex(BaseIndexMixin, Persistent):
 
         seq = self.normalize(seq)
 
-        new_kw = self.family.OO.Set(seq)
+        new_kw = self._keyword_set(seq)
 
         if old_kw is None:
-            self._insert_forward(docid, new_kw)
+            self._insert_forward(docid, self._rev_words(docid, new_kw))
             self._insert_reverse(docid, new_kw)
             self._num_docs.change(1)
         else:
             # determine added and removed keywords
-            kw_added = self.family.OO.difference(new_kw, old_kw)
-            kw_removed = self.family.OO.difference(old_kw, new_kw)
+            if self._wids is None:
+                difference = self.family.OO.difference
+            else:
+                difference = self.family.II.difference
+            kw_added = difference(new_kw, old_kw)
+            kw_removed = difference(old_kw, new_kw)
 
             if not (kw_added or kw_removed):
                 return
 
             # removed keywords are removed from the forward index
-            for word in kw_removed:
-                fwd = self._fwd_index[word]
-                fwd.remove(docid)
-                if not fwd:
-                    del self._fwd_index[word]
+            self._remove_forward(docid, self._rev_words(docid, kw_removed))
 
             # now update reverse and forward indexes
-            self._insert_forward(docid, kw_added)
+            self._insert_forward(docid, self._rev_words(docid, kw_added))
             self._insert_reverse(docid, new_kw)
 
+    def index_docs(self, docs):
+        """ Index many documents at once.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs.  The result is the
+        same as calling ``index_doc`` for each pair in turn, but the keywords
+        added to and removed from each document are computed first (so a
+        value which cannot be indexed raises before the index is changed),
+        and the changes are then applied keyword by keyword, so that the
+        docids of each keyword are updated once however many of the
+        documents have it."""
+        values = {}
+        for docid, obj in docs:
+            seq = self.discriminate(obj, _marker)
+            if isinstance(seq, string_types):
+                raise TypeError('seq argument must be a list/tuple of '
+                                'strings')
+            values[docid] = seq
+
+        OO = self.family.OO
+        not_indexed = self._not_indexed
+        missing = []
+        added = {}
+        removed = {}
+        changed = {}
+        for docid, seq in values.items():
+            if seq is _marker:
+                if docid in not_indexed:
+                    continue
+                missing.append(docid)
+            elif docid in not_indexed:
+                not_indexed.remove(docid)
+            if seq is _marker or not seq:
+                new_kw = None
+            else:
+                new_kw = OO.Set(self.normalize(seq))
+            old_kw = self._rev_words(docid)
+            if old_kw is None:
+                if new_kw is None:
+                    continue
+                kw_added, kw_removed = new_kw, ()
+            elif new_kw is None:
+                kw_added, kw_removed = (), old_kw
+            else:
+                old_kw = OO.Set(old_kw)
+                kw_added = OO.difference(new_kw, old_kw)
+                kw_removed = OO.difference(old_kw, new_kw)
+                if not (kw_added or kw_removed):
+                    continue
+            for word in kw_added:
+                added.setdefault(word, []).append(docid)
+            for word in kw_removed:
+                removed.setdefault(word, []).append(docid)
+            changed[docid] = new_kw
+
+        for word, docids in sorted(removed.items()):
+            self._remove_docids(word, docids)
+        for word, docids in sorted(added.items()):
+            self._insert_docids(word, docids)
+
+        rev_index = self._rev_index
+        num_docs = 0
+        for docid, new_kw in sorted(changed.items()):
+            if new_kw is None:
+                del rev_index[docid]
+                num_docs -= 1
+            else:
+                if docid not in rev_index:
+                    num_docs += 1
+                self._insert_reverse(docid, self._keyword_set(new_kw))
+        if num_docs:
+            self._num_docs.change(num_docs)
+        not_indexed.update(missing)
+
     def unindex_doc(self, docid):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
-        
-        idx  = self._fwd_index
+
+        words = self._rev_words(docid)
+        if words is None:
+            return
 
         try:
-            for word in self._rev_index[docid]:
-                idx[word].remove(docid)
-                if not idx[word]:
-                    del idx[word]
+            self._remove_forward(docid, words)
         except KeyError:
             msg = 'WAAA!  Inconsistent'
             return
@@ -222,20 +625,82 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     def _insert_forward(self, docid, words):
         """insert a sequence of words into the forward index """
 
+        docids = (docid,)
+        for word in words:
+            self._insert_docids(word, docids)
+
+    def _remove_forward(self, docid, words):
+        """remove a sequence of words from the forward index """
+
+        docids = (docid,)
+        for word in words:
+            self._remove_docids(word, docids)
+
+    def _insert_docids(self, word, docids):
+        """ add a sequence of docids to the forward index entry of word """
+
         idx = self._fwd_index
-        get_word_idx = idx.get
         IF = self.family.IF
-        Set = IF.Set
-        TreeSet = IF.TreeSet
-        for word in words:
-            word_idx = get_word_idx(word)
-            if word_idx is None:
-                idx[word] = word_idx = Set()
-            word_idx.insert(docid)
-            if (not isinstance(word_idx, TreeSet) and
-                    len(word_idx) >= self.tree_threshold):
-                # Convert to a TreeSet.
-                idx[word] = TreeSet(word_idx)
+        word_idx = idx.get(word)
+        if word_idx is None:
+            idx[word] = word_idx = IF.Set()
+        self._change_word_count(word, word_idx.update(docids))
+        if (not isinstance(word_idx, IF.TreeSet) and
+                len(word_idx) >= self.tree_threshold):
+            # Convert to a TreeSet.
+            idx[word] = IF.TreeSet(word_idx)
+
+    def _remove_docids(self, word, docids):
+        """ remove a sequence of docids from the forward index entry of
+        word """
+
+        idx = self._fwd_index
+        IF = self.family.IF
+        word_idx = idx[word]
+        for docid in docids:
+            word_idx.remove(docid)
+        self._change_word_count(word, -len(docids))
+        if not word_idx:
+            del idx[word]
+            wids = self._wids
+            if wids is not None:
+                del self._words[wids[word]]
+                del wids[word]
+        elif isinstance(word_idx, IF.TreeSet):
+            # the length of a TreeSet isn't stored, so look at no more
+            # docids than needed to tell whether it's small
+            set_threshold = self.tree_threshold // 2
+            remaining = list(islice(word_idx, set_threshold))
+            if len(remaining) < set_threshold:
+                # Convert to a Set.
+                idx[word] = IF.Set(remaining)
+
+    def _change_word_count(self, word, delta):
+        counts = self._word_counts
+        if counts is None or not delta:
+            return
+        length = counts.get(word)
+        if length is None:
+            counts[word] = length = Length(0)
+        old = length()
+        new = old + delta
+        if new:
+            length.change(delta)
+        else:
+            del counts[word]
+        count_index = self._count_index
+        if count_index is None:
+            return
+        if old:
+            words = count_index[old]
+            words.remove(word)
+            if not words:
+                del count_index[old]
+        if new:
+            words = count_index.get(new)
+            if words is None:
+                count_index[new] = words = self.family.OO.TreeSet()
+            words.insert(word)
 
     def _insert_reverse(self, docid, words):
         """ add words to forward index """
@@ -250,22 +715,27 @@ class KeywordIndex(BaseIndexMixin, Persistent):
 
         query = self.normalize(query)
 
-        sets = []
-        for word in query:
-            docids = self._fwd_index.get(word, self.family.IF.Set())
-            sets.append(docids)
-
         if operator == 'or':
+            sets = []
+            for word in query:
+                docids = self._fwd_index.get(word, self.family.IF.Set())
+                sets.append(docids)
             rs = self.family.IF.multiunion(sets)
         elif operator == 'and':
             # sort smallest to largest set so we intersect the smallest
-            # number of document identifiers possible
-            sets.sort(key=len)
+            # number of document identifiers possible; the intersection
+            # probes the larger sets for the docids found so far when they
+            # are much larger.  The sizes of the sets are their keyword
+            # counts, so that large TreeSets aren't walked to count them.
             rs = None
-            for set in sets:
-                rs = self.family.IF.intersection(rs, set)
-                if not rs:
+            for count, set in self._sized_sets(query):
+                if rs is None:
+                    rs, rlen = set, count
+                elif not rlen:
                     break
+                else:
+                    rs = intersection(rs, set, self.family, rlen, count)
+                    rlen = len(rs)
         else:
             raise TypeError('Keyword index only supports `and` and `or` '
                             'operators, not `%s`.' % operator)
@@ -283,17 +753,36 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             query = query['query']
         return self.search(query, operator=operator)
 
-    def optimize(self):
+    def optimize(self, batch_size=None, start=None):
         """Optimize the index. Call this after changing tree_threshold.
 
         This converts internal data structures between
         Sets and TreeSets based on tree_threshold.
+
+        If ``batch_size`` is passed, only that many words are looked at,
+        starting at the word ``start`` (or at the first word), and the word
+        at which to resume is returned (``None`` once all words have been
+        looked at).  This lets a large index be optimized in a series of
+        small transactions, e.g.::
+
+            start = index.optimize(1000)
+            transaction.commit()
+            while start is not None:
+                start = index.optimize(1000, start)
+                transaction.commit()
+
         """
         idx = self._fwd_index
         IF = self.family.IF
         Set = IF.Set
         TreeSet = IF.TreeSet
-        items = list(self._fwd_index.items())
+        items = idx.items(start)
+        if batch_size is not None:
+            items = islice(items, batch_size + 1)
+        items = list(items)
+        resume = None
+        if batch_size is not None and len(items) > batch_size:
+            resume = items.pop()[0]
         for word, word_idx in items:
             if len(word_idx) >= self.tree_threshold:
                 if not isinstance(word_idx, TreeSet):
@@ -303,4 +792,19 @@ class KeywordIndex(BaseIndexMixin, Persistent):
                 if isinstance(word_idx, TreeSet):
                     # Convert to a Set.
                     idx[word] = Set(word_idx)
+        return resume
 
+def postings_count_wins(numwords, rlen, postings, per_doc):
+    """
+    Return True if counting the keywords of the documents of a result set
+    is likely faster by counting the docids of each keyword in the result
+    set (see ``hypatia.util.intersection_count``) than by looking up the
+    keywords of each docid.
+
+    Looking up a docid and counting each of its ``per_doc`` keywords costs
+    about one unit each; a forward count costs about 12 units per keyword,
+    plus 0.6 units per docid of the keyword's set (or of the result set,
+    when it is much smaller) it looks at.
+    """
+    forward = numwords * 12.0 + min(postings, numwords * rlen) * 0.6
+    return forward < rlen * (1 + per_doc)
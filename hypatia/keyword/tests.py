@@ -201,6 +201,260 @@ class _KeywordIndexTestsBase:
         self.assertEqual(list(result), [1, 2, 3, 4, 5, 6])
 
 
+    def test_search_and_skewed_sizes(self):
+        index = self._makeOne()
+        for docid in range(200):
+            keywords = ['common']
+            if docid % 50 == 0:
+                keywords.append('rare')
+            if docid % 3 == 0:
+                keywords.append('third')
+            index.index_doc(docid, keywords)
+        self._search_and(index, ['common', 'rare'],
+                         self.IFSet([0, 50, 100, 150]))
+        self._search_and(index, ['third', 'rare', 'common'],
+                         self.IFSet([0, 150]))
+        self._search_and(index, ['third', 'common'],
+                         self.IFSet(range(0, 200, 3)))
+        self._search_and(index, [], self.IFSet())
+
+    def test_search_and_uses_word_counts(self):
+        from .. import keyword
+        index = self._makeOne()
+        for docid in range(200):
+            keywords = ['common']
+            if docid % 50 == 0:
+                keywords.append('rare')
+            index.index_doc(docid, keywords)
+        self.assertEqual([count for count, docids in
+                          index._sized_sets(['common', 'missing', 'rare'])],
+                         [0, 4, 200])
+        lengths = []
+        def intersection(set1, set2, family, len1=None, len2=None):
+            lengths.append((len1, len2))
+            return family.IF.intersection(set1, set2)
+        orig = keyword.intersection
+        keyword.intersection = intersection
+        try:
+            result = index.search(['common', 'rare'])
+        finally:
+            keyword.intersection = orig
+        self.assertEqual(list(result), [0, 50, 100, 150])
+        self.assertEqual(lengths, [(4, 200)])
+
+    def _checkSameIndex(self, index, other):
+        self.assertEqual(list(index._fwd_index.keys()),
+                         list(other._fwd_index.keys()))
+        for word, docids in index._fwd_index.items():
+            # whether a word has a Set or a TreeSet may depend on the
+            # order of the changes
+            self.assertEqual(list(docids), list(other._fwd_index[word]))
+        self.assertEqual(list(index._rev_index.keys()),
+                         list(other._rev_index.keys()))
+        for docid in index._rev_index.keys():
+            self.assertEqual(sorted(index._rev_words(docid)),
+                             sorted(other._rev_words(docid)))
+        self.assertEqual(index.indexed_count(), other.indexed_count())
+        self.assertEqual(index._num_docs(), other._num_docs())
+        self.assertEqual(list(index.not_indexed()),
+                         list(other.not_indexed()))
+
+    def test_index_docs_same_as_index_doc(self):
+        import random
+        rnd = random.Random(2)
+        index = self._makeOne()
+        other = self._makeOne()
+        index.tree_threshold = other.tree_threshold = 8
+        words = list(range(10))
+        def value():
+            if rnd.random() < 0.1:
+                return _marker
+            return rnd.sample(words, rnd.randrange(0, 5))
+        for docid in range(30):
+            obj = value()
+            index.index_doc(docid, obj)
+            other.index_doc(docid, obj)
+        for i in range(5):
+            batch = [(rnd.randrange(40), value()) for j in range(30)]
+            index.index_docs(batch)
+            for docid, obj in batch:
+                other.index_doc(docid, obj)
+            self._checkSameIndex(index, other)
+
+    def test_index_docs_string_value_raises(self):
+        index = self._makeOne()
+        self.assertRaises(TypeError, index.index_docs,
+                          [(1, ('a',)), (2, 'albatross')])
+        self.assertEqual(index.indexed_count(), 0)
+        self.assertEqual(index.word_count(), 0)
+
+    def _populate_random(self, index, seed):
+        import random
+        rnd = random.Random(seed)
+        words = ['w%d' % i for i in range(20)]
+        docs = {}
+        for i in range(300):
+            docid = rnd.randrange(100)
+            if docid in docs and rnd.random() < 0.2:
+                index.unindex_doc(docid)
+                del docs[docid]
+                continue
+            # skew the keyword frequencies
+            keywords = set(words[int(rnd.random() ** 2 * len(words))]
+                           for j in range(rnd.randrange(1, 6)))
+            index.index_doc(docid, list(keywords))
+            docs[docid] = keywords
+        return docs
+
+    def _expected_counts(self, docs, docids=None):
+        counts = {}
+        for docid, keywords in docs.items():
+            if docids is None or docid in docids:
+                for word in keywords:
+                    counts[word] = counts.get(word, 0) + 1
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def test_word_counts_maintained(self):
+        index = self._makeOne()
+        index.tree_threshold = 8
+        index.build_count_index()
+        docs = self._populate_random(index, 3)
+        index.index_docs([(1, ['w0', 'new']), (2, _marker), (3, [])])
+        docs[1] = set(['w0', 'new'])
+        docs.pop(2, None)
+        docs.pop(3, None)
+        expected = dict(self._expected_counts(docs))
+        self.assertEqual(dict((word, length()) for word, length
+                              in index._word_counts.items()), expected)
+        for count, words in index._count_index.items():
+            for word in words:
+                self.assertEqual(expected.pop(word), count)
+        self.assertEqual(expected, {})
+
+    def test_top_keywords(self):
+        index = self._makeOne()
+        docs = self._populate_random(index, 4)
+        expected = self._expected_counts(docs)
+        self.assertEqual(index.top_keywords(5), expected[:5])
+        self.assertEqual(index.top_keywords(100), expected)
+        self.assertRaises(ValueError, index.top_keywords, 0)
+
+    def test_top_keywords_with_count_index(self):
+        index = self._makeOne()
+        docs = self._populate_random(index, 12)
+        self.assertEqual(index._count_index, None)
+        index.build_count_index()
+        expected = self._expected_counts(docs)
+        self.assertEqual(index.top_keywords(5), expected[:5])
+        index.index_doc(500, ['w3', 'other'])
+        docs[500] = set(['w3', 'other'])
+        expected = self._expected_counts(docs)
+        self.assertEqual(index.top_keywords(100), expected)
+        self.assertEqual(index.counts(range(50), 3),
+                         dict(self._expected_counts(docs, range(50))[:3]))
+        index.reset()
+        self.assertEqual(len(index._count_index), 0)
+        index.drop_count_index()
+        self.assertEqual(index._count_index, None)
+        index.index_doc(1, ['w1'])
+        self.assertEqual(index.top_keywords(1), [('w1', 1)])
+
+    def test_top_keywords_docids(self):
+        import random
+        rnd = random.Random(5)
+        index = self._makeOne()
+        docs = self._populate_random(index, 6)
+        for size in (0, 1, 5, 30, 100):
+            docids = rnd.sample(range(120), size)
+            expected = self._expected_counts(docs, docids)
+            for n in (1, 3, 10, 30):
+                self.assertEqual(index.top_keywords(n, docids), expected[:n])
+        self.assertEqual(index.top_keywords(3, self.IFSet([docids[0]])),
+                         self._expected_counts(docs, docids[:1])[:3])
+
+    def test_counts(self):
+        import random
+        rnd = random.Random(8)
+        index = self._makeOne()
+        docs = self._populate_random(index, 9)
+        for size in (0, 1, 10, 60, 120):
+            docids = rnd.sample(range(120), size)
+            expected = self._expected_counts(docs, docids)
+            self.assertEqual(index.counts(docids), dict(expected))
+            self.assertEqual(index.counts(self.IFSet(docids), 4),
+                             dict(expected[:4]))
+        self.assertRaises(ValueError, index.counts, [1], 0)
+
+    def test_counts_strategies(self):
+        import random
+        rnd = random.Random(10)
+        index = self._makeOne()
+        docs = self._populate_random(index, 11)
+        docids = self.IFSet(rnd.sample(range(120), 50))
+        expected = self._expected_counts(docs, docids)
+        for found in (index._reverse_counts(docids),
+                      index._forward_counts(docids, None)):
+            self.assertEqual(sorted(found), sorted(expected))
+        found = index._forward_counts(docids, 3)
+        found.sort(key=lambda item: (-item[1], item[0]))
+        self.assertEqual(found[:3], expected[:3])
+
+    def test_top_keywords_without_word_counts(self):
+        index = self._makeOne()
+        docs = self._populate_random(index, 7)
+        # as for indexes created with older versions
+        index._word_counts = index._count_index = None
+        expected = self._expected_counts(docs)
+        self.assertEqual(index.top_keywords(5), expected[:5])
+        self.assertEqual(index.top_keywords(5, range(50)),
+                         self._expected_counts(docs, range(50))[:5])
+        index.index_doc(200, ['w1'])
+
+    def test_applyMinMatch(self):
+        index = self._makeOne()
+        index.index_doc(1, ('a', 'b', 'c'))
+        index.index_doc(2, ('a', 'c'))
+        index.index_doc(3, ('b', 'd'))
+        index.index_doc(4, ('d',))
+        self.assertEqual(list(index.applyMinMatch(['a', 'b', 'c'], 1)),
+                         [1, 2, 3])
+        self.assertEqual(list(index.applyMinMatch(['a', 'b', 'c'], 2)),
+                         [1, 2])
+        self.assertEqual(list(index.applyMinMatch(['a', 'b', 'c'], 3)), [1])
+        self.assertEqual(list(index.applyMinMatch(['a', 'b', 'c', 'd'], 2)),
+                         [1, 2, 3])
+        self.assertEqual(list(index.applyMinMatch(['a', 'x', 'y'], 2)), [])
+        self.assertEqual(list(index.applyMinMatch(['a', 'a', 'b'], 2)), [1])
+        self.assertEqual(list(index.applyMinMatch(['a', 'b'], 3)), [])
+        self.assertEqual(list(index.applyMinMatch('d', 1)), [3, 4])
+        self.assertRaises(ValueError, index.applyMinMatch, ['a'], 0)
+
+    def test_applyMinMatch_matches_counts(self):
+        import random
+        rnd = random.Random(1)
+        index = self._makeOne()
+        index.tree_threshold = 10
+        words = list(range(12))
+        docs = {}
+        for docid in range(200):
+            docs[docid] = rnd.sample(words, rnd.randrange(1, 8))
+            index.index_doc(docid, docs[docid])
+        for i in range(30):
+            query = rnd.sample(words + [99], rnd.randrange(1, 8))
+            for min_match in range(1, len(query) + 1):
+                expected = [docid for docid, kw in sorted(docs.items())
+                            if len(set(kw) & set(query)) >= min_match]
+                self.assertEqual(
+                    list(index.applyMinMatch(query, min_match)), expected)
+
+    def test_applyNotMinMatch(self):
+        index = self._makeOne()
+        index.index_doc(1, ('a', 'b', 'c'))
+        index.index_doc(2, ('a', 'c'))
+        index.index_doc(3, ('b', 'd'))
+        self.assertEqual(list(index.applyNotMinMatch(['a', 'b', 'c'], 2)),
+                         [3])
+
     def test_optimize_converts_to_tree_set(self):
         index = self._makeOne()
         self._populate(index)
@@ -211,6 +465,49 @@ class _KeywordIndexTestsBase:
         self.assertEqual(type(index._fwd_index['zope']),
             type(self.IFTreeSet()))
 
+    def test_unindex_converts_to_simple_set(self):
+        index = self._makeOne()
+        index.tree_threshold = 8
+        for docid in range(10):
+            index.index_doc(docid, ['zope', 'cmf'])
+        self.assertEqual(type(index._fwd_index['zope']),
+            type(self.IFTreeSet()))
+        # still at least half of tree_threshold docids
+        for docid in range(6):
+            index.unindex_doc(docid)
+        self.assertEqual(type(index._fwd_index['zope']),
+            type(self.IFTreeSet()))
+        index.index_doc(6, ['cmf'])
+        self.assertEqual(type(index._fwd_index['zope']),
+            type(self.IFSet()))
+        self.assertEqual(list(index._fwd_index['zope']), [7, 8, 9])
+        self.assertEqual(type(index._fwd_index['cmf']),
+            type(self.IFTreeSet()))
+        index.unindex_doc(7)
+        self.assertEqual(type(index._fwd_index['cmf']),
+            type(self.IFSet()))
+        self.assertEqual(list(index._fwd_index['cmf']), [6, 8, 9])
+
+    def test_optimize_batches(self):
+        index = self._makeOne()
+        self._populate(index)
+        index.tree_threshold = 0
+        start = index.optimize(batch_size=4)
+        self.assertEqual(start, 'brown')
+        self.assertEqual(type(index._fwd_index['Zope3']),
+            type(self.IFTreeSet()))
+        self.assertEqual(type(index._fwd_index['brown']),
+            type(self.IFSet()))
+        start = index.optimize(batch_size=4, start=start)
+        self.assertEqual(start, 'zope')
+        self.assertEqual(type(index._fwd_index['the']),
+            type(self.IFTreeSet()))
+        self.assertEqual(type(index._fwd_index['zope']),
+            type(self.IFSet()))
+        self.assertEqual(index.optimize(batch_size=4, start=start), None)
+        for word_idx in index._fwd_index.values():
+            self.assertEqual(type(word_idx), type(self.IFTreeSet()))
+
     def test_docids(self):
         index = self._makeOne()
         index.index_doc(1, [1, 2, 3])
@@ -286,6 +583,8 @@ class _SixtyFourBitBase:
 
 class _TestCaseBase:
 
+    _vocabulary = False
+
     def _makeOne(self, discriminator=_marker, family=_marker):
         def _discriminator(obj, default):
             if obj is _marker:
@@ -295,8 +594,11 @@ class _TestCaseBase:
             discriminator = _discriminator
         if family is _marker:
             family = self._get_family()
+        kw = {}
+        if self._vocabulary:
+            kw['vocabulary'] = True
         return self._getTargetClass()(discriminator=discriminator,
-                                      family=family)
+                                      family=family, **kw)
     
 
     def _search(self, index, query, expected, mode='and'):
@@ -514,6 +816,7 @@ class _TestCaseBase:
         index.reset()
         self.assertEqual(index.indexed_count(), 0)
         self.assertEqual(index.word_count(), 0)
+        self.assertEqual(index.top_keywords(5), [])
         for docid in range(1, 6):
             self.assertFalse(index.has_doc(docid))
 
@@ -596,6 +899,22 @@ class _TestCaseBase:
         self.assertEqual(result.__class__, query.NotAll)
         self.assertEqual(result._value, [1])
 
+    def test_minmatch(self):
+        from .. import query
+        index = self._makeOne()
+        result = index.minmatch([1, 2], 2)
+        self.assertEqual(result.__class__, query.MinMatch)
+        self.assertEqual(result._value, [1, 2])
+        self.assertEqual(result.min_match, 2)
+
+    def test_notminmatch(self):
+        from .. import query
+        index = self._makeOne()
+        result = index.notminmatch([1, 2], 2)
+        self.assertEqual(result.__class__, query.NotMinMatch)
+        self.assertEqual(result._value, [1, 2])
+        self.assertEqual(result.min_match, 2)
+
     def test_eq(self):
         from .. import query
         index = self._makeOne()
@@ -623,6 +942,163 @@ class KeywordIndexTests64(_KeywordIndexTestsBase,
                           unittest.TestCase):
     pass
 
+class _VocabularyTestsBase:
+
+    _vocabulary = True
+
+    def _checkVocabulary(self, index):
+        self.assertEqual(sorted(index._wids.keys()),
+                         sorted(index._fwd_index.keys()))
+        for word, wid in index._wids.items():
+            self.assertEqual(index._words[wid], word)
+        self.assertEqual(len(index._words), len(index._wids))
+        for docid, wids in index._rev_index.items():
+            self.assertTrue(isinstance(wids, index.family.II.Set))
+            for wid in wids:
+                self.assertTrue(docid in index._fwd_index[index._words[wid]])
+
+    def test_reverse_index_stores_word_ids(self):
+        index = self._makeOne()
+        self._populate(index)
+        self._checkVocabulary(index)
+        self.assertEqual(sorted(index._rev_words(1)),
+                         ['CMF', 'Zope3', 'zope'])
+        self.assertEqual(index._rev_words(4), None)
+
+    def test_reindex_updates_vocabulary(self):
+        index = self._makeOne()
+        self._populate(index)
+        index.index_doc(1, ('zope', 'plone'))
+        index.index_doc(3, ('Zope', 'plone'))
+        self._checkVocabulary(index)
+        self.assertFalse('CMF' in index._wids)
+        self._search(index, 'plone', self.IFSet([1, 3]))
+        self._search(index, 'zope', self.IFSet([1]))
+
+    def test_unindex_updates_vocabulary(self):
+        index = self._makeOne()
+        self._populate(index)
+        index.unindex_doc(2)
+        index.unindex_doc(5)
+        self._checkVocabulary(index)
+        self.assertEqual(sorted(index._wids.keys()),
+                         ['CMF', 'Zope', 'Zope3', 'zope'])
+        index.index_doc(6, ('the', 'cmf'))
+        self._checkVocabulary(index)
+
+    def test_reset_keeps_vocabulary(self):
+        index = self._makeOne()
+        self._populate(index)
+        index.reset()
+        self.assertEqual(len(index._wids), 0)
+        index.index_doc(1, ('zope',))
+        self._checkVocabulary(index)
+
+    def test_build_vocabulary_converts_index(self):
+        self._vocabulary = False
+        index = self._makeOne()
+        self._populate(index)
+        index.build_vocabulary()
+        self._checkVocabulary(index)
+        self._search(index, 'cmf', self.IFSet([5]))
+        index.index_doc(5, ('cmf', 'FOX'))
+        self._search(index, 'FOX', self.IFSet([2, 5]))
+        self._checkVocabulary(index)
+
+    def test_drop_vocabulary(self):
+        index = self._makeOne()
+        self._populate(index)
+        index.drop_vocabulary()
+        self.assertEqual(index._wids, None)
+        self.assertEqual(list(index._rev_index[1]), ['CMF', 'Zope3', 'zope'])
+        index.index_doc(1, ('zope',))
+        self._search(index, 'CMF', self.IFSet())
+        index.drop_vocabulary()
+        self.assertEqual(list(index._rev_index[1]), ['zope'])
+
+class KeywordIndexVocabularyTests32(_VocabularyTestsBase,
+                                    _KeywordIndexTestsBase,
+                                    _ThirtyTwoBitBase,
+                                    _TestCaseBase,
+                                    unittest.TestCase):
+    pass
+
+class KeywordIndexVocabularyTests64(_VocabularyTestsBase,
+                                    _KeywordIndexTestsBase,
+                                    _SixtyFourBitBase,
+                                    _TestCaseBase,
+                                    unittest.TestCase):
+    pass
+
+class KeywordIndexConcurrencyTests(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.db = DB(FileStorage(self.tmpdir + '/Data.fs'))
+        self.addCleanup(self.db.close)
+
+    def _makeOne(self, **kw):
+        import transaction
+        from . import KeywordIndex
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        index = conn.root()['index'] = KeywordIndex(_identity, **kw)
+        index.index_doc(1, ['shared', 'one'])
+        tm.commit()
+        conn.close()
+
+    def _open(self):
+        import transaction
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+        return tm, conn.root()['index']
+
+    def test_concurrent_shared_keyword_commit(self):
+        self._makeOne()
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        index1.index_doc(2, ['shared', 'two'])
+        index2.index_doc(3, ['shared'])
+        tm1.commit()
+        tm2.commit()
+        tm1.begin()
+        self.assertEqual(list(index1._fwd_index['shared']), [1, 2, 3])
+        self.assertEqual(index1.top_keywords(2), [('shared', 3), ('one', 1)])
+
+    def test_concurrent_shared_keyword_with_count_index_conflict(self):
+        from ZODB.POSException import ConflictError
+        self._makeOne(count_index=True)
+        tm1, index1 = self._open()
+        tm2, index2 = self._open()
+        index1.index_doc(2, ['shared'])
+        index2.index_doc(3, ['shared'])
+        tm1.commit()
+        self.assertRaises(ConflictError, tm2.commit)
+
+def _identity(obj, default):
+    return obj
+
+class Test_postings_count_wins(unittest.TestCase):
+
+    def _callFUT(self, numwords, rlen, postings, per_doc):
+        from . import postings_count_wins
+        return postings_count_wins(numwords, rlen, postings, per_doc)
+
+    def test_small_result_set(self):
+        self.assertFalse(self._callFUT(1000, 100, 500000, 5))
+
+    def test_few_keywords_large_result_set(self):
+        self.assertTrue(self._callFUT(50, 100000, 500000, 5))
+
+    def test_many_keywords(self):
+        self.assertFalse(self._callFUT(100000, 10000, 500000, 5))
+
 class FrozenDict(dict):
     def _forbidden(self, *args, **kw):
         assert 0 # pragma: no cover
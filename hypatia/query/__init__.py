@@ -292,6 +292,53 @@ class NotAll(Comparator):
         return '%s not in all(%r)' % (self.index, self._value)
 
 
+class MinMatch(Comparator):
+    """Minimum should match query: at least ``min_match`` of the values.
+
+    CQE equivalent: none
+    """
+    operator = 'min match'
+
+    def __init__(self, index, value, min_match):
+        Comparator.__init__(self, index, value)
+        self.min_match = min_match
+
+    def _apply(self, names):
+        return self.index.applyMinMatch(
+            self._get_value(names), self._get_value(names, self.min_match))
+
+    def negate(self):
+        return NotMinMatch(self.index, self._value, self.min_match)
+
+    def __str__(self):
+        return '%s in min_match(%r, %r)' % (
+            self.index, self._value, self.min_match)
+
+    def __eq__(self, other):
+        return (Comparator.__eq__(self, other) and
+                self.min_match == other.min_match)
+
+
+class NotMinMatch(MinMatch):
+    """Not minimum should match query: fewer than ``min_match`` of the
+    values.
+
+    CQE equivalent: none
+    """
+    operator = 'not min match'
+
+    def _apply(self, names):
+        return self.index.applyNotMinMatch(
+            self._get_value(names), self._get_value(names, self.min_match))
+
+    def negate(self):
+        return MinMatch(self.index, self._value, self.min_match)
+
+    def __str__(self):
+        return '%s not in min_match(%r, %r)' % (
+            self.index, self._value, self.min_match)
+
+
 class _Range(Comparator, RichComparisonMixin):
 
     @classmethod
@@ -453,6 +453,73 @@ class TestNotAll(ComparatorTestBase):
         self.assertNotEqual(inst, Any('index', 'val'))
 
 
+class TestMinMatch(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from . import MinMatch
+        return MinMatch
+
+    def _makeOne(self, index, value, min_match):
+        return self._getTargetClass()(index, value, min_match)
+
+    def test_apply(self):
+        index = DummyIndex()
+        inst = self._makeOne(index, ['a', 'b'], 2)
+        result = inst._apply(None)
+        self.assertEqual(result, (['a', 'b'], 2))
+        self.assertEqual(index.min_match, (['a', 'b'], 2))
+
+    def test_apply_with_names(self):
+        from . import Name
+        index = DummyIndex()
+        inst = self._makeOne(index, [Name('foo'), 'b'], Name('count'))
+        result = inst._apply(names={'foo': 'a', 'count': 1})
+        self.assertEqual(result, (['a', 'b'], 1))
+
+    def test_to_str(self):
+        inst = self._makeOne('index', [1, 2, 3], 2)
+        self.assertEqual(str(inst), "index in min_match([1, 2, 3], 2)")
+
+    def test_negate(self):
+        from . import NotMinMatch
+        inst = self._makeOne('index', 'val', 2)
+        self.assertEqual(inst.negate(), NotMinMatch('index', 'val', 2))
+
+    def test_not_equal_with_other_min_match(self):
+        inst = self._makeOne('index', 'val', 2)
+        self.assertNotEqual(inst, self._makeOne('index', 'val', 3))
+
+
+class TestNotMinMatch(TestMinMatch):
+
+    def _getTargetClass(self):
+        from . import NotMinMatch
+        return NotMinMatch
+
+    def test_apply(self):
+        index = DummyIndex()
+        inst = self._makeOne(index, ['a', 'b'], 2)
+        result = inst._apply(None)
+        self.assertEqual(result, (['a', 'b'], 2))
+        self.assertEqual(index.not_min_match, (['a', 'b'], 2))
+
+    def test_apply_with_names(self):
+        from . import Name
+        index = DummyIndex()
+        inst = self._makeOne(index, [Name('foo'), 'b'], Name('count'))
+        result = inst._apply(names={'foo': 'a', 'count': 1})
+        self.assertEqual(result, (['a', 'b'], 1))
+
+    def test_to_str(self):
+        inst = self._makeOne('index', [1, 2, 3], 2)
+        self.assertEqual(str(inst), "index not in min_match([1, 2, 3], 2)")
+
+    def test_negate(self):
+        from . import MinMatch
+        inst = self._makeOne('index', 'val', 2)
+        self.assertEqual(inst.negate(), MinMatch('index', 'val', 2))
+
+
 class TestAny(ComparatorTestBase):
 
     def _getTargetClass(self):
@@ -1432,6 +1499,14 @@ class DummyIndex(object):
         self.all = value
         return value
 
+    def applyMinMatch(self, value, min_match):
+        self.min_match = (value, min_match)
+        return self.min_match
+
+    def applyNotMinMatch(self, value, min_match):
+        self.not_min_match = (value, min_match)
+        return self.not_min_match
+
     def applyInRange(self, start, end, start_exclusive, end_exclusive):
         self.range = (start, end, start_exclusive, end_exclusive)
         return self.range
@@ -1,4 +1,7 @@
+import heapq
 import itertools
+from operator import itemgetter
+
 import BTrees
 
 from persistent import Persistent
@@ -29,7 +32,7 @@ class ResultSet(object):
         return self.numids
 
     def sort(self, index, reverse=False, limit=None, sort_type=None,
-             raise_unsortable=True):
+             raise_unsortable=True, after=None):
         if sort_type is None:
             sort_type = self.sort_type
         
@@ -40,14 +43,50 @@ class ResultSet(object):
             ids = list(ids)
             self.ids = ids
 
+        kw = {}
+        if after is not None:
+            # only some indexes support cursors
+            kw['after'] = after
+
         ids = index.sort(
             self.ids,
             reverse=reverse,
             limit=limit,
             sort_type=sort_type,
             raise_unsortable=raise_unsortable,
+            **kw
             )
 
+        if after is not None:
+            # how many documents follow the cursor is only known once they
+            # have been sorted
+            ids = list(ids)
+            numids = len(ids)
+        else:
+            numids = self.numids
+            if limit:
+                numids = min(numids, limit)
+
+        return self.__class__(ids, numids, self.resolver, sort_type=STABLE)
+
+    def sort_by(self, sorts, limit=None, raise_unsortable=True):
+        if not sorts:
+            raise ValueError('sort_by requires at least one index')
+
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError('limit must be 1 or greater')
+
+        ids = self.ids
+
+        if not hasattr(ids, '__len__'):
+            ids = list(ids)
+            self.ids = ids
+
+        keys = [index.sort_key(reverse) for index, reverse in sorts]
+        ids = _sort_by(ids, keys, limit, raise_unsortable)
+
         numids = self.numids
 
         if limit:
@@ -107,6 +146,88 @@ class ResultSet(object):
         filtered_ids = [ x for x in self.ids if x in docids ]
         return self.__class__(filtered_ids, len(filtered_ids), self.resolver)
 
+def _sort_by(ids, keys, limit, raise_unsortable):
+    # the composite sort key of a docid is the tuple of its sort keys in
+    # each index; docids missing from any of the indexes can't be sorted
+    missing = []
+    decorated = []
+    for id_ in ids:
+        key = []
+        for get in keys:
+            k = get(id_, _marker)
+            if k is _marker:
+                missing.append(id_)
+                break
+            key.append(k)
+        else:
+            decorated.append((tuple(key), id_))
+
+    first = itemgetter(0)
+    if limit and limit < len(decorated):
+        decorated = heapq.nsmallest(limit, decorated, key=first)
+    else:
+        decorated.sort(key=first)
+
+    for key, id_ in decorated:
+        yield id_
+
+    if raise_unsortable and missing:
+        raise exc.Unsortable(missing)
+
+# intersection and intersection_count probe the larger set for each member
+# of the smaller one when the larger is at least this many times bigger
+PROBE_RATIO = 16
+
+def intersection(set1, set2, family=BTrees.family64, len1=None, len2=None):
+    """ Return the intersection of the docid sets ``set1`` and ``set2`` as
+    an IF set.
+
+    When one set is much smaller than the other (e.g. the docids of a rare
+    keyword and those of a very common one), each docid of the smaller set
+    is looked up in the larger one instead of merging both sets, so that the
+    cost depends on the size of the smaller set only.
+
+    ``len1`` and ``len2`` are the lengths of the sets when the caller knows
+    them already; the length of a TreeSet isn't stored, and computing it
+    loads all of its buckets.
+    """
+    if len1 is None:
+        len1 = len(set1)
+    if len2 is None:
+        len2 = len(set2)
+    if len1 > len2:
+        set1, set2 = set2, set1
+        len1, len2 = len2, len1
+    if not len1:
+        return family.IF.Set()
+    if len1 * PROBE_RATIO <= len2:
+        return family.IF.Set([docid for docid in set1 if docid in set2])
+    return family.IF.intersection(set1, set2)
+
+def intersection_count(set1, set2, family=BTrees.family64):
+    """ Return the number of docids in both of the docid sets ``set1`` and
+    ``set2``.
+
+    When one set is much smaller than the other, each docid of the smaller
+    set is looked up in the larger one, so that the intersection is counted
+    without being built.  Otherwise the intersection is built (in C), which
+    is then faster than looking docids up one by one.
+    """
+    len1 = len(set1)
+    len2 = len(set2)
+    if len1 > len2:
+        set1, set2 = set2, set1
+        len1, len2 = len2, len1
+    if not len1:
+        return 0
+    if len1 * PROBE_RATIO <= len2:
+        count = 0
+        for docid in set1:
+            if docid in set2:
+                count += 1
+        return count
+    return len(family.IF.intersection(set1, set2))
+
 class BaseIndexMixin(object):
     """ Mixin class for indexes that implements common behavior """
 
@@ -48,6 +48,32 @@ class TestResultSet(unittest.TestCase):
         self.assertEqual(index.reverse, True)
         self.assertEqual(index.limit, 1)
 
+    def test_sort_after(self):
+        from hypatia.field import FieldIndex
+        index = FieldIndex(lambda obj, default: obj)
+        for docid in range(1, 7):
+            index.index_doc(docid, docid % 3)
+        inst = self._makeOne(index.family.IF.Set(range(1, 7)), 6, None)
+        result = inst.sort(index, limit=2, after=(1, 1))
+        self.assertEqual(list(result.ids), [4, 2])
+        self.assertEqual(result.numids, 2)
+
+    def test_sort_after_len(self):
+        from hypatia.field import FieldIndex
+        index = FieldIndex(lambda obj, default: obj)
+        for docid in range(1, 11):
+            index.index_doc(docid, docid)
+        inst = self._makeOne(index.family.IF.Set(range(1, 11)), 10, None)
+        result = inst.sort(index, after=(7, 7))
+        self.assertEqual(list(result), [8, 9, 10])
+        self.assertEqual(len(result), 3)
+        result = inst.sort(index, limit=5, after=(7, 7))
+        self.assertEqual(list(result), [8, 9, 10])
+        self.assertEqual(len(result), 3)
+        result = inst.sort(index, limit=2, after=(3, 3))
+        self.assertEqual(list(result), [4, 5])
+        self.assertEqual(len(result), 2)
+
     def test_sort_generator(self):
         def mygen():
             yield 2
@@ -59,6 +85,73 @@ class TestResultSet(unittest.TestCase):
         self.assertEqual(result.ids, [1, 2, 3])
         self.assertEqual(result.numids, 3)
 
+    def test_sort_by(self):
+        from hypatia.interfaces import STABLE
+        inst = self._makeOne([1, 2, 3, 4], 4, None)
+        index1 = DummySortKeyIndex({1: 'b', 2: 'a', 3: 'b', 4: 'a'})
+        index2 = DummySortKeyIndex({1: 1, 2: 2, 3: 3, 4: 4})
+        result = inst.sort_by([(index1, False), (index2, True)])
+        self.assertEqual(list(result.ids), [4, 2, 3, 1])
+        self.assertEqual(result.numids, 4)
+        self.assertEqual(result.sort_type, STABLE)
+        self.assertEqual(index1.reverse, False)
+        self.assertEqual(index2.reverse, True)
+
+    def test_sort_by_limit(self):
+        inst = self._makeOne([1, 2, 3, 4], 4, None)
+        index1 = DummySortKeyIndex({1: 'b', 2: 'a', 3: 'b', 4: 'a'})
+        index2 = DummySortKeyIndex({1: 1, 2: 2, 3: 3, 4: 4})
+        result = inst.sort_by([(index1, True), (index2, False)], limit=3)
+        self.assertEqual(list(result.ids), [1, 3, 2])
+        self.assertEqual(result.numids, 3)
+
+    def test_sort_by_stable(self):
+        inst = self._makeOne([3, 1, 4, 2], 4, None)
+        index = DummySortKeyIndex({1: 'b', 2: 'a', 3: 'b', 4: 'a'})
+        result = inst.sort_by([(index, False)], limit=3)
+        self.assertEqual(list(result.ids), [4, 2, 3])
+
+    def test_sort_by_generator(self):
+        def mygen():
+            yield 2
+            yield 1
+        inst = self._makeOne(mygen(), 2, None)
+        index = DummySortKeyIndex({1: 1, 2: 2})
+        result = inst.sort_by([(index, False)])
+        self.assertEqual(inst.ids, [2, 1])
+        self.assertEqual(list(result.ids), [1, 2])
+
+    def test_sort_by_missing(self):
+        from hypatia.exc import Unsortable
+        inst = self._makeOne([1, 2, 3], 3, None)
+        index1 = DummySortKeyIndex({1: 1, 2: 2, 3: 3})
+        index2 = DummySortKeyIndex({1: 1, 3: 3})
+        result = inst.sort_by([(index1, False), (index2, False)])
+        ids = []
+        try:
+            for id_ in result.ids:
+                ids.append(id_)
+        except Unsortable as e:
+            self.assertEqual(list(e.docids), [2])
+        else: # pragma: no cover
+            raise AssertionError('Unsortable not raised')
+        self.assertEqual(ids, [1, 3])
+
+    def test_sort_by_missing_raise_unsortable_false(self):
+        inst = self._makeOne([1, 2, 3], 3, None)
+        index = DummySortKeyIndex({1: 1, 3: 3})
+        result = inst.sort_by([(index, True)], raise_unsortable=False)
+        self.assertEqual(list(result.ids), [3, 1])
+
+    def test_sort_by_no_sorts(self):
+        inst = self._makeOne([1], 1, None)
+        self.assertRaises(ValueError, inst.sort_by, [])
+
+    def test_sort_by_bad_limit(self):
+        inst = self._makeOne([1], 1, None)
+        index = DummySortKeyIndex({1: 1})
+        self.assertRaises(ValueError, inst.sort_by, [(index, False)], 0)
+
     def test_second_sort_stable(self):
         from hypatia.interfaces import STABLE, OPTIMAL
         inst = self._makeOne([2, 1], 2, None)
@@ -368,6 +461,73 @@ class TestBaseIndexMixin(unittest.TestCase):
         index = self._makeIndex('abc')
         self.assertEqual(index.flush(), None)
 
+class Test_intersection_count(unittest.TestCase):
+
+    def _callFUT(self, set1, set2):
+        from . import intersection_count
+        return intersection_count(set1, set2)
+
+    def test_empty(self):
+        from BTrees.LFBTree import LFSet
+        self.assertEqual(self._callFUT(LFSet(), LFSet([1, 2])), 0)
+        self.assertEqual(self._callFUT(LFSet([1, 2]), LFSet()), 0)
+
+    def test_similar_sizes(self):
+        from BTrees.LFBTree import LFSet
+        self.assertEqual(
+            self._callFUT(LFSet(range(0, 100, 2)), LFSet(range(0, 100, 3))),
+            17)
+
+    def test_skewed_sizes(self):
+        from BTrees.LFBTree import LFSet
+        from BTrees.LFBTree import LFTreeSet
+        small = LFSet([3, 4, 5000, 20000])
+        large = LFTreeSet(range(0, 10000, 2))
+        self.assertEqual(self._callFUT(small, large), 2)
+        self.assertEqual(self._callFUT(large, small), 2)
+
+class Test_intersection(unittest.TestCase):
+
+    def _callFUT(self, set1, set2):
+        from . import intersection
+        return intersection(set1, set2)
+
+    def test_empty(self):
+        from BTrees.LFBTree import LFSet
+        self.assertEqual(list(self._callFUT(LFSet(), LFSet([1, 2]))), [])
+        self.assertEqual(list(self._callFUT(LFSet([1, 2]), LFSet())), [])
+
+    def test_similar_sizes(self):
+        from BTrees.LFBTree import LFSet
+        self.assertEqual(
+            list(self._callFUT(LFSet(range(0, 20, 2)), LFSet(range(0, 20, 3)))),
+            [0, 6, 12, 18])
+
+    def test_skewed_sizes(self):
+        from BTrees.LFBTree import LFSet
+        from BTrees.LFBTree import LFTreeSet
+        small = LFSet([3, 4, 5000, 20000])
+        large = LFTreeSet(range(0, 10000, 2))
+        self.assertEqual(list(self._callFUT(small, large)), [4, 5000])
+        self.assertEqual(list(self._callFUT(large, small)), [4, 5000])
+
+    def test_lengths_passed(self):
+        from BTrees.LFBTree import LFSet
+        from . import intersection
+        class Unsized(object):
+            def __init__(self, docids):
+                self.docids = set(docids)
+            def __contains__(self, docid):
+                return docid in self.docids
+            def __len__(self):
+                raise AssertionError('len() called')
+        small = LFSet([3, 4, 5000, 20000])
+        large = Unsized(range(0, 10000, 2))
+        self.assertEqual(list(intersection(small, large, len2=5000)),
+                         [4, 5000])
+        self.assertEqual(list(intersection(large, small, len1=5000)),
+                         [4, 5000])
+
 class RichComparisonMixinTest(unittest.TestCase):
 
     def setUp(self):
@@ -458,6 +618,31 @@ class RichComparer(RichComparisonMixin):
         return self.value < other.value
 
 
+class DummySortKeyIndex(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def sort_key(self, reverse=False):
+        self.reverse = reverse
+        def get(docid, default):
+            value = self.values.get(docid, default)
+            if reverse and value is not default:
+                return ReversedComparer(value)
+            return value
+        return get
+
+class ReversedComparer(RichComparisonMixin):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
 class DummyIndex(object):
 
     value = None
@@ -101,6 +101,7 @@ setup(name='hypatia',
       install_requires = install_requires,
       extras_require = {
         'benchmark': ['PyChart'],
+        'numpy': ['numpy'],
         'testing': testing_extras,
         'docs': docs_extras,
         },